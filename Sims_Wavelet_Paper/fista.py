@@ -21,7 +21,8 @@ def shrinkage(z, cutoff):
 			retvals[k] = z[k]+cutoff
 	return retvals
 
-def FISTA(x0, I_fnc, Phi_fnc, DPhi_fnc, cutoffmultiplier, alpha0=1.0, eta=0.5, N_iter=500, backtracking=True, c=1.0, showDetails=False):
+def FISTA(x0, I_fnc, Phi_fnc, DPhi_fnc, cutoffmultiplier, alpha0=1.0, eta=0.5, N_iter=500, backtracking=True, c=1.0, showDetails=False, PhiDPhi_fnc=None):
+	# PhiDPhi_fnc(x) (optional) returns Phi(x) and DPhi(x) together, e.g. lambda x: invProb.value_and_grad(x, includePrior=False)[1::2] (one forward and one adjoint solve)
 	start = time.time()
 	xk = np.zeros((N_iter, x0.size))
 	xk[0, :] = x0
@@ -39,15 +40,22 @@ def FISTA(x0, I_fnc, Phi_fnc, DPhi_fnc, cutoffmultiplier, alpha0=1.0, eta=0.5, N
 	# for running diagnostics:
 	num_backtrackings = np.zeros((N_iter,))
 	for k in range(N_iter):
-		DPhi = DPhi_fnc(yk[k, :])
+		if PhiDPhi_fnc is None:
+			DPhi = DPhi_fnc(yk[k, :])
+		else:
+			Phi_y, DPhi = PhiDPhi_fnc(yk[k, :])
 		if backtracking:
+			if PhiDPhi_fnc is None:
+				Phi_y = Phi_fnc(yk[k, :])
 			alpha = alpha0
 			proposal = shrinkage(yk[k, :] - alpha*DPhi, cutoffmultiplier*alpha)
+			Phi_proposal = Phi_fnc(proposal)
 			max_backtrack = 20;
 			#while I_fnc(proposal) > Phi_fnc(yk[k, :]) + np.dot(DPhi.T, proposal-yk[k, :]) + 1.0/(2.0*alpha*c)*np.dot((proposal-yk[k, :]).T, proposal-yk[k, :]) + I_fnc(proposal) - Phi_fnc(proposal): ## ALTERNATIVE
-			while np.isnan(Phi_fnc(proposal)) or Phi_fnc(proposal) > Phi_fnc(yk[k, :]) + np.dot(DPhi.T, proposal-yk[k, :]) + 1.0/(2.0*alpha*c)*np.dot((proposal-yk[k, :]).T, proposal-yk[k, :]): ## ALTERNATIVE
+			while np.isnan(Phi_proposal) or Phi_proposal > Phi_y + np.dot(DPhi.T, proposal-yk[k, :]) + 1.0/(2.0*alpha*c)*np.dot((proposal-yk[k, :]).T, proposal-yk[k, :]): ## ALTERNATIVE
 				alpha = alpha*eta
 				proposal = shrinkage(yk[k, :] - alpha*DPhi,  cutoffmultiplier*alpha)
+				Phi_proposal = Phi_fnc(proposal)
 				max_backtrack -= 1
 				num_backtrackings[k] += 1
 				if max_backtrack <= 0:
@@ -70,7 +78,8 @@ def FISTA(x0, I_fnc, Phi_fnc, DPhi_fnc, cutoffmultiplier, alpha0=1.0, eta=0.5, N
 		print("norm(u) = " + str(Is[-1] - Phis[-1]))
 	return result
 
-def gradDesc(x0, I_fnc, Phi_fnc, DPhi_fnc, DNormpart_fnc, alpha0=1.0, eta=0.5, N_iter=500, backtracking=True, c=1.0, showDetails=False):
+def gradDesc(x0, I_fnc, Phi_fnc, DPhi_fnc, DNormpart_fnc, alpha0=1.0, eta=0.5, N_iter=500, backtracking=True, c=1.0, showDetails=False, PhiDPhi_fnc=None):
+	# PhiDPhi_fnc(x) (optional) returns Phi(x) and DPhi(x) together, see FISTA
 	start = time.time()
 	xk = np.zeros((N_iter, x0.size))
 	xk[0, :] = x0
@@ -84,14 +93,19 @@ def gradDesc(x0, I_fnc, Phi_fnc, DPhi_fnc, DNormpart_fnc, alpha0=1.0, eta=0.5, N
 	
 	num_backtrackings = np.zeros((N_iter,))
 	for k in range(1, N_iter):
-		DPhi = DPhi_fnc(xk[k-1, :])
+		if PhiDPhi_fnc is None:
+			DPhi = DPhi_fnc(xk[k-1, :])
+		else:
+			Phis[k-1], DPhi = PhiDPhi_fnc(xk[k-1, :])
 		DNormpart = DNormpart_fnc(xk[k-1,:])
 		alpha = alpha0
 		proposal = xk[k-1, :] - alpha*(DPhi + DNormpart)
+		Phi_proposal = Phi_fnc(proposal)
 		max_backtrack = 20;
-		while np.isnan(Phi_fnc(proposal)) or Phi_fnc(proposal) >= Phi_fnc(xk[k-1,:]) or  Phi_fnc(proposal) > Phi_fnc(xk[k-1, :]) + np.dot(DPhi.T, proposal-xk[k-1, :]) + 1.0/(2.0*alpha*c)*np.dot((proposal-xk[k-1, :]).T, proposal-xk[k-1, :]): ## ALTERNATIVE
+		while np.isnan(Phi_proposal) or Phi_proposal >= Phis[k-1] or  Phi_proposal > Phis[k-1] + np.dot(DPhi.T, proposal-xk[k-1, :]) + 1.0/(2.0*alpha*c)*np.dot((proposal-xk[k-1, :]).T, proposal-xk[k-1, :]): ## ALTERNATIVE
 			alpha = alpha*eta
 			proposal = xk[k-1, :] - alpha*(DPhi + DNormpart)
+			Phi_proposal = Phi_fnc(proposal)
 			max_backtrack -= 1
 			num_backtrackings[k] += 1
 			if max_backtrack <= 0:
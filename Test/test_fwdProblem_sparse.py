@@ -0,0 +1,66 @@
+from __future__ import division
+import numpy as np
+import scipy.sparse.linalg as spsla
+import sys
+sys.path.append('..')
+import mapOnRectangle as mor
+from fwdProblem_sparse import *
+from sparseFEM import *
+from rectangle import *
+
+# checks of the sparse P1 backend against plain reference computations
+
+np.random.seed(1)
+rect = Rectangle((0,0), (1,1), resol=4)
+u_D = mor.mapOnRectangle(rect, "handle", lambda x, y: x + 0.5*y)
+f = mor.mapOnRectangle(rect, "handle", lambda x, y: np.sin(3*x) + 1.0)
+fwd = linEllipt2dRectangle_sparse(rect, f, u_D, rectangleSides("left", "right"))
+kvec = np.exp(np.random.normal(0, 1, (fwd.assembler.numDofs,)))
+coords, cells = fwd.coords, fwd.cells
+lin = coords[:, 0] - 2*coords[:, 1] + 0.3 # nodal values of a linear function
+
+# A(k) from the precomputed scatter equals the sum of the element matrices (with the cell mean of k)
+A_loop = np.zeros((fwd.assembler.numDofs, fwd.assembler.numDofs))
+for c in range(cells.shape[0]):
+	p = coords[cells[c], :]
+	B = np.array([[p[1,0]-p[0,0], p[2,0]-p[0,0]], [p[1,1]-p[0,1], p[2,1]-p[0,1]]])
+	G = np.linalg.solve(B.T, np.array([[-1.0, 1.0, 0.0], [-1.0, 0.0, 1.0]])) # gradients of the barycentric coordinates as columns
+	area = abs(np.linalg.det(B))/2
+	A_loop[np.ix_(cells[c], cells[c])] += np.mean(kvec[cells[c]])*area*G.T.dot(G)
+A = fwd.assembler.assemble(kvec)
+err_assemble = np.max(np.abs(A.toarray() - A_loop))
+print("assembly error: " + str(err_assemble))
+assert err_assemble < 1e-12
+
+# for constant k, linear functions are discrete harmonic (patch test)
+interior = np.nonzero(np.logical_and(np.all(coords > 1e-12, axis=1), np.all(coords < 1-1e-12, axis=1)))[0]
+err_patch = np.max(np.abs(fwd.assembler.assemble(np.ones_like(kvec)).dot(lin)[interior]))
+print("patch test: " + str(err_patch))
+assert err_patch < 1e-12
+
+# the factorized operator solves the same system as spsolve with the Dirichlet rows replaced by the identity
+y = fwd.solve(kvec, pureFenicsOutput=True)
+A_bc = A.tolil()
+b = fwd.fvec.copy()
+for d in fwd.dirichletDofs:
+	A_bc.rows[d] = [d]
+	A_bc.data[d] = [1.0]
+b[fwd.dirichletDofs] = fwd.dirichletValues
+y_ref = spsla.spsolve(A_bc.tocsc(), b)
+err_lu = np.max(np.abs(y - y_ref))/np.max(np.abs(y_ref))
+print("LU vs spsolve: " + str(err_lu))
+assert err_lu < 1e-10
+
+# multigrid preconditioned CG agrees with the direct solver up to its tolerance
+fwd_mg = linEllipt2dRectangle_sparse(rect, f, u_D, rectangleSides("left", "right"), solver="multigrid")
+y_mg = fwd_mg.solve(kvec, pureFenicsOutput=True)
+err_mg = np.max(np.abs(y_mg - y))/np.max(np.abs(y))
+print("multigrid vs direct: " + str(err_mg))
+assert err_mg < 1e-8
+
+# P1 interpolation observes linear functions exactly
+obspos = [np.random.uniform(0, 1, 20), np.random.uniform(0, 1, 20)]
+obsOp = observationOperator(fwd.assembler, obspos)
+err_obs = np.max(np.abs(obsOp.apply(lin) - (obspos[0] - 2*obspos[1] + 0.3)))
+print("observation of linear function: " + str(err_obs))
+assert err_obs < 1e-12
@@ -0,0 +1,47 @@
+from __future__ import division
+import numpy as np
+import sys 
+sys.path.append('..')
+import mapOnRectangle as mor
+from fwdProblem_sparse import *
+from invProblem2d import *
+from rectangle import *
+
+# regression check: BFGS with the adjoint gradient for a prior without normpartGradient (non-Gaussian Besov prior) 
+# uses I_forOpt/DI_adjoint_forOpt instead of the fused value_and_grad
+
+np.random.seed(1)
+rect = Rectangle((0,0), (1,1), resol=4)
+gamma = 0.01
+N_obs = 30
+
+u_D = mor.mapOnRectangle(rect, "handle", lambda x, y: 0*x)
+f = mor.mapOnRectangle(rect, "handle", lambda x, y: np.sin(3*x) + 1.0)
+fwd = linEllipt2dRectangle_sparse(rect, f, u_D, rectangleSides("left", "right"))
+m1 = GeneralizedGaussianWavelet2d(rect, 1, 1.0, 5)
+m2 = GeneralizedWavelet2d(rect, 1, 1.0, 5, p=1.1)
+invProb = inverseProblem(fwd, m2, gamma)
+invProb.obspos = [np.random.uniform(0.05, 0.95, N_obs), np.random.uniform(0.05, 0.95, N_obs)]
+
+uTruth = m1.sample()
+invProb.obs = invProb.Gfnc(uTruth) + np.random.normal(0, gamma, (N_obs,))
+
+u0 = mor.mapOnRectangle(rect, "wavelet", m2.mean)
+uOpt = invProb.find_uMAP(u0, nit=20, method='BFGS', adjoint=True)
+print("I(u0) = " + str(invProb.I(u0)) + ", I(uOpt) = " + str(invProb.I(uOpt)))
+assert invProb.I(uOpt) < invProb.I(u0)
+
+# Newton-CG needs normpartGradient and normpartHessian, so it rejects this prior before starting
+try:
+	invProb.find_uMAP(u0, nit=5, method='trust-ncg')
+	raise AssertionError("trust-ncg should reject GeneralizedWavelet2d")
+except ValueError as e:
+	print("trust-ncg: " + str(e))
+
+# the fused value_and_grad can't include the prior's gradient either (but the misfit part alone is fine)
+try:
+	invProb.value_and_grad(flatWavelet(u0.waveletcoeffs))
+	raise AssertionError("value_and_grad should reject GeneralizedWavelet2d")
+except ValueError as e:
+	print("value_and_grad: " + str(e))
+invProb.value_and_grad(flatWavelet(u0.waveletcoeffs), includePrior=False)
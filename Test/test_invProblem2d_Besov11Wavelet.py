@@ -0,0 +1,30 @@
+from __future__ import division
+import numpy as np
+import sys
+sys.path.append('..')
+import mapOnRectangle as mor
+from fwdProblem_sparse import *
+from invProblem2d import *
+from rectangle import *
+
+# regression check: DI_adjoint_vec_wavelet with a Besov11Wavelet prior adds the prior term kappa*4^((j-1)*s)*u (level j) to the adjoint gradient of Phi
+
+np.random.seed(4)
+rect = Rectangle((0,0), (1,1), resol=4)
+gamma = 0.01
+N_obs = 20
+
+f = mor.mapOnRectangle(rect, "handle", lambda x, y: np.sin(3*x) + 1.0)
+fwd = linEllipt2dRectangle_sparse(rect, f, 0.0, rectangleSides("left", "right"))
+prior = Besov11Wavelet(rect, 2.0, 1.5, 4)
+invProb = inverseProblem(fwd, prior, gamma)
+invProb.obspos = [np.random.uniform(0.05, 0.95, N_obs), np.random.uniform(0.05, 0.95, N_obs)]
+invProb.obs = invProb.Gfnc(prior.sample()) + np.random.normal(0, gamma, (N_obs,))
+
+u = prior.sample()
+wc = u.waveletcoeffs
+factors = [prior.kappa] + [prior.kappa*4**(j*prior.s) for j in range(len(wc)-1)]
+priorTerm = unpackWavelet([wc[0]*factors[0]] + [[wc[m][t]*factors[m] for t in range(3)] for m in range(1, len(wc))])
+err = np.max(np.abs(invProb.DI_adjoint_vec_wavelet(u) - invProb.DPhi_adjoint_vec_wavelet(u) - priorTerm))/np.max(np.abs(priorTerm))
+print("prior term of DI_adjoint_vec_wavelet: " + str(err))
+assert err < 1e-12
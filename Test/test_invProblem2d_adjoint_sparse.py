@@ -0,0 +1,88 @@
+from __future__ import division
+import numpy as np
+import sys
+sys.path.append('..')
+import mapOnRectangle as mor
+from fwdProblem_sparse import *
+from invProblem2d import *
+from rectangle import *
+
+# checks of the observations and adjoint derivatives of inverseProblem (against central finite differences and against each other)
+
+np.random.seed(2)
+rect = Rectangle((0,0), (1,1), resol=4)
+gamma = 0.01
+N_obs = 20
+eps = 1e-5
+
+u_D = mor.mapOnRectangle(rect, "handle", lambda x, y: 0*x)
+f = mor.mapOnRectangle(rect, "handle", lambda x, y: np.sin(3*x) + 1.0)
+fwd = linEllipt2dRectangle_sparse(rect, f, u_D, rectangleSides("left", "right"))
+obspos = [np.random.uniform(0.05, 0.95, N_obs), np.random.uniform(0.05, 0.95, N_obs)]
+
+def relErr(a, b):
+	return np.max(np.abs(a - b))/np.max(np.abs(b))
+
+cases = [(GeneralizedGaussianWavelet2d(rect, 1, 1.0, 4), lambda v: mor.mapOnRectangle(rect, "wavelet", packWavelet(v)), lambda ip, u: ip.DI_adjoint_vec_wavelet(u)),
+		(GaussianFourier2d(rect, np.zeros((7, 7)), 1.0, 1.0), lambda v: mor.mapOnRectangle(rect, "fourier", v.reshape((7, 7))), lambda ip, u: ip.DI_adjoint_vec_fourier(u))]
+
+for (prior, toMor, DI) in cases:
+	invProb = inverseProblem(fwd, prior, gamma)
+	invProb.obspos = obspos
+	u = prior.sample()
+	invProb.obs = invProb.Gfnc(prior.sample()) + np.random.normal(0, gamma, (N_obs,))
+	vec = flatWavelet(u.waveletcoeffs) if u.inittype == "wavelet" else u.fouriermodes.flatten()
+	n = vec.size
+	V = np.random.normal(0, 1, (n, 3))
+	W = np.random.normal(0, 1, (N_obs, 2))
+	print(prior.__class__.__name__ + " (" + str(n) + " parameters)")
+
+	# G(u) and Phi(u) don't depend on whether (and in which form) the forward solution Fu is passed
+	G = invProb.Gfnc(u)
+	err_G = max(relErr(invProb.Gfnc(u, Fu=invProb.Ffnc(u)), G), relErr(invProb.Gfnc(u, Fu=invProb.Ffnc(u, pureFenicsOutput=True)), G))
+	print("  Gfnc with and without Fu: " + str(err_G))
+	assert err_G == 0
+	assert invProb.Phi(u, Fu=invProb.Ffnc(u)) == invProb.Phi(u)
+
+	# adjoint gradient of I against central differences
+	fd = np.array([(invProb.I(toMor(vec + eps*V[:, j])) - invProb.I(toMor(vec - eps*V[:, j])))/(2*eps) for j in range(3)])
+	err_grad = relErr(V.T.dot(DI(invProb, u)), fd)
+	print("  gradient vs finite differences: " + str(err_grad))
+	assert err_grad < 1e-5
+
+	# tangent derivative against central differences of G, and duality <jvp(v), w> = <v, vjp(w)> of tangent and adjoint
+	JV = invProb.jvp(u, V)
+	fdG = np.stack([(invProb.Gfnc(toMor(vec + eps*V[:, j])) - invProb.Gfnc(toMor(vec - eps*V[:, j])))/(2*eps) for j in range(3)], axis=1)
+	err_jvp = relErr(JV, fdG)
+	print("  jvp vs finite differences: " + str(err_jvp))
+	assert err_jvp < 1e-5
+	err_dual = relErr(W.T.dot(JV), invProb.vjp(u, W).T.dot(V))
+	print("  <jvp(v), w> - <v, vjp(w)>: " + str(err_dual))
+	assert err_dual < 1e-10
+
+	# both modes of the dense Jacobian agree, and the primal gradients need one adjoint solve (with Fu given in any form)
+	err_jac = relErr(invProb.jacobian(u, mode="tangent"), invProb.jacobian(u, mode="adjoint"))
+	print("  jacobian tangent vs adjoint: " + str(err_jac))
+	assert err_jac < 1e-10
+	DI_primal = invProb.DI_vec_wavelet if u.inittype == "wavelet" else lambda u, Fu=None: invProb.DI_vec_fourier(u, invProb.obs, Fu=Fu)
+	numSolves = invProb.numSolves
+	grad_primal = DI_primal(u)
+	assert invProb.numSolves == numSolves + 1
+	err_primal = max(relErr(grad_primal, DI(invProb, u)), relErr(DI_primal(u, Fu=invProb.Ffnc(u)), grad_primal))
+	print("  primal vs adjoint gradient: " + str(err_primal))
+	assert err_primal < 1e-10
+
+	# Hessian of Phi: symmetric, the derivative of the adjoint gradient of Phi, and J^T J/gamma^2 in the Gauss-Newton case
+	HV = invProb.hessVecPhi(u, V)
+	M = V.T.dot(HV)
+	err_sym = np.max(np.abs(M - M.T))/np.max(np.abs(M))
+	print("  Hessian symmetry: " + str(err_sym))
+	assert err_sym < 1e-10
+	DPhi = lambda v: DI(invProb, toMor(v)) - invProb.prior.normpartGradient(toMor(v))
+	fdH = np.stack([(DPhi(vec + eps*V[:, j]) - DPhi(vec - eps*V[:, j]))/(2*eps) for j in range(3)], axis=1)
+	err_hess = relErr(HV, fdH)
+	print("  Hessian vs finite differences: " + str(err_hess))
+	assert err_hess < 1e-5
+	err_gn = relErr(V.T.dot(invProb.hessVecPhi(u, V, gaussNewton=True)), JV.T.dot(JV)/gamma**2)
+	print("  Gauss-Newton Hessian vs J^T J/gamma^2: " + str(err_gn))
+	assert err_gn < 1e-10
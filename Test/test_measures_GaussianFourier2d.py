@@ -0,0 +1,29 @@
+from __future__ import division
+import numpy as np
+import sys
+sys.path.append('..')
+from measures import *
+from rectangle import *
+import mapOnRectangle as mor
+
+# pins the norm of GaussianFourier2d: normpart(u) = 1/2*sum(m*modes^2) with the precision m = 1/eigenvals (1 for the constant mode),
+# i.e. the quadratic Cameron-Martin norm (before, the modes entered with the fourth power)
+
+rect = Rectangle((0,0), (1,1), resol=4)
+m = GaussianFourier2d(rect, np.zeros((3,3)), 1.0, 1.0) # all eigenvalues are 1/(1^2+1^2) = 0.5 except the constant mode
+evs = np.array(m.eigenvals)
+
+u = mor.mapOnRectangle(rect, "fourier", np.ones((3,3)))
+print("normpart(ones) = " + str(m.normpart(u)))
+assert abs(m.normpart(u) - 8.5) < 1e-12 # 1/2*(1 + 8*2)
+
+modes = np.arange(9.0).reshape((3,3))
+u = mor.mapOnRectangle(rect, "fourier", modes)
+print("normpart(arange) = " + str(m.normpart(u)))
+assert abs(m.normpart(u) - 1/2*(2*np.sum(modes**2))) < 1e-12 # the constant mode is 0 here
+assert abs(m.normpart(mor.mapOnRectangle(rect, "fourier", 2*modes)) - 4*m.normpart(u)) < 1e-10
+
+# gradient and Hessian diagonal of normpart, and no side effects on the eigenvalues
+assert np.allclose(m.normpartGradient(u), (m.precision()*modes).flatten())
+assert np.allclose(m.normpartHessian(u), m.precision().flatten())
+assert np.array_equal(m.eigenvals, evs)
@@ -0,0 +1,72 @@
+from __future__ import division
+import numpy as np
+import sys
+sys.path.append('..')
+import mapOnRectangle as mor
+from haarWavelet2d import *
+from rectangle import *
+
+# checks of the fast wavelet and fourier transforms against plain reference implementations
+
+np.random.seed(3)
+J = 5
+F = np.random.normal(0, 1, (6, 2**J, 2**J))
+
+# <synthesis(c), f> = <c, synthesis_adjoint(f)>
+c = np.random.normal(0, 1, (4**J,))
+lhs = np.sum(waveletsynthesis2d(packWavelet(c), resol=J)*F[0])
+rhs = np.dot(c, flatWavelet(waveletsynthesis2d_adjoint(F[0], J)))
+err_adjoint = abs(lhs - rhs)/abs(lhs)
+print("wavelet synthesis adjoint: " + str(err_adjoint))
+assert err_adjoint < 1e-12
+
+# evalmodesGrid_adjoint is the transpose of the evaluation with the basis tensor getPhiMat
+rect = Rectangle((0,0), (1,1), resol=J)
+for N in [3, 7, 11]:
+	u = mor.mapOnRectangle(rect, "fourier", np.random.normal(0, 1, (N, N)))
+	phi = u.getPhiMat()
+	D = mor.evalmodesGrid_adjoint(F[0], N)
+	D_ref = np.tensordot(F[0], phi, axes=([0, 1], [0, 1]))
+	err_fourier = np.max(np.abs(D - D_ref))/np.max(np.abs(D_ref))
+	print("evalmodesGrid_adjoint vs getPhiMat (N = " + str(N) + "): " + str(err_fourier))
+	assert err_fourier < 1e-12
+
+# the cascaded synthesis adds up the same Haar functions as the former loop over all coefficients, and inverts the analysis
+def synthesisByLoop(w, J):
+	f = np.zeros((2**J, 2**J)) + w[0]
+	for j in range(1, len(w)):
+		b = 2**(J-j) # half width of the level j wavelets
+		for k in range(2**(j-1)):
+			for l in range(2**(j-1)):
+				psi = np.zeros((2, 2, 2**J, 2**J)) # psi[r, s] is the indicator of quadrant (r, s) of the support
+				for r in range(2):
+					for s in range(2):
+						psi[r, s, (2*k+r)*b:(2*k+r+1)*b, (2*l+s)*b:(2*l+s+1)*b] = 2**(j-1)
+				f = f + w[j][0][k,l]*(psi[0,0] + psi[0,1] - psi[1,0] - psi[1,1]) + w[j][1][k,l]*(psi[0,0] - psi[0,1] + psi[1,0] - psi[1,1]) + w[j][2][k,l]*(psi[0,0] - psi[0,1] - psi[1,0] + psi[1,1])
+	return f
+for resol in [J, J+1]:
+	err_loop = np.max(np.abs(waveletsynthesis2d(packWavelet(c), resol=resol) - synthesisByLoop(packWavelet(c), resol)))
+	print("cascaded vs loop synthesis (resol = " + str(resol) + "): " + str(err_loop))
+	assert err_loop < 1e-12
+err_inverse = np.max(np.abs(waveletsynthesis2d(waveletanalysis2d(F[0])) - F[0]))
+print("synthesis(analysis(f)) - f: " + str(err_inverse))
+assert err_inverse < 1e-12
+
+# batched analysis and synthesis are the per-field transforms row by row
+C = waveletanalysis2d_batch(F)
+C_loop = np.stack([unpackWavelet(waveletanalysis2d(F[i])) for i in range(F.shape[0])])
+err_analysis = np.max(np.abs(C - C_loop))
+print("batched vs per-field analysis: " + str(err_analysis))
+assert err_analysis < 1e-12
+S = waveletsynthesis2d_batch(C, resol=J)
+S_loop = np.stack([waveletsynthesis2d(packWavelet(C[i]), resol=J) for i in range(C.shape[0])])
+err_synthesis = np.max(np.abs(S - S_loop))
+print("batched vs per-field synthesis: " + str(err_synthesis))
+assert err_synthesis < 1e-12
+
+# the separable evalmodesGrid agrees with the evaluation by the basis tensor getPhiMat
+for N in [3, 7, 11]:
+	u = mor.mapOnRectangle(rect, "fourier", np.random.normal(0, 1, (N, N)))
+	err_eval = np.max(np.abs(u.values - np.tensordot(u.getPhiMat(), u.fouriermodes, axes=([2, 3], [0, 1]))))
+	print("evalmodesGrid vs getPhiMat (N = " + str(N) + "): " + str(err_eval))
+	assert err_eval < 1e-12
@@ -0,0 +1,45 @@
+from __future__ import division
+import numpy as np
+import hashlib
+from collections import OrderedDict
+
+# Small caching utilities without dependencies on the rest of the package (meshes, solvers, fields), so every module can use them.
+
+def arrayKey(arr): # content hash of an array (with its shape), for caches keyed by numerical data
+	arr = np.ascontiguousarray(arr, dtype=np.float64)
+	return hashlib.sha1(arr.tobytes()).hexdigest() + str(arr.shape)
+
+class lruCache():
+	# bounded least recently used cache: get(k, build) returns the value stored under key(k) or builds, stores and returns it.
+	# key() is the identity, i.e. k must be hashable; subclasses override it for unhashable arguments (see arrayKey)
+	def __init__(self, maxsize=4):
+		self.maxsize = maxsize
+		self._store = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def key(self, k):
+		return k
+
+	def get(self, k, build): # returns the cached value for k or builds it with build() and stores it
+		if self.maxsize <= 0:
+			self.misses += 1
+			return build()
+		key = self.key(k)
+		if key in self._store:
+			self.hits += 1
+			val = self._store.pop(key)
+			self._store[key] = val # move to most recently used position
+			return val
+		self.misses += 1
+		val = build()
+		self._store[key] = val
+		while len(self._store) > self.maxsize:
+			self._store.popitem(last=False) # drop least recently used value
+		return val
+
+	def invalidate(self): # explicit invalidation, e.g. after changing the mesh or boundary conditions
+		self._store.clear()
+
+	def __len__(self):
+		return len(self._store)
@@ -8,7 +8,12 @@ from math import pi
 from rectangle import *
 import matplotlib.pyplot as plt
 import scipy
-from fenics import *
+from sparseFEM import *
+from fwdProblem_sparse import *
+try:
+	from fenics import *
+except ImportError: # without dolfin only the fenics-free backend linEllipt2dRectangle_sparse is usable
+	pass
 
 tol = 1E-14
 
@@ -72,94 +77,106 @@ def morToFenicsConverter(f, mesh, V): # redundant: corresponds to morToFenicsCon
 		raise Exception("make sure your function returns float values (i.e. no integers or anything else)")
 
 	fnc = Function(V)
-	fnc.vector().set_local(vals[dof_to_vertex_map(V)])
+	fnc.vector().set_local(vals[gridDofMaps(V)[2]])
 	return fnc
 
-def morToFenicsConverterHigherOrder(f, mesh, V, version="vals"):
-	#dof_coord_x = np.array([dof_coord_raw[2*k] for k in range(len(dof_coord_raw)//2)]).reshape((-1,1))
-	#dof_coord_y = np.array([dof_coord_raw[2*k+1] for k in range(len(dof_coord_raw)//2)]).reshape((-1,1))
-	#dof_coords = np.concatenate((dof_coord_x, dof_coord_y), axis=1)
-	#dof_coords = np.concatenate((dof_coord_raw[:,0], dof_coord_raw[:,1]), axis=1)
-	# compute function values on all degrees of freedom
-
-	
-	"""if f.inittype == "handle":
-		vals = f.handle(dof_coords[:, 0], dof_coords[:, 1])
-	else:"""
-	if version == "vals" or version == "wavelet":
-		# get coordinates of all degrees of freedom
+_gridDofMaps = sharedCache(16) # keyed by the id of the function space, emptied by clearMeshRegistry
+def gridDofMaps(V): # index arrays between the (N+1)x(N+1) vertex grid (ordered by y, then x) and the dofs of the P1 space V, computed once per function space
+	# returns (dofOfGridPoint, gridPointOfDof, dofToVertex): vec[dofOfGridPoint] are the grid values of a dof vector vec, gridvals.flatten()[gridPointOfDof] is the dof vector of grid values
+	def build():
 		dof_coord_raw = V.tabulate_dof_coordinates().reshape((-1,2))
-		ind = np.lexsort((dof_coord_raw[:,0], dof_coord_raw[:,1])) # maybe outsource this if this gets too much computation time
-		def invert_permutation(permutation):
-			return [i for i, j in sorted(enumerate(permutation), key=lambda j: j[1])]
-		ind_inv = invert_permutation(ind)
-		fvals = f.values
-		(N1,N2) = fvals.shape
-		vals = np.zeros((N1+1,N2+1)) # extend array to "right boundary": data is only given on 0, 1/N, ..., (N-1)/N and needs to be defined on 1 as well. This is done here
-		vals[0:N1, 0:N2] = fvals
-		vals[-1, 0:N2] = fvals[-1, :]
-		vals[0:N1, -1] = fvals[:, -1]
-		vals[-1,-1] = fvals[-1,-1]
-		vals = vals.flatten() # this is super risky!
-		vals = vals[ind_inv]
+		dofOfGridPoint = np.lexsort((dof_coord_raw[:,0], dof_coord_raw[:,1]))
+		gridPointOfDof = np.empty_like(dofOfGridPoint)
+		gridPointOfDof[dofOfGridPoint] = np.arange(len(dofOfGridPoint))
+		gridPointOfDof = gridPointOfDof[np.asarray(V.dofmap().dofs(), dtype=np.int64)] # kind of like dof_to_vertex_map
+		return (dofOfGridPoint, gridPointOfDof, dof_to_vertex_map(V))
+	return _gridDofMaps.get(V.id(), build)
+
+def gridValsToDofVector(fvals, V): # dof vector of grid values fvals on 0, 1/N, ..., (N-1)/N
+	# data is only given on 0, 1/N, ..., (N-1)/N and needs to be defined on 1 as well, so the last row/column is copied (extendGridValues)
+	return extendGridValues(fvals).flatten()[gridDofMaps(V)[1]]
 
-		# kind of like dof_to_vertex_map
-		dofs = V.dofmap().dofs()
-		fnc = Function(V)
-		fnc.vector().set_local(vals[dofs])
-		return fnc
+def dofVectorToGridVals(vec, V): # values of a dof vector on the (N+1)x(N+1) vertex grid
+	dofOfGridPoint = gridDofMaps(V)[0]
+	N1 = int(round(np.sqrt(len(dofOfGridPoint))))
+	return np.reshape(vec[dofOfGridPoint], (N1, N1))
+
+def morToFenicsConverterHigherOrder(f, mesh, V, version="vals"):
+	# converts a mapOnRectangle function to a fenics function on V, either from its grid values ("vals", "wavelet") or by evaluating its handle in the vertices ("handle")
+	if version == "vals" or version == "wavelet":
+		vals = gridValsToDofVector(f.values, V)
 	elif version == "handle":
 		coords = mesh.coordinates().T
-		vals = f.handle(coords[0, :], coords[1, :])
-		fnc = Function(V)
-		fnc.vector().set_local(vals[dof_to_vertex_map(V)])
-		return fnc		
+		vals = f.handle(coords[0, :], coords[1, :])[gridDofMaps(V)[2]]
 	else:
 		raise Exception("invalid option for parameter 'version' in morToFenicsConverterHigherOrder")
+	fnc = Function(V)
+	fnc.vector().set_local(vals)
+	return fnc
 
-class linEllipt2dRectangle():
-	# main class for the linear elliptical 2d problem on a rectangular domain
-	# can handle several kinds of PDE operations which are needed by higher-level classes
-	# in principle this should be the only class in the inverse problem setting that can "see" fenics functionality
-	# (unless for debugging or testing purposes)
-	def __init__(self, rect, f, u_D, boundary_D_boolean):
-		assert isinstance(rect, Rectangle)
-		self.rect = rect
-		self.mesh = RectangleMesh(Point(rect.x1,rect.y1), Point(rect.x2,rect.y2), 2**rect.resol, 2**rect.resol)
-		self.V = FunctionSpace(self.mesh, 'P', 1) # should be 4, I guess
-		
-		# if the forcing term and/or the dirichlet boundary data are not already in fenics type, convert
-				
-		if isinstance(f, mor.mapOnRectangle):
-			self.f = morToFenicsConverterHigherOrder(f, self.mesh, self.V, f.inittype)
-		else:
-			self.f = f
-		
-		if isinstance(u_D, mor.mapOnRectangle): # use "handle" version! converter in "expl" version only works on inner part of domain, but u_D is exclusively defined on boundary!
-			self.u_D = morToFenicsConverterHigherOrder(u_D, self.mesh, self.V, version="handle")
-		else:
-			self.u_D = u_D
-		
-		self.boundary_markers = MeshFunction("size_t", self.mesh, self.mesh.topology().dim() - 1)
+def sparseP1Assembler(mesh, V):
+	# fenics-free stiffness assembler for the P1 space V: vertex coordinates and cells are renumbered to dof numbering once
+	v2d = vertex_to_dof_map(V)
+	coords = np.zeros(mesh.coordinates().shape)
+	coords[v2d, :] = mesh.coordinates()
+	return P1StiffnessAssembler(coords, v2d[mesh.cells()])
 
-		# the following implements Dirichlet boundary conditions with value u_D on the boundary specified by boundary_D_boolean 
-		# (and the pre-implemented on_boundary functionality)
-		# the rest is assumed 0-Neumann
-		
-		class BoundaryDirichlet(SubDomain):
-			tol = 1E-14
-			def inside(self, x, on_boundary):
-				return on_boundary and boundary_D_boolean(x)
-		class BoundaryNeumann(SubDomain):
-			tol = 1E-14
-			def inside(self, x, on_boundary):
-				return on_boundary and not boundary_D_boolean(x)
+def meshFacetVertices(mesh): # (numFacets, 2) vertex indices of all facets of a 2d mesh in fenics' facet numbering
+	mesh.init(1, 0)
+	try:
+		return np.asarray(mesh.topology()(1, 0)(), dtype=np.int64).reshape((-1, 2))
+	except TypeError: # dolfin versions without access to the whole connectivity array
+		return np.array([fct.entities(0) for fct in facets(mesh)], dtype=np.int64)
 
+def markBoundary(mesh, boundary_markers, rect, boundary_D_boolean):
+	# marks Dirichlet facets with 1 and the remaining exterior facets with 2 (0-Neumann) and returns the Dirichlet vertices
+	# boundary_D_boolean is a vectorized specification (rectangleSides, boundaryPredicate) or a pointwise callback boundary_D_boolean(x)
+	N = 2**rect.resol
+	bFacets, isDirichlet = dirichletBoundary(rect.x1, rect.y1, rect.x2, rect.y2, N, N, boundary_D_boolean)
+	numVertices = (N+1)**2
+	fVertices = np.sort(meshFacetVertices(mesh), axis=1)
+	bSorted = np.sort(bFacets, axis=1)
+	fKeys = fVertices[:, 0]*numVertices + fVertices[:, 1]
+	marks = np.zeros((fVertices.shape[0],), dtype=np.int64)
+	marks[np.isin(fKeys, bSorted[:, 0]*numVertices + bSorted[:, 1])] = 2
+	marks[np.isin(fKeys, bSorted[isDirichlet, 0]*numVertices + bSorted[isDirichlet, 1])] = 1
+	boundary_markers.set_values(marks.tolist())
+	return np.unique(bFacets[isDirichlet, :].flatten())
 
-		bD = BoundaryDirichlet()
-		bD.mark(self.boundary_markers, 1)
-		bN = BoundaryNeumann()
-		bN.mark(self.boundary_markers, 2)
+def sharedDiscretization(rect, degree, boundary_D_boolean):
+	# mesh, function space, boundary markers, DOF maps, homogeneous bc and stiffness assembler for rect with the given Dirichlet boundary.
+	# These only depend on (rect, degree, boundary_D_boolean), so they are built once and shared by all forward problems (and all experiments
+	# of a hydraulic tomography problem), together with multigrid hierarchies and the cache of factorized operators A(k).
+	def build(shared):
+		shared.mesh = RectangleMesh(Point(rect.x1,rect.y1), Point(rect.x2,rect.y2), 2**rect.resol, 2**rect.resol)
+		shared.V = FunctionSpace(shared.mesh, 'P', degree)
+		shared.vertexToDof = vertex_to_dof_map(shared.V)
+		shared.dofToVertex = dof_to_vertex_map(shared.V)
+		shared.boundary_markers = MeshFunction("size_t", shared.mesh, shared.mesh.topology().dim() - 1)
+		# Dirichlet boundary with marker 1 as specified by boundary_D_boolean (either a pointwise callback boundary_D_boolean(x) 
+		# or a vectorized rectangleSides/boundaryPredicate), the rest is assumed 0-Neumann with marker 2
+		dirichletVertices = markBoundary(shared.mesh, shared.boundary_markers, rect, boundary_D_boolean)
+		shared.dirichletDofs = np.sort(shared.vertexToDof[dirichletVertices])
+		shared.bc0 = DirichletBC(shared.V, Constant(0), shared.boundary_markers, 1) # homogeneous version for adjoint and tangent problems
+		shared.assembler = sparseP1Assembler(shared.mesh, shared.V)
+	return meshRegistry(("fenics", rect.x1, rect.y1, rect.x2, rect.y2, rect.resol, degree, boundary_D_boolean), build)
+
+class fenicsP1Problem(sparseEllipticSolves):
+	# fenics side of linEllipt2dRectangle and linEllipt2dRectangle_hydrTom: shared P1 discretization, Dirichlet data and the conversions between 
+	# fenics functions, mapOnRectangles and dof vectors. All solves are done on dof vectors by sparseEllipticSolves
+	def initDiscretization(self, rect, boundary_D_boolean, operatorCacheSize):
+		assert isinstance(rect, Rectangle)
+		self.rect = rect
+		set_log_level(40) # once per instance instead of once per solve
+		self.shared = sharedDiscretization(rect, 1, boundary_D_boolean) # should be 4, I guess
+		self.mesh = self.shared.mesh
+		self.V = self.shared.V
+		self.operatorCacheSize = operatorCacheSize
+		self.v = TestFunction(self.V)
+		self._work = Function(self.V) # reused for interpolating fenics expressions
+	
+	def initBoundaryConditions(self, solver, warmStart, recycle): # Dirichlet data u_D on marker 1, 0-Neumann on marker 2, and the solver
+		self.boundary_markers = self.shared.boundary_markers
 
 		boundary_conditions = {1: {'Dirichlet': self.u_D}, 2: {'Neumann':   Constant(0.0)}}
 
@@ -169,122 +186,78 @@ class linEllipt2dRectangle():
 				bc = DirichletBC(self.V, boundary_conditions[i]['Dirichlet'], self.boundary_markers, i)
 				bcs.append(bc)
 		
-		self.bc = bcs				
-	
-	def solve(self, k, pureFenicsOutput=False):	# solves -div(k*nabla(y)) = f for y	with b.c. as specified in initialization
-		set_log_level(40)
-		if isinstance(k, mor.mapOnRectangle):
-			k = morToFenicsConverterHigherOrder(k, self.mesh, self.V)
-		
-		u = TrialFunction(self.V)
-		v = TestFunction(self.V)
-		L = self.f*v*dx		
-		a = k*dot(grad(u), grad(v))*dx
-		uSol = Function(self.V)
-		solve(a == L, uSol, self.bc)
-		if pureFenicsOutput == True:
-			return uSol
-		vals = np.reshape(uSol.compute_vertex_values(), (2**self.rect.resol+1, 2**self.rect.resol+1))
-		if pureFenicsOutput == "Both" or pureFenicsOutput == "both":
-			return uSol, mor.mapOnRectangle(self.rect, "expl", vals[0:-1,0:-1]) #cut vals to fit in rect grid
-		else:
-			return mor.mapOnRectangle(self.rect, "expl", vals[0:-1,0:-1]) #cut vals to fit in rect grid  
-	
-	def evalInnerProdListPhi(self, phis, u, v): # computes \int phi * nabla(u)*nabla(v) for all phi in phis
-		lst = []
-		if isinstance(u, mor.mapOnRectangle):
-			u = morToFenicsConverterHigherOrder(u, self.mesh, self.V)
-		if isinstance(v, mor.mapOnRectangle):
-			v = morToFenicsConverterHigherOrder(v, self.mesh, self.V)
-		for phi in phis:
-			if isinstance(phi, mor.mapOnRectangle):
-				phi = morToFenicsConverterHigherOrder(phi, self.mesh, self.V)			
-			lst.append(assemble(phi*dot(grad(u),grad(v))*dx))
-		return lst
+		self.bc = bcs
+		self.bc0 = self.shared.bc0
 		
+		# everything the sparse solves need which only depends on mesh and boundary is shared, source and boundary data are per instance
+		self.assembler = self.shared.assembler
+		self.dirichletDofs = self.shared.dirichletDofs
+		self.dirichletValues = self.dofVector(self.u_D)[self.dirichletDofs]
+		self.setSolver(solver, warmStart, recycle)
 	
-	def solveWithDiracRHS(self, k, ws, xs, pureFenicsOutput=False): # solves -div(k*nabla(y)) = sum_i w_i*dirac_{x_i} with homogenous bcs
-		set_log_level(40)
+	def dofVector(self, k): # nodal values of k in V (mapOnRectangles are converted, other fenics objects are interpolated)
+		if isinstance(k, np.ndarray): # already a dof vector
+			return k
 		if isinstance(k, mor.mapOnRectangle):
-			k = morToFenicsConverterHigherOrder(k, self.mesh, self.V)
-		u = TrialFunction(self.V)
-		v = TestFunction(self.V)
-		delta = []
-		for w, x in zip(ws, xs):
-			delta.append(PointSource(self.V, Point(x[0], x[1]), w))
-		
-		a = k*dot(grad(u), grad(v))*dx
-		L = Constant(0)*v*dx
-		A, b = assemble_system(a, L, DirichletBC(self.V, Constant(0), self.boundary_markers, 1))
-		for d in delta:
-			d.apply(b)
-		
-		uSol = Function(self.V)
-		solve(A, uSol.vector(), b)
-		if pureFenicsOutput:
-			return uSol
-		vals = np.reshape(uSol.compute_vertex_values(), (2**self.rect.resol+1, 2**self.rect.resol+1))
-		return mor.mapOnRectangle(self.rect, "expl", vals[0:-1,0:-1]) #cut vals to fit in rect grid 
-	
-	
+			return gridValsToDofVector(k.values, self.V) # same values as morToFenicsConverterHigherOrder, without a fenics function
+		if not isinstance(k, Function):
+			self._work.interpolate(k)
+			k = self._work
+		return k.vector().get_local()
 	
+	def vecToFunction(self, vec): # wraps a dof vector as a fenics function in V
+		uSol = Function(self.V)
+		uSol.vector().set_local(vec)
+		uSol.vector().apply("insert")
+		return uSol
 	
+	def gridToDofMatrix(self): # dofVector of "expl" mapOnRectangles as sparse (numDofs, N*N) matrix acting on flattened grid values (shared by all instances on the mesh)
+		if not hasattr(self.shared, "gridToDof"):
+			self.shared.gridToDof = extensionMatrix(2**self.rect.resol)[gridDofMaps(self.V)[1], :]
+		return self.shared.gridToDof
 	
+	def vecToMor(self, vec): # grid values of a dof vector as mapOnRectangle, without allocating a new fenics function
+		vals = dofVectorToGridVals(vec, self.V)
+		return mor.mapOnRectangle(self.rect, "expl", vals[0:-1,0:-1]) #cut vals to fit in rect grid
 	
+	def vecToGridVals(self, vec): # values of a dof vector on the (N+1)x(N+1) vertex grid
+		return dofVectorToGridVals(vec, self.V)
 	
+	def output(self, vec, pureFenicsOutput): # fenics function (True), mapOnRectangle (False) or both ("both") for a dof vector
+		if pureFenicsOutput == True:
+			return self.vecToFunction(vec)
+		if pureFenicsOutput == "Both" or pureFenicsOutput == "both":
+			return self.vecToFunction(vec), self.vecToMor(vec)
+		return self.vecToMor(vec)
 	
-	def evalInnerProd(self, k, u, v): # evaluate \int k * nabla(u)*nabla(v) over Omega
-		return assemble(k*dot(grad(u),grad(v))*dx)
+class linEllipt2dRectangle(fenicsP1Problem):
+	# main class for the linear elliptical 2d problem on a rectangular domain
+	# can handle several kinds of PDE operations which are needed by higher-level classes
+	# in principle this should be the only class in the inverse problem setting that can "see" fenics functionality
+	# (unless for debugging or testing purposes)
+	def __init__(self, rect, f, u_D, boundary_D_boolean, operatorCacheSize=4, solver="direct", warmStart=False, recycle=0):
+		self.initDiscretization(rect, boundary_D_boolean, operatorCacheSize)
 		
-	def solveWithHminus1RHS(self, k, k1, y, pureFenicsOutput=False): # solves -div(k*nabla(y1)) = div(k1*nabla(y)) for y1		
-		if isinstance(k, mor.mapOnRectangle):
-			k = morToFenicsConverterHigherOrder(k, self.mesh, self.V)
-		if isinstance(k1, mor.mapOnRectangle):
-			k1 = morToFenicsConverterHigherOrder(k1, self.mesh, self.V)
-		if isinstance(y, mor.mapOnRectangle):
-			y = morToFenicsConverterHigherOrder(y, self.mesh, self.V)
-		set_log_level(40)
-		u = TrialFunction(self.V)
-		v = TestFunction(self.V)
-		#L = self.f*v*dx		
-		L = - k1*dot(grad(y),grad(v))*dx
-		a = k*dot(grad(u), grad(v))*dx
-		uSol = Function(self.V)
-		u_D_0 = Expression('0*x[0]', degree=2)
-		solve(a == L, uSol, DirichletBC(self.V, Constant(0), self.boundary_markers, 1))#DirichletBC(self.V, u_D_0, self.boundary_D))#
+		# if the forcing term and/or the dirichlet boundary data are not already in fenics type, convert
+				
+		if isinstance(f, mor.mapOnRectangle):
+			self.f = morToFenicsConverterHigherOrder(f, self.mesh, self.V, f.inittype)
+		else:
+			self.f = f
 		
-		if pureFenicsOutput:
-			return uSol
-		vals = np.reshape(uSol.compute_vertex_values(), (2**self.rect.resol+1, 2**self.rect.resol+1))
-		return mor.mapOnRectangle(self.rect, "expl", vals[0:-1,0:-1])
-	
-	def solveWithHminus1RHS_variant(self, k, k1, y1, k2, y2): # solves -div(k*nabla(y22)) = div(k1*nabla(y2) + k2*nabla(y1)) for y22	
-		if isinstance(k, mor.mapOnRectangle):
-			k = morToFenicsConverterHigherOrder(k, self.mesh, self.V)
-		if isinstance(k1, mor.mapOnRectangle):
-			k1 = morToFenicsConverterHigherOrder(k1, self.mesh, self.V)
-		if isinstance(k2, mor.mapOnRectangle):
-			k2 = morToFenicsConverterHigherOrder(k2, self.mesh, self.V)
-		set_log_level(40)
-		u = TrialFunction(self.V)
-		v = TestFunction(self.V)
-		#L = self.f*v*dx		
-		L = - (k1*dot(grad(y2),grad(v)) + k2*dot(grad(y1),grad(v)))*dx
-		a = k*dot(grad(u), grad(v))*dx
-		uSol = Function(self.V)
-		u_D_0 = Expression('0*x[0]', degree=2)
-		solve(a == L, uSol, DirichletBC(self.V, Constant(0), self.boundary_markers, 1))#DirichletBC(self.V, u_D_0, self.boundary_D))
-		vals = np.reshape(uSol.compute_vertex_values(), (2**self.rect.resol+1, 2**self.rect.resol+1))
-		return mor.mapOnRectangle(self.rect, "expl", vals[0:-1,0:-1])
+		if isinstance(u_D, mor.mapOnRectangle): # use "handle" version! converter in "expl" version only works on inner part of domain, but u_D is exclusively defined on boundary!
+			self.u_D = morToFenicsConverterHigherOrder(u_D, self.mesh, self.V, version="handle")
+		else:
+			self.u_D = u_D
 		
-class linEllipt2dRectangle_hydrTom():
+		self.initBoundaryConditions(solver, warmStart, recycle)
+		self.fvec = assemble(self.f*self.v*dx).get_local()
+	
+class linEllipt2dRectangle_hydrTom(fenicsP1Problem):
 	# main class for the linear elliptical 2d hydraulic tomography problem on a rectangular domain
 	# is essentially just a list of linEllipt2dRectangle classes (all the same rectangle, permeability and boundary conditions, just source term varies)
-	def __init__(self, rect, fs, u_D, boundary_D_boolean):
-		assert isinstance(rect, Rectangle)
-		self.rect = rect
-		self.mesh = RectangleMesh(Point(rect.x1,rect.y1), Point(rect.x2,rect.y2), 2**rect.resol, 2**rect.resol)
-		self.V = FunctionSpace(self.mesh, 'P', 1) # should be 4, I guess
+	def __init__(self, rect, fs, u_D, boundary_D_boolean, operatorCacheSize=4, solver="direct", warmStart=False, recycle=0):
+		self.initDiscretization(rect, boundary_D_boolean, operatorCacheSize)
 		
 		# if the forcing term and/or the dirichlet boundary data are not already in fenics type, convert
 		self.fs = []
@@ -299,145 +272,19 @@ class linEllipt2dRectangle_hydrTom():
 		else:
 			self.u_D = u_D
 		
-		self.boundary_markers = FacetFunction("size_t", self.mesh)
-
-		# the following implements Dirichlet boundary conditions with value u_D on the boundary specified by boundary_D_boolean 
-		# (and the pre-implemented on_boundary functionality)
-		# the rest is assumed 0-Neumann
-		
-		class BoundaryDirichlet(SubDomain):
-			tol = 1E-14
-			def inside(self, x, on_boundary):
-				return on_boundary and boundary_D_boolean(x)
-		class BoundaryNeumann(SubDomain):
-			tol = 1E-14
-			def inside(self, x, on_boundary):
-				return on_boundary and not boundary_D_boolean(x)
-
-
-		bD = BoundaryDirichlet()
-		bD.mark(self.boundary_markers, 1)
-		bN = BoundaryNeumann()
-		bN.mark(self.boundary_markers, 2)
-
-		boundary_conditions = {1: {'Dirichlet': self.u_D}, 2: {'Neumann':   Constant(0.0)}}
-
-		bcs = []
-		for i in boundary_conditions:
-			if 'Dirichlet' in boundary_conditions[i]:
-				bc = DirichletBC(self.V, boundary_conditions[i]['Dirichlet'], self.boundary_markers, i)
-				bcs.append(bc)
-		
-		self.bc = bcs				
+		self.initBoundaryConditions(solver, warmStart, recycle)
+		self.fvecs = [assemble(f*self.v*dx).get_local() for f in self.fs]
 	
 	def solve(self, k, pureFenicsOutput=False):	# solves -div(k*nabla(y)) = f for y	with b.c. as specified in initialization
-		set_log_level(40)
-		if isinstance(k, mor.mapOnRectangle):
-			k = morToFenicsConverterHigherOrder(k, self.mesh, self.V)
-		uSolList = []
-		for f in self.fs:
-			u = TrialFunction(self.V)
-			v = TestFunction(self.V)
-			L = f*v*dx		
-			a = k*dot(grad(u), grad(v))*dx
-			uSol = Function(self.V)
-			solve(a == L, uSol, self.bc)
-			uSolList.append(uSol)
+		yList = [self.solveVec(k, fvec, self.dirichletValues, warmStartKey="state"+str(m)) for m, fvec in enumerate(self.fvecs)] # all source terms share one factorization of A(k)
 		if pureFenicsOutput == True:
-			return uSolList
-		valsList = [np.reshape(uSol.compute_vertex_values(), (2**self.rect.resol+1, 2**self.rect.resol+1)) for uSol in uSolList]
-		fnclist = [mor.mapOnRectangle(self.rect, "expl", vals[0:-1,0:-1]) for vals in valsList] #cut vals to fit in rect grid  
+			return [self.vecToFunction(y) for y in yList]
+		fnclist = [self.vecToMor(y) for y in yList]
 		if pureFenicsOutput == "Both" or pureFenicsOutput == "both":
-			return uSolList, fnclist 
+			return [self.vecToFunction(y) for y in yList], fnclist 
 		else:
 			return fnclist 
 	
-	def evalInnerProdListPhi(self, phis, u, v): # computes \int phi * nabla(u)*nabla(v) for all phi in phis
-		lst = []
-		if isinstance(u, mor.mapOnRectangle):
-			u = morToFenicsConverterHigherOrder(u, self.mesh, self.V)
-		if isinstance(v, mor.mapOnRectangle):
-			v = morToFenicsConverterHigherOrder(v, self.mesh, self.V)
-		for phi in phis:
-			if isinstance(phi, mor.mapOnRectangle):
-				phi = morToFenicsConverterHigherOrder(phi, self.mesh, self.V)			
-			lst.append(assemble(phi*dot(grad(u),grad(v))*dx))
-		return lst
-		
-	
-	def solveWithDiracRHS(self, k, ws, xs, pureFenicsOutput=False): # solves -div(k*nabla(y)) = sum_i w_i*dirac_{x_i} with homogenous bcs
-		set_log_level(40)
-		if isinstance(k, mor.mapOnRectangle):
-			k = morToFenicsConverterHigherOrder(k, self.mesh, self.V)
-		u = TrialFunction(self.V)
-		v = TestFunction(self.V)
-		delta = []
-		for w, x in zip(ws, xs):
-			delta.append(PointSource(self.V, Point(x[0], x[1]), w))
-		
-		a = k*dot(grad(u), grad(v))*dx
-		L = Constant(0)*v*dx
-		A, b = assemble_system(a, L, DirichletBC(self.V, Constant(0), self.boundary_markers, 1))
-		for d in delta:
-			d.apply(b)
-		
-		uSol = Function(self.V)
-		solve(A, uSol.vector(), b)
-		if pureFenicsOutput:
-			return uSol
-		vals = np.reshape(uSol.compute_vertex_values(), (2**self.rect.resol+1, 2**self.rect.resol+1))
-		return mor.mapOnRectangle(self.rect, "expl", vals[0:-1,0:-1]) #cut vals to fit in rect grid 
-	
-	
-	
-	
-	
-	
-	
-	
-	def evalInnerProd(self, k, u, v): # evaluate \int k * nabla(u)*nabla(v) over Omega
-		return assemble(k*dot(grad(u),grad(v))*dx)
-		
-	def solveWithHminus1RHS(self, k, k1, y, pureFenicsOutput=False): # solves -div(k*nabla(y1)) = div(k1*nabla(y)) for y1		
-		if isinstance(k, mor.mapOnRectangle):
-			k = morToFenicsConverterHigherOrder(k, self.mesh, self.V)
-		if isinstance(k1, mor.mapOnRectangle):
-			k1 = morToFenicsConverterHigherOrder(k1, self.mesh, self.V)
-		if isinstance(y, mor.mapOnRectangle):
-			y = morToFenicsConverterHigherOrder(y, self.mesh, self.V)
-		set_log_level(40)
-		u = TrialFunction(self.V)
-		v = TestFunction(self.V)
-		#L = self.f*v*dx		
-		L = - k1*dot(grad(y),grad(v))*dx
-		a = k*dot(grad(u), grad(v))*dx
-		uSol = Function(self.V)
-		u_D_0 = Expression('0*x[0]', degree=2)
-		solve(a == L, uSol, DirichletBC(self.V, Constant(0), self.boundary_markers, 1))#DirichletBC(self.V, u_D_0, self.boundary_D))#
-		
-		if pureFenicsOutput:
-			return uSol
-		vals = np.reshape(uSol.compute_vertex_values(), (2**self.rect.resol+1, 2**self.rect.resol+1))
-		return mor.mapOnRectangle(self.rect, "expl", vals[0:-1,0:-1])
-	
-	def solveWithHminus1RHS_variant(self, k, k1, y1, k2, y2): # solves -div(k*nabla(y22)) = div(k1*nabla(y2) + k2*nabla(y1)) for y22	
-		if isinstance(k, mor.mapOnRectangle):
-			k = morToFenicsConverterHigherOrder(k, self.mesh, self.V)
-		if isinstance(k1, mor.mapOnRectangle):
-			k1 = morToFenicsConverterHigherOrder(k1, self.mesh, self.V)
-		if isinstance(k2, mor.mapOnRectangle):
-			k2 = morToFenicsConverterHigherOrder(k2, self.mesh, self.V)
-		set_log_level(40)
-		u = TrialFunction(self.V)
-		v = TestFunction(self.V)
-		#L = self.f*v*dx		
-		L = - (k1*dot(grad(y2),grad(v)) + k2*dot(grad(y1),grad(v)))*dx
-		a = k*dot(grad(u), grad(v))*dx
-		uSol = Function(self.V)
-		u_D_0 = Expression('0*x[0]', degree=2)
-		solve(a == L, uSol, DirichletBC(self.V, Constant(0), self.boundary_markers, 1))#DirichletBC(self.V, u_D_0, self.boundary_D))
-		vals = np.reshape(uSol.compute_vertex_values(), (2**self.rect.resol+1, 2**self.rect.resol+1))
-		return mor.mapOnRectangle(self.rect, "expl", vals[0:-1,0:-1])
 """class linEllipt2d(): # should be obsolete after linEllipt2dRectangle
 	# model: -(k*p')' = f, with p = u_D on the Dirichlet boundary and Neumann = 0 on the rest 
 	def __init__(self, f, u_D, boundaryD, resol=4, xresol=7):
@@ -0,0 +1,183 @@
+from __future__ import division
+import numpy as np
+import mapOnRectangle as mor
+from rectangle import *
+from sparseFEM import *
+
+# fenics-free backend for the linear elliptical 2d forward problem.
+# It uses the same P1 discretization and mesh numbering as linEllipt2dRectangle, but everything is assembled and solved with scipy.sparse,
+# so it can be used on machines without dolfin and is cheap to construct (e.g. in worker processes).
+
+def extendGridValues(fvals): # extends grid values on 0, 1/N, ..., (N-1)/N to the vertices 0, 1/N, ..., 1 by copying the last row/column (as morToFenicsConverterHigherOrder does)
+	(N1, N2) = fvals.shape
+	vals = np.zeros((N1+1, N2+1))
+	vals[0:N1, 0:N2] = fvals
+	vals[-1, 0:N2] = fvals[-1, :]
+	vals[0:N1, -1] = fvals[:, -1]
+	vals[-1, -1] = fvals[-1, -1]
+	return vals
+
+def foldGridValues(vals): # adjoint of extendGridValues: adds the last row/column of vertex values to the ones before
+	fvals = np.array(vals[0:-1, 0:-1])
+	fvals[-1, :] += vals[-1, 0:-1]
+	fvals[:, -1] += vals[0:-1, -1]
+	fvals[-1, -1] += vals[-1, -1]
+	return fvals
+
+def extensionMatrix(N): # sparse ((N+1)^2, N^2) matrix of extendGridValues acting on flattened N x N grid values
+	ind = np.minimum(np.arange(N+1), N-1)
+	cols = (ind.reshape((-1, 1))*N + ind.reshape((1, -1))).flatten()
+	return sps.csr_matrix((np.ones(((N+1)**2,)), (np.arange((N+1)**2), cols)), shape=((N+1)**2, N*N))
+
+def sharedSparseDiscretization(rect, boundary_D_boolean):
+	# mesh, assembler and Dirichlet dofs for rect with the given Dirichlet boundary, built once and shared via meshRegistry
+	def build(shared):
+		N = 2**rect.resol
+		shared.coords, shared.cells = structuredRectangleMesh(rect.x1, rect.y1, rect.x2, rect.y2, N, N)
+		shared.assembler = P1StiffnessAssembler(shared.coords, shared.cells)
+		# like fenics' SubDomain.mark: a boundary facet is Dirichlet if both its vertices and its midpoint are, the rest is assumed 0-Neumann
+		# boundary_D_boolean is a pointwise callback boundary_D_boolean(x) or a vectorized rectangleSides/boundaryPredicate
+		facets, isDirichlet = dirichletBoundary(rect.x1, rect.y1, rect.x2, rect.y2, N, N, boundary_D_boolean)
+		shared.dirichletDofs = np.unique(facets[isDirichlet, :].flatten())
+	return meshRegistry(("sparse", rect.x1, rect.y1, rect.x2, rect.y2, rect.resol, 1, boundary_D_boolean), build)
+
+class sparseEllipticSolves():
+	# solves and derived quantities of -div(k*nabla(y)) = f on a P1 mesh that all backends share (linEllipt2dRectangle_sparse, and the fenics classes 
+	# linEllipt2dRectangle and linEllipt2dRectangle_hydrTom, which only use fenics for their function spaces and in- and output). 
+	# Everything works on dof vectors, a backend provides
+	#	dofVector(k): dof vector of k (mapOnRectangle, dof vector, or whatever the backend accepts)
+	#	output(vec, pureFenicsOutput): the backend's result type for a dof vector (see linEllipt2dRectangle.solve)
+	#	vecToMor(vec), vecToGridVals(vec): a dof vector as mapOnRectangle and as values on the (N+1)x(N+1) vertex grid
+	# and the attributes rect, shared (see meshRegistry), assembler, dirichletDofs, dirichletValues, fvec and operatorCacheSize
+	def setSolver(self, solver, warmStart=False, recycle=0, tol=1e-10): # "direct" (sparse LU) or "multigrid" (geometric multigrid preconditioned CG, for fine grids)
+		# warmStart: iterative state and adjoint solves start from the solution for the nearest previously seen k, recycle: size of the recycled subspace
+		# tol: relative residual for the iterative solver (warm starts pay off most for moderate tolerances)
+		if solver == "multigrid":
+			vertexOfDof = getattr(self.shared, "dofToVertex", None) # fenics numbers its dofs differently from the mesh vertices
+			self.multigrid = self.shared.multigridFor(tol, lambda: multigridHierarchy(self.rect.resol, self.dirichletDofs, vertexOfDof=vertexOfDof, tol=tol))
+		elif solver == "direct":
+			self.multigrid = None
+		else:
+			raise ValueError("solver must be 'direct' or 'multigrid'")
+		self.solver = solver
+		self.solutionHistory = solutionHistory(recycle=recycle) if (warmStart and solver == "multigrid") else None
+		self.operatorCache = self.shared.operatorCacheFor((solver, tol if solver == "multigrid" else None), self.operatorCacheSize) # shared with all forward problems on this mesh
+
+	def getOperator(self, k): # returns the (cached) factorized stiffness operator A(k) shared by all solves with permeability k
+		kvec = self.dofVector(k)
+		if self.multigrid is not None:
+			return self.operatorCache.get(kvec, lambda: multigridOperator(self.assembler.assemble(kvec), self.dirichletDofs, self.multigrid))
+		return self.operatorCache.get(kvec, lambda: kappaOperator(self.assembler.assemble(kvec), self.dirichletDofs))
+
+	def clearOperatorCache(self): # note that the cache is shared with all forward problems on the same mesh and boundary
+		self.operatorCache.invalidate()
+
+	def solveVec(self, k, b, dirichletValues=None, warmStartKey=None): # solves A(k) y = b (b given as dof vector) with y = dirichletValues (default 0) on the Dirichlet boundary, returns the dof vector of y
+		# warmStartKey names the kind of solve ("state", "adjoint") whose previous solutions may serve as initial guess
+		kvec = self.dofVector(k)
+		if warmStartKey is None or self.solutionHistory is None:
+			return self.getOperator(kvec).solve(b, dirichletValues)
+		y = self.getOperator(kvec).solve(b, dirichletValues, x0=self.solutionHistory.nearest(warmStartKey, kvec), basis=self.solutionHistory.basis(warmStartKey))
+		self.solutionHistory.record(self.multigrid.lastStats)
+		self.solutionHistory.store(warmStartKey, kvec, y)
+		return y
+
+	def solveWithOperator(self, k, b, dirichletValues=None, warmStartKey=None): # like solveVec, but returns y in the backend's pure output type (fenics function or dof vector)
+		return self.output(self.solveVec(k, b, dirichletValues, warmStartKey), True)
+
+	def solve(self, k, pureFenicsOutput=False):	# solves -div(k*nabla(y)) = f for y	with b.c. as specified in initialization
+		return self.output(self.solveVec(k, self.fvec, self.dirichletValues, warmStartKey="state"), pureFenicsOutput)
+
+	def evalInnerProdListPhi(self, phis, u, v): # computes \int phi * nabla(u)*nabla(v) for all phi in phis
+		weights = self.assembler.gradProdWeights(self.dofVector(u), self.dofVector(v)) # \int phi * nabla(u)*nabla(v) = phi . weights for P1 functions phi
+		return [np.dot(self.dofVector(phi), weights) for phi in phis]
+
+	def getObservationOperator(self, obspos): # sparse observation operator for the points obspos = [[x1,x2,...], [y1,y2,...]] on this mesh
+		return observationOperator(self.assembler, obspos)
+
+	def solveWithDiracRHS(self, k, ws, xs, pureFenicsOutput=False): # solves -div(k*nabla(y)) = sum_i w_i*dirac_{x_i} with homogenous bcs
+		# xs is a list of points or an observationOperator (whose transpose gives the right hand side without locating the points again)
+		if isinstance(xs, observationOperator):
+			b = xs.adjoint(ws)
+		else:
+			b = self.assembler.pointEvaluation(list(xs)).T.dot(np.asarray(ws, dtype=np.float64)) # same load vector as fenics' PointSource
+		return self.output(self.solveVec(k, b, warmStartKey="adjoint"), pureFenicsOutput)
+
+	def solveWithDiracRHSBlock(self, k, xs, pureFenicsOutput=False): # solves -div(k*nabla(y_i)) = dirac_{x_i} for all x_i in xs at once with homogenous bcs
+		# all right hand sides are the columns of one sparse matrix and share one factorization of A(k)
+		if isinstance(xs, observationOperator):
+			B = xs.sources()
+		else:
+			B = self.assembler.pointEvaluation(list(xs)).T.toarray()
+		Y = self.getOperator(k).solve(B)
+		return [self.output(Y[:, m], pureFenicsOutput) for m in range(Y.shape[1])]
+
+	def innerProdGridWeights(self, u, v): # grid values W with evalInnerProd(k, u, v) = sum(k.values*W) for every mapOnRectangle k (one pass over all cells)
+		weights = self.assembler.gradProdWeights(self.dofVector(u), self.dofVector(v))
+		return foldGridValues(self.vecToGridVals(weights))
+
+	def evalInnerProd(self, k, u, v): # evaluate \int k * nabla(u)*nabla(v) over Omega
+		return self.assembler.innerProd(self.dofVector(k), self.dofVector(u), self.dofVector(v))
+
+	def projectGradProd(self, k, u, v, pureFenicsOutput=False): # L2 projection of k * nabla(u)*nabla(v) onto the finite element space (same as fenics' project, which integrates exactly here)
+		return self.output(self.assembler.projectGradProd(self.dofVector(k), self.dofVector(u), self.dofVector(v)), pureFenicsOutput)
+
+	def solveWithHminus1RHS(self, k, k1, y, pureFenicsOutput=False): # solves -div(k*nabla(y1)) = div(k1*nabla(y)) for y1
+		b = -self.assembler.assemble(self.dofVector(k1)).dot(self.dofVector(y)) # weak form of div(k1*nabla(y)) is -A(k1) y
+		return self.output(self.solveVec(k, b), pureFenicsOutput)
+
+	def solveWithHminus1RHS_variant(self, k, k1, y1, k2, y2, pureFenicsOutput=False): # solves -div(k*nabla(y22)) = div(k1*nabla(y2) + k2*nabla(y1)) for y22
+		b = -(self.assembler.assemble(self.dofVector(k1)).dot(self.dofVector(y2)) + self.assembler.assemble(self.dofVector(k2)).dot(self.dofVector(y1)))
+		return self.output(self.solveVec(k, b), pureFenicsOutput)
+
+class linEllipt2dRectangle_sparse(sparseEllipticSolves):
+	# drop-in replacement for linEllipt2dRectangle without fenics: solves -div(k*nabla(y)) = f with y = u_D on the boundary part given by boundary_D_boolean, 0-Neumann elsewhere
+	# wherever linEllipt2dRectangle returns fenics functions (pureFenicsOutput), this class returns dof vectors instead. Dofs coincide with mesh vertices.
+	def __init__(self, rect, f, u_D, boundary_D_boolean, operatorCacheSize=4, solver="direct", warmStart=False, recycle=0):
+		assert isinstance(rect, Rectangle)
+		self.rect = rect
+		self.N = 2**rect.resol
+		self.shared = sharedSparseDiscretization(rect, boundary_D_boolean)
+		self.coords, self.cells = self.shared.coords, self.shared.cells
+		self.assembler = self.shared.assembler
+		self.operatorCacheSize = operatorCacheSize
+
+		if isinstance(f, mor.mapOnRectangle) and f.inittype == "handle":
+			self.f = self.dofVector(f, version="handle")
+		else:
+			self.f = self.dofVector(f)
+		self.u_D = self.dofVector(u_D, version="handle") # u_D lives on the boundary only, so don't use grid values
+		self.fvec = self.assembler.massMatrix().dot(self.f)
+		self.dirichletDofs = self.shared.dirichletDofs
+		self.dirichletValues = self.u_D[self.dirichletDofs]
+		self.setSolver(solver, warmStart, recycle)
+
+	def dofVector(self, k, version="vals"): # nodal values of k (mapOnRectangle, number, handle k(x,y) or dof vector)
+		if isinstance(k, mor.mapOnRectangle):
+			if version == "handle":
+				return np.zeros((self.assembler.numDofs,)) + k.handle(self.coords[:, 0], self.coords[:, 1])
+			return extendGridValues(k.values).flatten()
+		if np.isscalar(k):
+			return k*np.ones((self.assembler.numDofs,))
+		if callable(k):
+			return np.zeros((self.assembler.numDofs,)) + k(self.coords[:, 0], self.coords[:, 1])
+		return np.asarray(k, dtype=np.float64)
+
+	def gridToDofMatrix(self): # dofVector of "expl" mapOnRectangles as sparse (numDofs, N*N) matrix acting on flattened grid values (shared by all instances on the mesh)
+		if not hasattr(self.shared, "gridToDof"):
+			self.shared.gridToDof = extensionMatrix(self.N)
+		return self.shared.gridToDof
+	
+	def vecToMor(self, vec): # restricts a dof vector to the grid of self.rect
+		vals = np.reshape(vec, (self.N+1, self.N+1))
+		return mor.mapOnRectangle(self.rect, "expl", vals[0:-1,0:-1]) #cut vals to fit in rect grid
+
+	def vecToGridVals(self, vec): # values of a dof vector on the (N+1)x(N+1) vertex grid (dofs are the mesh vertices)
+		return np.reshape(vec, (self.N+1, self.N+1))
+
+	def output(self, vec, pureFenicsOutput): # same output conventions as linEllipt2dRectangle, with dof vectors in place of fenics functions
+		if pureFenicsOutput == True:
+			return vec
+		if pureFenicsOutput == "Both" or pureFenicsOutput == "both":
+			return vec, self.vecToMor(vec)
+		return self.vecToMor(vec)
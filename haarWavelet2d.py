@@ -31,7 +31,9 @@ def psi_scale2(x, n1, k1, n2, k2): #############################################
 	assert (x.shape[0] == 2), "must be of shape (2,N)"
 	return psi_scale(x[0,:], n1, k1)*psi_scale(x[1,:], n2, k2)
 
-def unpackWavelet(waco):
+def unpackWavelet(waco): # coefficient list -> vector [a0, h1, v1, d1, h2 (flattened), ...] (always a new array)
+	if isinstance(waco, waveletCoeffs) and waco.intact():
+		return np.array(waco.flat, dtype=np.float64)
 	J = len(waco)
 	unpacked = np.zeros((2**(2*(J-1)),)) ##### !!!!!
 	unpacked[0] = waco[0][0,0]
@@ -39,15 +41,51 @@ def unpackWavelet(waco):
 		unpacked[2**(2*j-2):2**(2*j)] = np.concatenate((waco[j][0].flatten(), waco[j][1].flatten(), waco[j][2].flatten()))
 	return unpacked
 
-def packWavelet(vector):
-	packed = [np.array([[vector[0]]])]
-	J = int(log10(len(vector))/(2*log10(2)))+1
-	for j in range(1, J):
-		temp1 = np.reshape(vector[2**(2*j-2):2**(2*j-1)], (2**(j-1), 2**(j-1)))
-		temp2 = np.reshape(vector[2**(2*j-1):2**(2*j-1)+2**(2*j-2)], (2**(j-1), 2**(j-1)))
-		temp3 = np.reshape(vector[2**(2*j-1)+2**(2*j-2):2**(2*j)], (2**(j-1), 2**(j-1)))
-		packed.append([temp1, temp2, temp3])
-	return packed
+def packWavelet(vector): # vector -> coefficient list whose arrays are views into vector (nothing is copied if vector is contiguous)
+	return waveletCoeffs(vector)
+
+def flatWavelet(waco): # like unpackWavelet, but returns the underlying vector of a waveletCoeffs without copying (read only!)
+	if isinstance(waco, waveletCoeffs) and waco.intact() and waco.flat.dtype == np.float64:
+		return waco.flat
+	return unpackWavelet(waco)
+
+def waveletLevels(J): # level of every entry of the unpacked coefficients with levels 0, ..., J (0 for a0, j for the entries 4^(j-1), ..., 4^j-1)
+	levels = np.zeros((4**J,), dtype=int)
+	for j in range(1, J+1):
+		levels[4**(j-1):4**j] = j
+	return levels
+
+class waveletCoeffs(list):
+	# coefficient list [a0, [h1, v1, d1], [h2, v2, d2], ...] backed by one contiguous vector flat in the order of unpackWavelet: 
+	# a0 and the orientations w[j][t] are zero-copy views into flat, so in-place changes of either are seen by the other. 
+	# Replacing items (w[j] = ..., w[j][t] = ...) or appending levels works like for a plain list, but detaches the list from flat (see intact)
+	def __init__(self, vector):
+		self.flat = np.ascontiguousarray(vector)
+		J = int(round(log(len(self.flat), 4)))
+		assert (len(self.flat) == 4**J), "number of coefficients must be a power of 4"
+		list.__init__(self, [self.flat[0:1].reshape((1, 1))])
+		for j in range(1, J+1):
+			s = 4**(j-1)
+			self.append([self.flat[(t+1)*s:(t+2)*s].reshape((2**(j-1), 2**(j-1))) for t in range(3)])
+		self.views = [self[0]] + [a for j in range(1, J+1) for a in self[j]]
+	
+	def intact(self): # True if all arrays of the list are still the views into flat
+		if len(self) != (len(self.views)+2)//3 or self[0] is not self.views[0]:
+			return False
+		for j in range(1, len(self)):
+			if len(self[j]) != 3 or any(self[j][t] is not self.views[3*j-2+t] for t in range(3)):
+				return False
+		return True
+	
+	def level(self, j): # the coefficients of level j (a0 for j = 0) as view into flat, in the order h, v, d
+		if j == 0:
+			return self.flat[0:1]
+		return self.flat[4**(j-1):4**j]
+	
+	def __reduce__(self): # pickle (and copy) through flat, so that the arrays are views again afterwards
+		if self.intact():
+			return (waveletCoeffs, (self.flat,))
+		return (list, (list(self),))
 
 def checkWhether2dWaveletCoeff(coeff):
 	# checks whether coeff is indeed a valid 2d wavelet coefficient list
@@ -160,77 +198,125 @@ def waveletsynthesis2d_old(w, resol=None):
 				f = f + w_hori[k,l]*psivec1 + w_vert[k, l]*psivec2 + w_diag[k,l]*psivec3
 	return f
 
+def synthesisCascade(w, levelScale): # block values after each level of the inverse Haar transform, level j adds levelScale(j)*(+-w[j][t]) to the four quadrants of every block
+	# the same floating point operations per grid point as adding up the psivecs one by one, but O(4^J) in total
+	# works on stacks of fields as well (leading axes of w[0] and w[j][t], see packWaveletBatch)
+	a = np.zeros((1, 1)) + w[0]
+	levels = [a]
+	for j in range(1, len(w)):
+		s = levelScale(j)
+		h, v, d = w[j][0]*s, w[j][1]*s, w[j][2]*s
+		n = a.shape[-1]
+		a_next = np.empty(a.shape[:-2] + (2*n, 2*n))
+		ap = a + h
+		am = a - h
+		q = a_next[..., 0::2, 0::2] # quadrants are written in place: a + h + v + d, a + h - v - d, a - h + v - d, a - h - v + d
+		np.add(ap, v, out=q)
+		q += d
+		q = a_next[..., 0::2, 1::2]
+		np.subtract(ap, v, out=q)
+		q -= d
+		q = a_next[..., 1::2, 0::2]
+		np.add(am, v, out=q)
+		q -= d
+		q = a_next[..., 1::2, 1::2]
+		np.subtract(am, v, out=q)
+		q += d
+		a = a_next
+		levels.append(a)
+	return levels
+
+def upsampleBlocks(a, J): # values of the 2^j x 2^j blocks a (last two axes) on the 2^J x 2^J grid
+	r = 2**J//a.shape[-1]
+	if r == 1:
+		return a
+	return np.repeat(np.repeat(a, r, axis=-2), r, axis=-1)
+
 def waveletsynthesis2d(w, resol=None):
 	if resol is None:
 		J = len(w) - 1
 	else:
 		J = max(resol, len(w) - 1)
-	f = np.zeros((2**J, 2**J))+ w[0]
-	for j in range(1, len(w)):
-		w_hori = w[j][0] # is quadratic
-		w_vert = w[j][1]
-		w_diag = w[j][2]
-		(maxK, maxL) = w_hori.shape
-		for k in range(maxK):
-			for l in range(maxL):
-				psivec1 = np.zeros((2**J, 2**J))
-				psivec1[2**(J-j+1)*k:2**(J-j+1)*k + 2**(J-j), 2**(J-j+1)*l:2**(J-j+1)*(l+1)] = 2**(j-1)
-				psivec1[2**(J-j+1)*k + 2**(J-j):2**(J-j+1)*(k+1), 2**(J-j+1)*l:2**(J-j+1)*(l+1)] = -2**(j-1)
-				psivec2 = np.zeros((2**J, 2**J))
-				psivec2[2**(J-j+1)*k:2**(J-j+1)*(k+1), 2**(J-j+1)*l:2**(J-j+1)*l + 2**(J-j)] = 2**(j-1)
-				psivec2[2**(J-j+1)*k:2**(J-j+1)*(k+1), 2**(J-j+1)*l + 2**(J-j):2**(J-j+1)*(l+1)] = -2**(j-1)
-				psivec3 = np.zeros((2**J, 2**J))
-				psivec3[2**(J-j+1)*k:2**(J-j+1)*k + 2**(J-j), 2**(J-j+1)*l:2**(J-j+1)*l + 2**(J-j)] = 2**(j-1)
-				psivec3[2**(J-j+1)*k + 2**(J-j):2**(J-j+1)*(k+1), 2**(J-j+1)*l:2**(J-j+1)*l + 2**(J-j)] = -2**(j-1)
-				psivec3[2**(J-j+1)*k:2**(J-j+1)*k + 2**(J-j), 2**(J-j+1)*l + 2**(J-j):2**(J-j+1)*(l+1)] = -2**(j-1)
-				psivec3[2**(J-j+1)*k + 2**(J-j):2**(J-j+1)*(k+1), 2**(J-j+1)*l + 2**(J-j):2**(J-j+1)*(l+1)] = 2**(j-1)
-				f = f + w_hori[k,l]*psivec1 + w_vert[k, l]*psivec2 + w_diag[k,l]*psivec3
-	return f
+	return upsampleBlocks(synthesisCascade(w, lambda j: 2**(j-1))[-1], J)
 
-def waveletanalysis2d(f):
-	a = [f]
-	d = [0]		
-	J = int(log(f.shape[0], 2))
+def waveletanalysis2d(f): # f can also be a stack of fields (n, 2^J, 2^J), then all coefficient arrays get the leading axis n
+	# the details are written straight into the views of a waveletCoeffs (or of the rows of an (n, 4^J) array for stacks)
+	J = int(log(f.shape[-1], 2))
+	if f.ndim == 2:
+		w = waveletCoeffs(np.empty((4**J,)))
+	else:
+		w = packWaveletBatch(np.empty((f.shape[0], 4**J)))
+	a_last = f
 	for j in range(J):
-		a_last = a[-1]
-		temp1 = (a_last[0::2, :] + a_last[1::2, :])/2
-		a.append((temp1[:, 0::2] + temp1[:, 1::2])/2)
+		temp1 = a_last[..., 0::2, :] + a_last[..., 1::2, :]
+		temp1 /= 2
+		a_next = temp1[..., :, 0::2] + temp1[..., :, 1::2]
+		a_next /= 2
 		
-		temp2 = (a_last[0::2, :] - a_last[1::2, :])/2
-		d1 = (temp2[:, 0::2] + temp2[:, 1::2])/(2**(J-j))
-		d2 = (temp1[:, 0::2] - temp1[:, 1::2])/(2**(J-j))
-		d3 = (temp2[:, 0::2] - temp2[:, 1::2])/(2**(J-j))
-		d.append([d1,d2,d3])
-	w = [a[-1]]
-	for j in range(J):
-		w.append(d[J-j])
+		temp2 = a_last[..., 0::2, :] - a_last[..., 1::2, :]
+		temp2 /= 2
+		d1, d2, d3 = w[J-j]
+		np.add(temp2[..., :, 0::2], temp2[..., :, 1::2], out=d1)
+		np.subtract(temp1[..., :, 0::2], temp1[..., :, 1::2], out=d2)
+		np.subtract(temp2[..., :, 0::2], temp2[..., :, 1::2], out=d3)
+		for d in (d1, d2, d3):
+			d /= 2**(J-j)
+		a_last = a_next
+	w[0][...] = a_last
+	return w
+
+# batched transforms: stacks of n fields (n, 2^J, 2^J) and their unpacked coefficients as rows of a (n, 4^J) array, in one vectorized pass
+def unpackWaveletBatch(w): # (n, 4^J) array of the coefficient list of a stack of fields (w[0] of shape (n,1,1), w[j][t] of shape (n,2^(j-1),2^(j-1)))
+	n = w[0].shape[0]
+	unpacked = np.empty((n, 4**(len(w)-1)))
+	unpacked[:, 0] = w[0].reshape((n,))
+	for j in range(1, len(w)):
+		s = 4**(j-1)
+		for t in range(3):
+			unpacked[:, (t+1)*s:(t+2)*s] = w[j][t].reshape((n, s))
+	return unpacked
+
+def packWaveletBatch(C): # coefficient list of a stack of fields as views into the rows of the (n, 4^J) array C (nothing is copied)
+	n = C.shape[0]
+	J = int(round(log(C.shape[1], 4)))
+	packed = [C[:, 0:1].reshape((n, 1, 1))]
+	for j in range(1, J+1):
+		s = 2**(j-1)
+		packed.append([C[:, (t+1)*s*s:(t+2)*s*s].reshape((n, s, s)) for t in range(3)])
+	return packed
+
+def waveletanalysis2d_batch(F): # row i is unpackWavelet(waveletanalysis2d(F[i])) for the fields F of shape (n, 2^J, 2^J)
+	return unpackWaveletBatch(waveletanalysis2d(np.asarray(F, dtype=np.float64)))
+
+def waveletsynthesis2d_batch(C, resol=None): # entry i is waveletsynthesis2d(packWavelet(C[i]), resol) for unpacked coefficients C of shape (n, 4^J)
+	w = packWaveletBatch(np.asarray(C, dtype=np.float64))
+	if resol is None:
+		J = len(w) - 1
+	else:
+		J = max(resol, len(w) - 1)
+	return upsampleBlocks(synthesisCascade(w, lambda j: 2**(j-1))[-1], J)
+
+def waveletsynthesis2d_adjoint(f, J):
+	# adjoint (transpose) of waveletsynthesis2d with J levels applied to the grid signal f: returns w with w[j][t][k,l] = sum(f*psivec_t) for the 
+	# wavelets psivec of waveletsynthesis2d (and w[0] = sum(f)), i.e. the derivative of sum(f*g) w.r.t. the coefficients of g. O(f.size) via block sums
+	K = int(log(f.shape[0], 2))
+	blocksums = [f] # blocksums[m] are the sums of f over blocks of size 2**m x 2**m
+	for m in range(K):
+		B = blocksums[-1]
+		blocksums.append(B[0::2, 0::2] + B[0::2, 1::2] + B[1::2, 0::2] + B[1::2, 1::2])
+	w = waveletCoeffs(np.empty((4**J,)))
+	w[0][0, 0] = np.sum(f)
+	for j in range(1, J+1):
+		Q = blocksums[K-j] # the four quadrants of the support of each level j wavelet
+		a, b, c, d = Q[0::2, 0::2], Q[0::2, 1::2], Q[1::2, 0::2], Q[1::2, 1::2]
+		w[j][0][...] = 2**(j-1)*(a+b-c-d)
+		w[j][1][...] = 2**(j-1)*(a-b+c-d)
+		w[j][2][...] = 2**(j-1)*(a-b-c+d)
 	return w
 
 def getApprox2d(w):
 	J = len(w) - 1
-	f = np.zeros((2**J, 2**J))+ w[0]
-	recon = [f]
-	for j in range(1, len(w)):
-		w_hori = w[j][0] # is quadratic
-		w_vert = w[j][1]
-		w_diag = w[j][2]
-		(maxK, maxL) = w_hori.shape
-		for k in range(maxK):
-			for l in range(maxL):
-				psivec1 = np.zeros((2**J, 2**J))
-				psivec1[2**(J-j+1)*k:2**(J-j+1)*k + 2**(J-j), 2**(J-j+1)*l:2**(J-j+1)*(l+1)] = 1
-				psivec1[2**(J-j+1)*k + 2**(J-j):2**(J-j+1)*(k+1), 2**(J-j+1)*l:2**(J-j+1)*(l+1)] = -1
-				psivec2 = np.zeros((2**J, 2**J))
-				psivec2[2**(J-j+1)*k:2**(J-j+1)*(k+1), 2**(J-j+1)*l:2**(J-j+1)*l + 2**(J-j)] = 1
-				psivec2[2**(J-j+1)*k:2**(J-j+1)*(k+1), 2**(J-j+1)*l + 2**(J-j):2**(J-j+1)*(l+1)] = -1
-				psivec3 = np.zeros((2**J, 2**J))
-				psivec3[2**(J-j+1)*k:2**(J-j+1)*k + 2**(J-j), 2**(J-j+1)*l:2**(J-j+1)*l + 2**(J-j)] = 1
-				psivec3[2**(J-j+1)*k + 2**(J-j):2**(J-j+1)*(k+1), 2**(J-j+1)*l:2**(J-j+1)*l + 2**(J-j)] = -1
-				psivec3[2**(J-j+1)*k:2**(J-j+1)*k + 2**(J-j), 2**(J-j+1)*l + 2**(J-j):2**(J-j+1)*(l+1)] = -1
-				psivec3[2**(J-j+1)*k + 2**(J-j):2**(J-j+1)*(k+1), 2**(J-j+1)*l + 2**(J-j):2**(J-j+1)*(l+1)] = 1
-				f = f + w_hori[k,l]*psivec1 + w_vert[k, l]*psivec2 + w_diag[k,l]*psivec3
-		recon.append(f)
-	return recon
+	return [upsampleBlocks(a, J) for a in synthesisCascade(w, lambda j: 1)]
 		
 		
 
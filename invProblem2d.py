@@ -6,12 +6,14 @@ import math
 from fwdProblem import *
 from measures import *
 from haarWavelet2d import *
+from caching import *
 #import mapOnInterval as moi
 #import mapOnInterval2d as moi2d
 import mapOnRectangle as mor
 import pickle
 import time, sys
 import scipy.optimize
+import scipy.sparse.linalg as spsla
 #from fenics import *
 
 def pickleData(ip, u, uOpt=None, filename="data_.pkl"):
@@ -48,8 +50,28 @@ def unpickleData(filename="data_.pkl"):
 	pkl_file = open(filename, 'rb')
 	return pickle.load(pkl_file)
 	
+def adjointSensitivity(fwd, u, Fu_, wtildeSol): # grid density s with -\int exp(u)*h*nabla(Fu).nabla(wtilde) = sum(s*h.values) for every direction h
+	# computed in one pass over all cells, so the adjoint gradient in any linear parametrization of h is a transform of s
+	return -np.exp(u.values)*fwd.innerProdGridWeights(Fu_, wtildeSol)
+
+def adjointGradientWavelet(fwd, u, Fu_, wtildeSol): # exact gradient -\int exp(u)*psi*nabla(Fu).nabla(wtilde) for all Haar wavelets psi of u's resolution at once
+	return flatWavelet(waveletsynthesis2d_adjoint(adjointSensitivity(fwd, u, Fu_, wtildeSol), len(u.waveletcoeffs)-1))
+
+class forwardSolutionCache(lruCache):
+	# bounded LRU cache of forward solutions, keyed by the forward problem and the content of the log-permeability's defining array (Fourier modes, 
+	# Haar coefficients or grid values). The entries keep their forward problem alive, so its id can't be reused by another one while they are cached
+	def key(self, fwdAndU):
+		fwd, u = fwdAndU
+		if u.inittype == "fourier":
+			coeffs = u.fouriermodes
+		elif u.inittype == "wavelet":
+			coeffs = flatWavelet(u.waveletcoeffs)
+		else:
+			coeffs = u.values
+		return str(id(fwd)) + u.inittype + str(u.rect.resol) + arrayKey(coeffs)
+
 class inverseProblem():
-	def __init__(self, fwd, prior, gamma, obspos=None, obs=None):
+	def __init__(self, fwd, prior, gamma, obspos=None, obs=None, stateCacheSize=8):
 		# need: type(fwd) == fwdProblem, type(prior) == measure
 		self.fwd = fwd
 		self.rect = fwd.rect
@@ -59,35 +81,58 @@ class inverseProblem():
 		self.gamma = gamma
 		self.resol = self.rect.resol
 		self.numSolves = 0
+		self._obsOp = None
+		self.stateCache = forwardSolutionCache(maxsize=stateCacheSize) # forward solutions (and their observations) of the last stateCacheSize log-permeabilities, see stateEntry
 	# Forward operators and their derivatives:	
-	def Ffnc(self, logkappa, pureFenicsOutput=False): # F is like forward, but uses logpermeability instead of permeability
-		# so: F maps logpermeability to solution of PDE (don't confuse with F in Sullivan's notation, which is the differential operator)
+	def kappafnc(self, logkappa): # permeability belonging to logkappa. All solves for the same logkappa must use this, so they share one cached factorization of the operator
 		if logkappa.inittype == "handle":
-			kappa = mor.mapOnRectangle(self.rect, "handle", lambda x,y: np.exp(logkappa.handle(x,y)))
+			return mor.mapOnRectangle(self.rect, "handle", lambda x,y: np.exp(logkappa.handle(x,y)))
 		else:
-			kappa = mor.mapOnRectangle(self.rect, "expl", np.exp(logkappa.values))
-		ret = self.fwd.solve(kappa, pureFenicsOutput=pureFenicsOutput)
-		self.numSolves += 1
-		
-		return ret
+			return mor.mapOnRectangle(self.rect, "expl", np.exp(logkappa.values))
 	
-	def DFfnc(self, logkappa, h, F_logkappa=None): # Frechet derivative of F in logkappa in direction h. FIXME: logkappa here, u further down
+	def Ffnc(self, logkappa, pureFenicsOutput=False): # F is like forward, but uses logpermeability instead of permeability
+		# so: F maps logpermeability to solution of PDE (don't confuse with F in Sullivan's notation, which is the differential operator)
+		if logkappa.inittype == "handle": # nothing to key the cache on
+			kappa = self.kappafnc(logkappa)
+			ret = self.fwd.solve(kappa, pureFenicsOutput=pureFenicsOutput)
+			self.numSolves += 1
+			return ret
+		return self.fwd.output(np.copy(self.stateEntry(logkappa)["state"]), pureFenicsOutput)
+	
+	def stateEntry(self, u): # cached dof vector of the forward solution of u ("state") and, once Gfnc has needed them, its observations ("obs" for the operator "obsOp")
+		# repeated evaluations of the same u (Phi, I, gradients, line searches, ...) share one forward solve. Hits and misses are counted in self.stateCache.hits/misses
+		def build():
+			self.numSolves += 1
+			return {"state": self.fwd.dofVector(self.fwd.solve(self.kappafnc(u), pureFenicsOutput=True)), "obsOp": None, "obs": None, "fwd": self.fwd}
+		return self.stateCache.get((self.fwd, u), build) # replacing self.fwd never returns the solutions of the old one
+	
+	def stateVector(self, u, Fu=None): # dof vector of the forward solution of u (read only), taken from Fu if that is the backend's pure output (fenics function or dof vector)
+		# a mapOnRectangle Fu only has the grid values (without the last row and column of the mesh), so the state of u is used instead (from the cache, see stateEntry)
+		if Fu is not None and not isinstance(Fu, mor.mapOnRectangle):
+			return self.fwd.dofVector(Fu)
+		if u.inittype == "handle":
+			return self.fwd.dofVector(self.Ffnc(u, pureFenicsOutput=True))
+		return self.stateEntry(u)["state"]
+	
+	def clearStateCache(self): # needed if the forward problem (e.g. its right hand side) is changed in place
+		self.stateCache.invalidate()
+	
+	def DFfnc(self, logkappa, h, F_logkappa=None, pureFenicsOutput=False): # Frechet derivative of F in logkappa in direction h. FIXME: logkappa here, u further down
 		if F_logkappa is None:
 			F_logkappa = self.Ffnc(logkappa, pureFenicsOutput=True)
+		kappa = self.kappafnc(logkappa)
 		if logkappa.inittype == "handle":
-			kappa = mor.mapOnRectangle(self.rect, "handle", lambda x,y: np.exp(logkappa.handle(x,y)))
 			kappa1 = mor.mapOnRectangle(self.rect, "handle", lambda x,y: np.exp(logkappa.handle(x,y))*h.handle(x,y))
 		else:
-			kappa = mor.mapOnRectangle(self.rect, "expl", np.exp(logkappa.values))
 			kappa1 = mor.mapOnRectangle(self.rect, "expl", np.exp(logkappa.values)*h.values)
 		
-		return self.fwd.solveWithHminus1RHS(kappa, kappa1, F_logkappa)
+		return self.fwd.solveWithHminus1RHS(kappa, kappa1, F_logkappa, pureFenicsOutput=pureFenicsOutput)
 	
-	def D2Ffnc(self, logkappa, h1, h2=None, F_logkappa=None): # second Frechet derivative of F in logkappa. FIXME: logkappa here, u further down
+	def D2Ffnc(self, logkappa, h1, h2=None, F_logkappa=None, pureFenicsOutput=False): # second Frechet derivative of F in logkappa. FIXME: logkappa here, u further down
 		if F_logkappa is None:
 			F_logkappa = self.Ffnc(logkappa, pureFenicsOutput=True)
 		
-		kappa = mor.mapOnRectangle(self.rect, "handle", lambda x,y: np.exp(logkappa.handle(x,y)))
+		kappa = self.kappafnc(logkappa)
 		kappa1 = mor.mapOnRectangle(self.rect, "handle", lambda x,y: np.exp(logkappa.handle(x,y))*h1.handle(x,y))
 		if h2 is None:
 			kappa2 = kappa1
@@ -98,43 +143,46 @@ class inverseProblem():
 		
 		y1prime = self.fwd.solveWithHminus1RHS(kappa, kappa1, F_logkappa, pureFenicsOutput=True)
 		y2prime = self.fwd.solveWithHminus1RHS(kappa, kappa2, F_logkappa, pureFenicsOutput=True)
-		y2primeprime = self.fwd.solveWithHminus1RHS(kappa, kappa12, F_logkappa)
-		y1primeprime = self.fwd.solveWithHminus1RHS_variant(kappa, kappa1, y1prime, kappa2, y2prime)
-		return y1primeprime+y2primeprime
+		y2primeprime = self.fwd.solveWithHminus1RHS(kappa, kappa12, F_logkappa, pureFenicsOutput=True)
+		y1primeprime = self.fwd.solveWithHminus1RHS_variant(kappa, kappa1, y1prime, kappa2, y2prime, pureFenicsOutput=True)
+		return self.fwd.output(self.fwd.dofVector(y1primeprime) + self.fwd.dofVector(y2primeprime), pureFenicsOutput)
+	
+	def observationOp(self, obspos=None): # sparse observation operator for obspos (default: self.obspos), only rebuilt when the observation positions change
+		if obspos is None:
+			obspos = self.obspos
+		if obspos is None:
+			raise ValueError("self.obspos need to be defined or obspos needs to be given")
+		if self._obsOp is None or not self._obsOp.matches(obspos):
+			self._obsOp = self.fwd.getObservationOperator(obspos)
+		return self._obsOp
 	
 	def Gfnc(self, u, Fu=None, obspos=None):
 		# this is the observation operator, i.e. G = Pi \circ F, where F is the solution operator and Pi is the projection onto obspos coordinates
+		# (obspos = [[x1,x2,x3,...], [y1,y2,y3,...]]). Pi is a sparse matrix acting on the FEM solution, see observationOp
 		if self.obspos is None and obspos is None:
 			raise ValueError("self.obspos need to be defined or obspos needs to be given")
-		if Fu is None:
-			p = self.Ffnc(u)
-		else:
-			p = Fu
-		if obspos is None:
-			obs = p.handle(self.obspos[0], self.obspos[1])
-		else:
-			obs = p.handle(obspos[0], obspos[1]) # assumes that obspos = [[x1,x2,x3,...], [y1,y2,y3,...]]
-		return obs
+		# a mapOnRectangle Fu is not observed itself (see stateVector), so G(u) doesn't depend on how (or whether) Fu is passed
+		if (Fu is None or isinstance(Fu, mor.mapOnRectangle)) and u.inittype != "handle":
+			entry = self.stateEntry(u)
+			obsOp = self.observationOp(obspos)
+			if entry["obsOp"] is not obsOp:
+				entry["obsOp"], entry["obs"] = obsOp, obsOp.apply(entry["state"])
+			return np.copy(entry["obs"])
+		return self.observationOp(obspos).apply(self.stateVector(u, Fu))
 		
 	def DGfnc(self, u, h, obspos=None):
 		# Frechet derivative of observation operator
 		if self.obspos == None and obspos is None:
 			raise ValueError("self.obspos need to be defined or obspos needs to be given")			
-		Dp = self.DFfnc(u, h)
-		if obspos is None:
-			return Dp.handle(self.obspos[0], self.obspos[1])
-		else:
-			return Dp.handle(obspos[0], obspos[1])
+		Dp = self.DFfnc(u, h, pureFenicsOutput=True)
+		return self.observationOp(obspos).apply(self.fwd.dofVector(Dp))
 		
 	def D2Gfnc(self, u, h1, h2=None, obspos=None):
 		# second Frechet derivative of observation operator
 		if self.obspos == None and obspos is None:
 			raise ValueError("self.obspos need to be defined or obspos needs to be given")	
-		D2p = self.D2Ffnc(u, h1, h2=h2)
-		if obspos is None:
-			return D2p.handle(self.obspos[0], self.obspos[1])
-		else:
-			return D2p.handle(obspos[0], obspos[1])
+		D2p = self.D2Ffnc(u, h1, h2=h2, pureFenicsOutput=True)
+		return self.observationOp(obspos).apply(self.fwd.dofVector(D2p))
 			
 	
 	def Phi(self, u, obs=None, obspos=None, Fu=None):
@@ -156,35 +204,20 @@ class inverseProblem():
 		return -1.0/(self.gamma**2)*np.dot(discrepancy, DG_of_u_h)		
 	
 	def DPhi_vec_wavelet(self, u, obs=None, obspos=None, Fu=None):
-		# gradient of energy functional (each row is one "wavelet direction")
-		numDir = unpackWavelet(u.waveletcoeffs).shape[0]
-		DPhivec = np.zeros((numDir,))
+		# gradient of energy functional (each row is one "wavelet direction"), DG(u)^T applied to the weighted discrepancy by one adjoint solve (see vjp)
 		if obs is None:
 			obs = self.obs
-		if Fu is None:
-			Fu = self.Ffnc(u)
-		for direction in range(numDir):
-			temp = np.zeros((numDir,))
-			temp[direction] = 1.0
-			h = mor.mapOnRectangle(self.rect, "wavelet", packWavelet(temp))
-			DPhivec[direction] = self.DPhi(u, h, obs, obspos=obspos, Fu=Fu)
-		return DPhivec
+		if u.inittype != "wavelet":
+			u = mor.mapOnRectangle(self.rect, "wavelet", u.waveletcoeffs)
+		discrepancy = obs-self.Gfnc(u, Fu=Fu, obspos=obspos)
+		return -1.0/(self.gamma**2)*self.vjp(u, discrepancy, Fu=Fu, obspos=obspos)
 	
 	def DPhi_vec_fourier(self, u, obs=None, obspos=None, Fu=None):
-		# gradient of energy functional (each row is one "wavelet direction")
-		numDir = (u.fouriermodes.flatten()).shape[0]
-		N = u.fouriermodes.shape[0]
-		DPhivec = np.zeros((numDir,))
+		# gradient of energy functional (each row is one "fourier direction"), DG(u)^T applied to the weighted discrepancy by one adjoint solve (see vjp)
 		if obs is None:
 			obs = self.obs
-		if Fu is None:
-			Fu = self.Ffnc(u)
-		for direction in range(numDir):
-			temp = np.zeros((numDir,))
-			temp[direction] = 1.0
-			h = mor.mapOnRectangle(self.rect, "fourier", temp.reshape((N,N)))
-			DPhivec[direction] = self.DPhi(u, h, obs, obspos=obspos, Fu=Fu)
-		return DPhivec
+		discrepancy = obs-self.Gfnc(u, Fu=Fu, obspos=obspos)
+		return -1.0/(self.gamma**2)*self.vjp(u, discrepancy, Fu=Fu, obspos=obspos)
 	
 	def D2Phi(self, u, h1, h2=None, obs=None, obspos=None, Fu=None):		
 		# 2nd Frechet derivative of misfit functional
@@ -212,58 +245,169 @@ class inverseProblem():
 		return DPhi_u_h + inner
 	
 	def DI_vec_wavelet(self, u, obs=None, obspos=None, Fu=None):
-		# gradient of energy functional (each row is one "wavelet direction")
-		numDir = unpackWavelet(u.waveletcoeffs).shape[0]
-		DIvec = np.zeros((numDir,))
-		if obs is None:
-			obs = self.obs
-		if Fu is None:
-			Fu = self.Ffnc(u)
+		# gradient of energy functional (each row is one "wavelet direction"), the misfit part by one adjoint solve (see DPhi_vec_wavelet)
+		DIvec = self.DPhi_vec_wavelet(u, obs, obspos=obspos, Fu=Fu)
+		if hasattr(self.prior, "normpartGradient"):
+			return DIvec + self.prior.normpartGradient(mor.mapOnRectangle(self.rect, "wavelet", u.waveletcoeffs))
+		numDir = DIvec.shape[0]
 		for direction in range(numDir):
 			temp = np.zeros((numDir,))
 			temp[direction] = 1
-			h = mor.mapOnRectangle(self.rect, "wavelet", packWavelet(temp))
-			DIvec[direction] = self.DI(u, h, obs, obspos=obspos, Fu=Fu)
+			DIvec[direction] += self.prior.covInnerProd(u, mor.mapOnRectangle(self.rect, "wavelet", packWavelet(temp)))
 		return DIvec
 	
+	# Matrix-free derivatives of G: directions and gradients are coefficient vectors in the parametrization of u 
+	# (unpacked wavelet coefficients or flattened fourier modes), blocks of them are the columns of a matrix
+	def numParams(self, u):
+		if u.inittype == "wavelet":
+			return 4**(len(u.waveletcoeffs)-1)
+		elif u.inittype == "fourier":
+			return u.fouriermodes.size
+		raise ValueError("u needs to be initialized by wavelet coefficients or fourier modes")
+	
+	def paramToGrid(self, u, v): # grid values of the direction with coefficient vector v
+		if u.inittype == "wavelet":
+			return waveletsynthesis2d(packWavelet(v), resol=self.resol)
+		elif u.inittype == "fourier":
+			return mor.mapOnRectangle(self.rect, "fourier", np.reshape(v, u.fouriermodes.shape)).values
+		raise ValueError("u needs to be initialized by wavelet coefficients or fourier modes")
+	
+	def gridToParam(self, u, s): # transpose of paramToGrid: derivative of sum(s*h.values) w.r.t. the coefficients of h
+		if u.inittype == "wavelet":
+			return flatWavelet(waveletsynthesis2d_adjoint(s, len(u.waveletcoeffs)-1))
+		elif u.inittype == "fourier":
+			return mor.evalmodesGrid_adjoint(s, u.fouriermodes.shape[0]).flatten()
+		raise ValueError("u needs to be initialized by wavelet coefficients or fourier modes")
+	
+	def linearization(self, u, Fu=None): # permeability, dof vector of the state (see stateVector) and exp(u) on the grid, i.e. everything derivatives in u share
+		return self.kappafnc(u), self.stateVector(u, Fu), np.exp(u.values)
+	
+	def paramToGridBlock(self, u, Vb): # flattened grid values of the directions in the columns of Vb as (N*N, m) array
+		if u.inittype == "wavelet":
+			return waveletsynthesis2d_batch(Vb.T, resol=self.resol).reshape((Vb.shape[1], -1)).T
+		return np.stack([self.paramToGrid(u, Vb[:, j]).flatten() for j in range(Vb.shape[1])], axis=1)
+	
+	def tangentRHS(self, expu, Hb, p): # right hand sides -A(exp(u)*h_j) p of the tangent problems for the flattened grid values h_j in the columns of Hb
+		# A(k) p is linear in k, so the whole block is one sparse product (no stiffness matrix per direction)
+		return -self.fwd.assembler.derivativeMatrix(p).dot(self.fwd.gridToDofMatrix()).dot(expu.reshape((-1, 1))*Hb)
+	
+	def jvp(self, u, V, Fu=None, obspos=None): # DG(u) V for one direction V (numParams,) or a block of directions (numParams, m), all tangent solves share one factorization of A(k)
+		V = np.asarray(V, dtype=np.float64)
+		Vb = V.reshape((V.shape[0], -1))
+		kappa, p, expu = self.linearization(u, Fu)
+		Y = self.fwd.getOperator(kappa).solve(self.tangentRHS(expu, self.paramToGridBlock(u, Vb), p))
+		self.numSolves += Vb.shape[1]
+		return self.observationOp(obspos).apply(Y).reshape((-1,) + V.shape[1:])
+	
+	def vjp(self, u, W, Fu=None, obspos=None): # DG(u)^T W for observation weights W (numObs,) or a block (numObs, m), all adjoint solves share one factorization of A(k)
+		W = np.asarray(W, dtype=np.float64)
+		Wb = W.reshape((W.shape[0], -1))
+		kappa, p, expu = self.linearization(u, Fu)
+		Wtilde = self.fwd.getOperator(kappa).solve(self.observationOp(obspos).adjoint(Wb)) # A(k) is symmetric
+		self.numSolves += Wb.shape[1]
+		G = np.stack([self.gridToParam(u, -expu*self.fwd.innerProdGridWeights(p, Wtilde[:, j])) for j in range(Wb.shape[1])], axis=1)
+		return G.reshape((-1,) + W.shape[1:])
+	
+	def jacobianOperator(self, u): # DG(u) as (numObs, numParams) LinearOperator, all products share the forward solve in u
+		Fu = self.Ffnc(u, pureFenicsOutput=True)
+		shape = (self.observationOp().numObs, self.numParams(u))
+		return spsla.LinearOperator(shape, matvec=lambda v: self.jvp(u, v, Fu), rmatvec=lambda w: self.vjp(u, w, Fu), 
+				matmat=lambda V: self.jvp(u, V, Fu), rmatmat=lambda W: self.vjp(u, W, Fu), dtype=np.float64)
+	
+	def jacobian(self, u, Fu=None, obspos=None, mode="auto"): # DG(u) as dense (numObs, numParams) matrix from numParams tangent ("tangent") or numObs adjoint solves ("adjoint")
+		# "auto" takes the mode with fewer solves, either way they are one block solve with one factorization of A(k)
+		obsOp = self.observationOp(obspos)
+		n = self.numParams(u)
+		if mode == "auto":
+			mode = "tangent" if n <= obsOp.numObs else "adjoint"
+		if mode == "tangent":
+			return self.jvp(u, np.eye(n), Fu=Fu, obspos=obspos)
+		elif mode == "adjoint":
+			return self.vjp(u, np.eye(obsOp.numObs), Fu=Fu, obspos=obspos).T
+		raise ValueError("mode needs to be 'auto', 'tangent' or 'adjoint'")
+	
+	# Hessian-vector products by second order adjoints. For a direction h with tangent p' (A(k) p' = -A(exp(u)*h) p) and incremental 
+	# adjoint wtilde' (A(k) wtilde' = O^T O p'/gamma^2 - A(exp(u)*h) wtilde), D^2 Phi(u)[h, .] has the sensitivity density
+	# -exp(u)*(h*nabla(p).nabla(wtilde) + nabla(p').nabla(wtilde) + nabla(p).nabla(wtilde')). Gauss-Newton keeps only the O^T O p' part
+	def adjointState(self, u, obs=None, Fu=None): # wtilde with A(k) wtilde = O^T (G(u)-obs)/gamma^2 (the adjoint state of the gradient of Phi)
+		if obs is None:
+			obs = self.obs
+		kappa, p, expu = self.linearization(u, Fu)
+		obsOp = self.observationOp()
+		self.numSolves += 1
+		return self.fwd.getOperator(kappa).solve(obsOp.adjoint((obsOp.apply(p) - obs)/self.gamma**2))
+	
+	def hessVecPhi(self, u, V, gaussNewton=False, obs=None, Fu=None, wtilde=None): # D^2 Phi(u) V for one direction V (numParams,) or a block (numParams, m)
+		# costs one tangent and one incremental adjoint solve per direction (all with one factorization of A(k)), Fu and wtilde can be shared between calls
+		V = np.asarray(V, dtype=np.float64)
+		Vb = V.reshape((V.shape[0], -1))
+		if Fu is None:
+			Fu = self.Ffnc(u, pureFenicsOutput=True)
+		kappa, p, expu = self.linearization(u, Fu)
+		op = self.fwd.getOperator(kappa)
+		obsOp = self.observationOp()
+		Hb = self.paramToGridBlock(u, Vb)
+		P1 = op.solve(self.tangentRHS(expu, Hb, p))
+		B = obsOp.adjoint(obsOp.apply(P1))/self.gamma**2
+		if not gaussNewton:
+			if wtilde is None:
+				wtilde = self.adjointState(u, obs, Fu)
+			B = B + self.tangentRHS(expu, Hb, wtilde)
+		Wtilde1 = op.solve(B)
+		self.numSolves += 2*Vb.shape[1]
+		HV = np.zeros(Vb.shape)
+		for j in range(Vb.shape[1]):
+			density = self.fwd.innerProdGridWeights(p, Wtilde1[:, j])
+			if not gaussNewton:
+				density = density + Hb[:, j].reshape(expu.shape)*self.fwd.innerProdGridWeights(p, wtilde) + self.fwd.innerProdGridWeights(P1[:, j], wtilde)
+			HV[:, j] = self.gridToParam(u, -expu*density)
+		return HV.reshape(V.shape)
+	
+	def hessVecI(self, u, V, gaussNewton=False, obs=None, Fu=None, wtilde=None): # D^2 I(u) V, i.e. hessVecPhi plus the Hessian of the prior's normpart
+		V = np.asarray(V, dtype=np.float64)
+		priorHess = self.prior.normpartHessian(u)
+		return self.hessVecPhi(u, V, gaussNewton, obs, Fu, wtilde) + (priorHess*V.T).T
+	
+	def hessianOperator(self, u, gaussNewton=False, includePrior=True, obs=None): # D^2 I(u) (or D^2 Phi(u) if not includePrior) as symmetric LinearOperator
+		# the forward and adjoint state in u are computed once, each product then costs two solves per direction
+		Fu = self.Ffnc(u, pureFenicsOutput=True)
+		wtilde = None if gaussNewton else self.adjointState(u, obs, Fu)
+		hessVec = self.hessVecI if includePrior else self.hessVecPhi
+		mv = lambda V: hessVec(u, V, gaussNewton, obs, Fu, wtilde)
+		n = self.numParams(u)
+		return spsla.LinearOperator((n, n), matvec=mv, rmatvec=mv, matmat=mv, rmatmat=mv, dtype=np.float64)
+	
 	def DPhi_adjoint(self, u, h):
 		Fu_ = self.Ffnc(u, pureFenicsOutput=True)
-		Fu = self.Ffnc(u)
 		
-		kappa = mor.mapOnRectangle(self.rect, "handle", lambda x,y: np.exp(u.handle(x,y)))
+		kappa = self.kappafnc(u)
 		
 		
-		discrepancy = self.obs - Fu.handle(self.obspos[0], self.obspos[1])
+		discrepancy = self.obs - self.Gfnc(u, Fu=Fu_)
 		weights = -discrepancy/self.gamma**2
-		wtildeSol = self.fwd.solveWithDiracRHS(kappa, weights, zip(self.obspos[0][:], self.obspos[1][:]), pureFenicsOutput=True)
+		wtildeSol = self.fwd.solveWithDiracRHS(kappa, weights, self.observationOp(), pureFenicsOutput=True) # adjoint source O^T weights
 		
 		kappa1 = mor.mapOnRectangle(self.rect, "handle", lambda x,y: np.exp(u.handle(x,y))*h.handle(x,y))
-		k1 = morToFenicsConverterHigherOrder(kappa1, self.fwd.mesh, self.fwd.V)
-		return -assemble(k1*dot(grad(Fu_),grad(wtildeSol))*dx)
+		return -self.fwd.evalInnerProd(kappa1, Fu_, wtildeSol)
 	
 	
 	def DG_adjoint_vec_wavelet(self, u, version, diagnostic=False):
-		Fu_, Fu = self.Ffnc(u, pureFenicsOutput="both")
+		Fu_ = self.Ffnc(u, pureFenicsOutput=True)
 
-		kappa = mor.mapOnRectangle(self.rect, "handle", lambda x,y: np.exp(u.handle(x,y)))	
+		kappa = self.kappafnc(u)
 
-		positions = list(zip(self.obspos[0][:], self.obspos[1][:]))
-		wtildeSols = []
-		# for each observation point make a dirac there and solve with this as RHS
-		for p in positions:
-			wtildeSols.append(self.fwd.solveWithDiracRHS(kappa, [1], [p], pureFenicsOutput=True))
+		obsOp = self.observationOp()
+		positions = obsOp.points
+		# for each observation point make a dirac there and solve with this as RHS (all of them with one factorization)
+		wtildeSols = self.fwd.solveWithDiracRHSBlock(kappa, obsOp, pureFenicsOutput=True)
 
-		functions = []
-		k = morToFenicsConverterHigherOrder(kappa, self.fwd.mesh, self.fwd.V)
 		# now evaluate inner product for every solution
-		for wt in wtildeSols:
-			functions.append(project(k*dot(grad(Fu_), grad(wt)), self.fwd.V))
+		if version == 0 or version == 1:
+			functions = [self.fwd.projectGradProd(kappa, Fu_, wt) for wt in wtildeSols]
 		
 		if version == 0:
 			DG = np.zeros((len(positions),len(unpackWavelet(u.waveletcoeffs))))
-			for m, fnc in enumerate(functions):
-				valsfnc = np.reshape(fnc.compute_vertex_values(), (2**self.fwd.rect.resol+1, 2**self.fwd.rect.resol+1))
-				morfnc = mor.mapOnRectangle(self.fwd.rect, "expl", valsfnc[0:-1,0:-1])
+			for m, morfnc in enumerate(functions):
 				correctionfactor = (self.rect.x2-self.rect.x1)*(self.rect.y2-self.rect.y1) # ugly hack, adjoint DPhi needs to be scaled by rect dimensions. Don't know why, though.
 				DG_vec = unpackWavelet(morfnc.waveletcoeffs[0:len(u.waveletcoeffs)])*(-1)*correctionfactor
 				DG[m, :] = DG_vec
@@ -271,9 +415,7 @@ class inverseProblem():
 		elif version == 1: # like version 0 but with correction for 0th wavelet coeff
 			N = len(unpackWavelet(u.waveletcoeffs))
 			DG = np.zeros((len(positions),len(unpackWavelet(u.waveletcoeffs))))
-			for m, fnc in enumerate(functions):
-				valsfnc = np.reshape(fnc.compute_vertex_values(), (2**self.fwd.rect.resol+1, 2**self.fwd.rect.resol+1))
-				morfnc = mor.mapOnRectangle(self.fwd.rect, "expl", valsfnc[0:-1,0:-1])
+			for m, morfnc in enumerate(functions):
 				correctionfactor = (self.rect.x2-self.rect.x1)*(self.rect.y2-self.rect.y1) # ugly hack, adjoint DPhi needs to be scaled by rect dimensions. Don't know why, though.
 				DG_vec = unpackWavelet(morfnc.waveletcoeffs[0:len(u.waveletcoeffs)])*(-1)*correctionfactor
 				DG[m, :] = DG_vec
@@ -282,41 +424,30 @@ class inverseProblem():
 				temp[0] = 1
 				h = mor.mapOnRectangle(self.fwd.rect, "wavelet", packWavelet(temp))	
 				kappa1 = mor.mapOnRectangle(self.rect, "expl", np.exp(u.values)*h.values)
-				k1 = morToFenicsConverterHigherOrder(kappa1, self.fwd.mesh, self.fwd.V)
 			for m, wtildeSol in enumerate(wtildeSols):
-				DG[m, 0] = -assemble(k1*dot(grad(Fu_),grad(wtildeSol))*dx)
+				DG[m, 0] = -self.fwd.evalInnerProd(kappa1, Fu_, wtildeSol)
 				#DPhi_vec[0] = self.DPhi_adjoint(u, mor.mapOnRectangle(self.rect, "wavelet", packWavelet(temp))) # correct 0th order, which is badly computed by this method
 			# correct 0th wavelet coeff entry	
 			return DG
-		elif version == 2: # more exact variant
-			N = len(unpackWavelet(u.waveletcoeffs))
+		elif version == 2: # exact variant: one adjoint Haar transform of the sensitivity density per observation
 			DG_vec = np.zeros((len(positions),len(unpackWavelet(u.waveletcoeffs))))
-			for kk in range(N): # wavelet coeffs
-				for m, wtildeSol in enumerate(wtildeSols): # observations
-					temp = np.zeros((N, ))
-					temp[kk] = 1
-					h = mor.mapOnRectangle(self.fwd.rect, "wavelet", packWavelet(temp))	
-					kappa1 = mor.mapOnRectangle(self.rect, "expl", np.exp(u.values)*h.values)
-					k1 = morToFenicsConverterHigherOrder(kappa1, self.fwd.mesh, self.fwd.V)
-					DG_vec[m, kk] = -assemble(k1*dot(grad(Fu_),grad(wtildeSol))*dx)
+			for m, wtildeSol in enumerate(wtildeSols): # observations
+				DG_vec[m, :] = adjointGradientWavelet(self.fwd, u, Fu_, wtildeSol)
 			return DG_vec	
 		if diagnostic:
 			return DG_vec, fnc, morfnc
 		
 	def DPhi_adjoint_vec_wavelet(self, u, version=2, diagnostic=False):
-		Fu_, Fu = self.Ffnc(u, pureFenicsOutput="both")
+		Fu_ = self.Ffnc(u, pureFenicsOutput=True)
 		
-		kappa = mor.mapOnRectangle(self.rect, "handle", lambda x,y: np.exp(u.handle(x,y)))
+		kappa = self.kappafnc(u)
 		
 		
-		discrepancy = self.obs - Fu.handle(self.obspos[0], self.obspos[1])
+		discrepancy = self.obs - self.Gfnc(u, Fu=Fu_)
 		weights = -discrepancy/self.gamma**2
-		wtildeSol = self.fwd.solveWithDiracRHS(kappa, weights, zip(self.obspos[0][:], self.obspos[1][:]), pureFenicsOutput=True)
-		k = morToFenicsConverterHigherOrder(kappa, self.fwd.mesh, self.fwd.V)
-		fnc = project(k*dot(grad(Fu_), grad(wtildeSol)), self.fwd.V)
+		wtildeSol = self.fwd.solveWithDiracRHS(kappa, weights, self.observationOp(), pureFenicsOutput=True)
 		if version == 0:
-			valsfnc = np.reshape(fnc.compute_vertex_values(), (2**self.fwd.rect.resol+1, 2**self.fwd.rect.resol+1))
-			morfnc = mor.mapOnRectangle(self.fwd.rect, "expl", valsfnc[0:-1,0:-1])
+			fnc, morfnc = self.fwd.projectGradProd(kappa, Fu_, wtildeSol, pureFenicsOutput="both")
 			correctionfactor = (self.rect.x2-self.rect.x1)*(self.rect.y2-self.rect.y1) # ugly hack, adjoint DPhi needs to be scaled by rect dimensions. Don't know why, though. The negative sign is most likely to a missing minus sign in the formula for D_uQ(\bar u)[h] = 1/gamma^2 = ... in the handout. Check out!
 			DPhi_vec = unpackWavelet(morfnc.waveletcoeffs[0:len(u.waveletcoeffs)])*(-1)*correctionfactor
 			temp = np.zeros((len(unpackWavelet(u.waveletcoeffs)),))
@@ -325,69 +456,32 @@ class inverseProblem():
 			if diagnostic:
 				return DPhi_vec, fnc, morfnc
 			return DPhi_vec
-		else:
-			N = len(unpackWavelet(u.waveletcoeffs))
-			DPhi_vec = []
-			#print("N = " + str(N))
-			for kk in range(N):
-				temp = np.zeros((N, ))
-				temp[kk] = 1
-				h = mor.mapOnRectangle(self.fwd.rect, "wavelet", packWavelet(temp))	
-				kappa1 = mor.mapOnRectangle(self.rect, "expl", np.exp(u.values)*h.values)
-				k1 = morToFenicsConverterHigherOrder(kappa1, self.fwd.mesh, self.fwd.V)
-				s1 = time.time()
-				DPhi_vec.append(-assemble(k1*dot(grad(Fu_),grad(wtildeSol))*dx))
-				s2 = time.time()
-				#print(str(s2-s1) + " seconds for assembly in wavelet")
-			return DPhi_vec
+		else: # exact: -\int exp(u)*psi*nabla(Fu).nabla(wtilde) for every wavelet psi, i.e. the adjoint Haar transform of the sensitivity density
+			return adjointGradientWavelet(self.fwd, u, Fu_, wtildeSol)
 	
 	def DPhi_adjoint_vec_fourier(self, u, version=2):
 		#print("starting DPhi")
-		Fu_, Fu = self.Ffnc(u, pureFenicsOutput="both")
+		Fu_ = self.Ffnc(u, pureFenicsOutput=True)
 		#print("done solving fwd PDE")
 		M = u.fouriermodes.shape[0]
 		#print(M)
-		#kappa = mor.mapOnRectangle(self.rect, "handle", lambda x,y: np.exp(u.handle(x,y)))
-		kappa = mor.mapOnRectangle(self.rect, "expl", np.exp(u.values))
+		kappa = self.kappafnc(u)
 		
-		discrepancy = self.obs - Fu.handle(self.obspos[0], self.obspos[1])
+		discrepancy = self.obs - self.Gfnc(u, Fu=Fu_)
 		weights = -discrepancy/self.gamma**2
-		wtildeSol = self.fwd.solveWithDiracRHS(kappa, weights, zip(self.obspos[0][:], self.obspos[1][:]), pureFenicsOutput=True)
+		wtildeSol = self.fwd.solveWithDiracRHS(kappa, weights, self.observationOp(), pureFenicsOutput=True)
 		#print("done solving adjoint PDE")
-		k = morToFenicsConverterHigherOrder(kappa, self.fwd.mesh, self.fwd.V)
-		fnc = project(k*dot(grad(Fu_), grad(wtildeSol)), self.fwd.V)
-		#print("done projecting")
 		
 		if version == 0:
-			valsfnc = np.reshape(fnc.compute_vertex_values(), (2**self.fwd.rect.resol+1, 2**self.fwd.rect.resol+1))
-			morfnc = mor.mapOnRectangle(self.fwd.rect, "expl", valsfnc[0:-1,0:-1])
+			morfnc = self.fwd.projectGradProd(kappa, Fu_, wtildeSol)
 			#print(morfnc.fouriermodes.shape)
 			correctionfactor = (self.rect.x2-self.rect.x1)*(self.rect.y2-self.rect.y1) # ugly hack, adjoint DPhi needs to be scaled by rect dimensions. Don't know why, though. The negative sign is most likely to a missing minus sign in the formula for D_uQ(\bar u)[h] = 1/gamma^2 = ... in the handout. Check out!
 			#print("will get fourier decomposition")
 			DPhi_vec = (mor.extractsubfouriermatrix(morfnc.fouriermodes, M)).flatten()*(-1)
 			#print("... done")
 			return DPhi_vec
-		else:
-			M = u.fouriermodes.shape[0]
-			N = u.fouriermodes.shape[1]
-			#print("M*N = " + str(M*N))
-			DPhi_vec = np.zeros((M,N))
-			phimat = u.getPhiMat()
-			for kk in range(M):
-				for ll in range(N):
-					temp = np.zeros((M, N))
-					temp[kk, ll] = 1
-					#print("start loop iteration " + str(kk) + ", " + str(ll))
-					s1 = time.time()
-					h = mor.mapOnRectangle(self.fwd.rect, "fourier", temp)	
-					hvals = h.evalmodesGrid(h.fouriermodes, h.x, h.y, phimat)
-					kappa1 = mor.mapOnRectangle(self.rect, "expl", np.exp(u.values)*hvals) # h.values takes long time!
-					#kappa1 = mor.mapOnRectangle(self.rect, "expl", np.exp(u.values)*h.values) # h.values takes long time!
-					k1 = morToFenicsConverterHigherOrder(kappa1, self.fwd.mesh, self.fwd.V)
-					DPhi_vec[kk,ll] = -assemble(k1*dot(grad(Fu_),grad(wtildeSol))*dx)
-					s2 = time.time()
-					#print(str(s2-s1) + " seconds for fourier eval AND assembly in fourier")
-			return DPhi_vec.reshape((M*N,))
+		else: # exact: -\int exp(u)*phi_kl*nabla(Fu).nabla(wtilde) for all modes phi_kl at once, via real FFTs of the sensitivity density
+			return mor.evalmodesGrid_adjoint(adjointSensitivity(self.fwd, u, Fu_, wtildeSol), M).reshape((M*M,))
 	"""	
 	def DNormpart(self, u): # BAD! put in prior instead
 		wc = packWavelet(np.array(unpackWavelet(u.waveletcoeffs), copy = True))
@@ -405,38 +499,28 @@ class inverseProblem():
 	
 	def DI_adjoint_vec_wavelet(self, u, version=2):
 		DPhi_vec = self.DPhi_adjoint_vec_wavelet(u, version=version)
-		wc = packWavelet(np.array(unpackWavelet(u.waveletcoeffs), copy = True))
-		MM = len(wc)
-		s = self.prior.s
-		kappa = self.prior.kappa
-		factors = [kappa] + [kappa*4**(j*s) for j in range(MM-1)]
-		wc[0] = wc[0]*factors[0]
-		for m in range(1, MM):
-			wc[m][0] = wc[m][0]*factors[m]
-			wc[m][1] = wc[m][1]*factors[m]
-			wc[m][2] = wc[m][2]*factors[m]
-		normpartvec = unpackWavelet(wc)
+		normpartvec = self.prior.multiplyWithInvCov(u)
 		assert(len(normpartvec) == len(DPhi_vec))
 		return normpartvec + DPhi_vec
 	
 	def DI_adjoint_vec_fourier(self, u):
 		DPhi_vec = self.DPhi_adjoint_vec_fourier(u)
-		normpartvec = np.nan_to_num(self.prior.eigenvals**(-2))
-		return DPhi_vec + normpartvec.flatten()
+		return DPhi_vec + self.prior.normpartGradient(u)
 	def DI_mor(self, u, version=2):
 		D = self.DI_adjoint_vec_wavelet(u, version=version)
 		return mor.mapOnRectangle(self.rect, "wavelet", packWavelet(D))
 		
 	def DI_vec_fourier(self, u, obs, obspos=None, Fu=None):
-		# gradient of energy functional (each row is one "fourier direction")
-		numDir = len(u.fouriermodes.flatten())
-		DIvec = np.zeros((numDir,))
-		N = self.prior.N
+		# gradient of energy functional (each row is one "fourier direction"), the misfit part by one adjoint solve (see DPhi_vec_fourier)
+		DIvec = self.DPhi_vec_fourier(u, obs, obspos=obspos, Fu=Fu)
+		if hasattr(self.prior, "normpartGradient"):
+			return DIvec + self.prior.normpartGradient(u)
+		numDir = DIvec.shape[0]
+		N = u.fouriermodes.shape[0]
 		for direction in range(numDir):
 			temp = np.zeros((numDir,))
 			temp[direction] = 1
-			h = mor.mapOnRectangle(self.rect, "fourier", temp.reshape((N,N)))
-			DIvec[direction] = self.DI(u, h, obs, obspos=obspos, Fu=Fu)
+			DIvec[direction] += self.prior.covInnerProd(u, mor.mapOnRectangle(self.rect, "fourier", temp.reshape((N,N))))
 		return DIvec
 	
 	def D2I(self, u, h1, h2=None, obs=None):
@@ -510,8 +594,83 @@ class inverseProblem():
 		else:
 			raise Exception("not a valid option")			
 	
-	def find_uMAP(self, u0, nit=5000, nfev=5000, method='Nelder-Mead', adjoint=True, rate=0.0001, version=2):
+	def value_and_grad(self, u_modes_unpacked, includePrior=True):
+		# I, Phi, normpart and the gradient of I (of Phi if not includePrior, e.g. for FISTA) in the plain vector u_modes_unpacked (as in I_forOpt),
+		# all from one forward and one adjoint solve. Use e.g. as scipy.optimize.minimize(lambda v: self.value_and_grad(v)[0::3], v0, jac=True)
+		if includePrior and not hasattr(self.prior, "normpartGradient"):
+			raise ValueError("normpart of " + type(self.prior).__name__ + " has no gradient, use includePrior=False (e.g. with FISTA)")
+		if isinstance(self.prior, GaussianFourier2d):
+			u = mor.mapOnRectangle(self.rect, "fourier", u_modes_unpacked.reshape((self.prior.N, self.prior.N)))
+		elif isinstance(self.prior, GeneralizedGaussianWavelet2d) or isinstance(self.prior, GeneralizedWavelet2d):
+			u = mor.mapOnRectangle(self.rect, "wavelet", packWavelet(u_modes_unpacked))
+		else:
+			raise Exception("not a valid option")
+		Fu = self.Ffnc(u, pureFenicsOutput=True)
+		wtilde = self.adjointState(u, Fu=Fu)
+		kappa, p, expu = self.linearization(u, Fu)
+		Phi = self.Phi(u, Fu=Fu)
+		normpart = self.prior.normpart(u)
+		grad = self.gridToParam(u, -expu*self.fwd.innerProdGridWeights(p, wtilde))
+		if includePrior:
+			grad = grad + self.prior.normpartGradient(u)
+		return Phi + normpart, Phi, normpart, grad
+	
+	def covScaling(self, u): # square root of the (diagonal) prior covariance in the coefficients of u, used to whiten the MAP problem
+		if hasattr(self.prior, "multiplyWithCov"):
+			scaling = np.sqrt(np.abs(flatWavelet(self.prior.multiplyWithCov(np.ones((self.numParams(u),)), inputtype="wc_unpacked").waveletcoeffs)))
+		elif hasattr(self.prior, "eigenvals"):
+			scaling = np.sqrt(np.abs(self.prior.eigenvals.flatten()))
+		else:
+			scaling = np.ones((self.numParams(u),))
+		scaling[scaling == 0] = 1 # coefficients without prior information are not rescaled
+		return scaling
+	
+	def minimizeNewtonCG(self, u0, u0_vec, method='trust-ncg', nit=100, gaussNewton=False, tol=None):
+		# matrix-free (Gauss-)Newton CG for I in whitened coefficients z = u_vec/scaling (preconditioning with the prior covariance, see covScaling): 
+		# 'trust-ncg' is the Steihaug trust region method, 'Newton-CG' the line search variant. Forward and adjoint state are computed once per iterate,
+		# every Hessian-vector product costs two more solves. Returns the scipy result with the number of PDE solves per iteration in res.solvesPerIteration
+		if not (hasattr(self.prior, "normpartGradient") and hasattr(self.prior, "normpartHessian")):
+			raise ValueError("Newton-CG needs the gradient and Hessian of the prior's normpart, which " + type(self.prior).__name__ + " doesn't provide (use e.g. BFGS)")
+		scaling = self.covScaling(u0)
+		def toMor(z):
+			if u0.inittype == "fourier":
+				return mor.mapOnRectangle(self.rect, "fourier", np.reshape(z*scaling, u0.fouriermodes.shape))
+			return mor.mapOnRectangle(self.rect, "wavelet", packWavelet(z*scaling))
+		state = {"key": None}
+		def evaluateAt(z): # forward solve for the iterate z (shared by fun, jac and hessp)
+			if state["key"] != z.tobytes():
+				u = toMor(z)
+				state.update(key=z.tobytes(), u=u, Fu=self.Ffnc(u, pureFenicsOutput=True), wtilde=None)
+			return state
+		def adjointAt(z):
+			st = evaluateAt(z)
+			if st["wtilde"] is None:
+				st["wtilde"] = self.adjointState(st["u"], Fu=st["Fu"])
+			return st
+		def fun(z):
+			st = evaluateAt(z)
+			return self.Phi(st["u"], Fu=st["Fu"]) + self.prior.normpart(st["u"])
+		def jac(z):
+			st = adjointAt(z)
+			kappa, p, expu = self.linearization(st["u"], st["Fu"])
+			DPhi = self.gridToParam(st["u"], -expu*self.fwd.innerProdGridWeights(p, st["wtilde"]))
+			return scaling*(DPhi + self.prior.normpartGradient(st["u"]))
+		def hessp(z, v):
+			st = evaluateAt(z) if gaussNewton else adjointAt(z)
+			return scaling*self.hessVecI(st["u"], scaling*v, gaussNewton=gaussNewton, Fu=st["Fu"], wtilde=st["wtilde"])
+		solveCounts = [self.numSolves]
+		def callback(z):
+			solveCounts.append(self.numSolves)
+			print("iteration " + str(len(solveCounts)-1) + ": I = " + str(fun(z)) + ", " + str(solveCounts[-1]-solveCounts[-2]) + " PDE solves")
+		res = scipy.optimize.minimize(fun, u0_vec/scaling, jac=jac, hessp=hessp, method=method, callback=callback, tol=tol, options={'disp': True, 'maxiter': nit})
+		res.x = res.x*scaling
+		res.solvesPerIteration = np.diff(solveCounts)
+		return res
+	
+	def find_uMAP(self, u0, nit=5000, nfev=5000, method='Nelder-Mead', adjoint=True, rate=0.0001, version=2, gaussNewton=False, tol=None):
 		# find the MAP point starting from u0 with nit iterations, nfev function evaluations and method either Nelder-Mead or BFGS (CG is not recommended)
+		# or 'trust-ncg'/'Newton-CG' (matrix-free Newton, Gauss-Newton with gaussNewton=True, see minimizeNewtonCG; needs far fewer PDE solves)
+		# tol is passed on to scipy.optimize.minimize as termination tolerance (None: scipy's default for the method)
 		assert(self.obs is not None)
 		start = time.time()
 		u0_vec = None
@@ -519,25 +678,34 @@ class inverseProblem():
 			u0_vec = u0.fouriermodes.flatten()
 		elif isinstance(self.prior, GeneralizedGaussianWavelet2d) or isinstance(self.prior, GeneralizedWavelet2d):
 			u0_vec = unpackWavelet(u0.waveletcoeffs)
+		numSolves0 = self.numSolves
 		
 		if method=='Nelder-Mead':
 			If = lambda u: self.I_forOpt(u)
-			res = scipy.optimize.minimize(If, u0_vec, method=method, options={'disp': True, 'maxiter': nit, 'maxfev': nfev})
+			res = scipy.optimize.minimize(If, u0_vec, method=method, tol=tol, options={'disp': True, 'maxiter': nit, 'maxfev': nfev})
 		elif method == 'CG': # not recommended
 			# dirty hack to avoid overflow
 			If = lambda u: self.I_forOpt(u*rate)
 			DIf = lambda u: rate*self.DI_forOpt(u*rate)
 			#res = scipy.optimize.minimize(self.I_forOpt, u0_vec, jac=self.DI_forOpt, method=method, options={'disp': True, 'maxiter': nit})
-			res = scipy.optimize.minimize(If, u0_vec/rate, jac=DIf, method=method, options={'disp': True, 'maxiter': nit})
+			res = scipy.optimize.minimize(If, u0_vec/rate, jac=DIf, method=method, tol=tol, options={'disp': True, 'maxiter': nit})
 			res.x = res.x * rate
 		elif method == 'BFGS':
-			If = lambda u: self.I_forOpt(u*rate)
-			if adjoint:
-				DIf = lambda u: rate*self.DI_adjoint_forOpt(u*rate, version=version)
+			if adjoint and version != 0 and hasattr(self.prior, "normpartGradient"):
+				def If(u): # I and its gradient from one forward and one adjoint solve
+					I, Phi, normpart, DI = self.value_and_grad(u*rate)
+					return I, rate*DI
+				res = scipy.optimize.minimize(If, u0_vec/rate, jac=True, method=method, tol=tol, options={'disp': True, 'maxiter': nit})
 			else:
-				DIf = lambda u: rate*self.DI_forOpt(u*rate)
-			res = scipy.optimize.minimize(If, u0_vec/rate, jac=DIf, method=method, options={'disp': True, 'maxiter': nit})	
+				If = lambda u: self.I_forOpt(u*rate)
+				if adjoint:
+					DIf = lambda u: rate*self.DI_adjoint_forOpt(u*rate, version=version)
+				else:
+					DIf = lambda u: rate*self.DI_forOpt(u*rate)
+				res = scipy.optimize.minimize(If, u0_vec/rate, jac=DIf, method=method, tol=tol, options={'disp': True, 'maxiter': nit})	
 			res.x = res.x * rate		
+		elif method == 'trust-ncg' or method == 'Newton-CG':
+			res = self.minimizeNewtonCG(u0, u0_vec, method=method, nit=nit, gaussNewton=gaussNewton, tol=tol)
 		else:
 			raise NotImplementedError("this optimization routine either doesn't exist or isn't supported yet")
 		end = time.time()
@@ -551,12 +719,50 @@ class inverseProblem():
 		print("Took " + str(end-start) + " seconds")
 		print(str(res.nit) + " iterations")
 		print(str(res.nfev) + " function evaluations")
+		print(str(self.numSolves - numSolves0) + " PDE solves")
 		print("Reduction of function value from " + str(self.I(u0)) + " to " + str(self.I(uOpt)))
 		print("Function value consists of")
 		print("Phi(u)  = " + str(self.Phi(uOpt)))
 		print("norm(u) = " + str(self.prior.normpart(uOpt)))
 		return uOpt
 	
+	def prolongate(self, u, rect): # u as mapOnRectangle on rect: Haar coefficients are cut off or padded with zeros (parseResolution), Fourier modes don't depend on the grid
+		if u.inittype == "fourier":
+			return mor.mapOnRectangle(rect, "fourier", u.fouriermodes)
+		return mor.mapOnRectangle(rect, "wavelet", parseResolution(u.waveletcoeffs, rect.resol+1))
+	
+	def find_uMAP_multilevel(self, u0, levelProblem, resols=None, method='trust-ncg', nit=100, tol=1e-4, gaussNewton=False, version=2, inflateNoise=False):
+		# continuation in the resolution: find the MAP point on coarse grids first, each prolongated optimum is the starting point on the next finer grid, the last level is self
+		# levelProblem(rect) returns the inverseProblem on the coarser Rectangle rect (same domain as self.rect). While its level is optimized, it uses the observations
+		# and their positions of self, its own obs, obspos and gamma are restored afterwards. resols: coarse resolutions (default 3, 4, ..., self.resol-1). 
+		# A coarse level stops at tol*2**(self.resol-resol) in proportion to the O(h) error of piecewise constant log-permeabilities, resolving it better doesn't 
+		# improve the starting point for the next one. inflateNoise: a coarse level only fits the data up to its discretization error delta (rms difference of its 
+		# observations to those on self at the starting point, one extra solve on each grid), so use the noise level sqrt(gamma^2 + delta^2) there
+		if resols is None:
+			resols = range(min(3, self.resol), self.resol)
+		uOpt = u0
+		for resol in [r for r in resols if r < self.resol] + [self.resol]:
+			levelTol = tol*2**(self.resol-resol)
+			if resol == self.resol:
+				ip = self
+				saved = None
+			else:
+				ip = levelProblem(Rectangle(self.rect.p1, self.rect.p2, resol=resol))
+				saved = (ip.obs, ip.obspos, ip.gamma)
+				ip.obs = self.obs
+				ip.obspos = self.obspos
+				if inflateNoise:
+					ip.gamma = sqrt(self.gamma**2 + np.mean((ip.Gfnc(ip.prolongate(uOpt, ip.rect)) - self.Gfnc(self.prolongate(uOpt, self.rect)))**2))
+			numSolves0 = ip.numSolves
+			print("level resol = " + str(resol) + ", gamma = " + str(ip.gamma) + ", tol = " + str(levelTol))
+			try:
+				uOpt = ip.find_uMAP(ip.prolongate(uOpt, ip.rect), nit=nit, method=method, version=version, gaussNewton=gaussNewton, tol=levelTol)
+			finally:
+				if saved is not None:
+					ip.obs, ip.obspos, ip.gamma = saved
+			print("level resol = " + str(resol) + ": " + str(ip.numSolves - numSolves0) + " PDE solves")
+		return uOpt
+	
 	def randomwalk_MALA(self, uStart, N, beta=0.1, showDetails=False):
 		# MALA Crank-Nicolson MCMC for sampling from posterior (or preconditioned Crank-Nicolson Langevin pCNL) -> Only for Gaussian prior so far!!
 		start = time.time()
@@ -835,6 +1041,12 @@ class inverseProblem_hydrTom():
 	
 	def DI_adjoint_forOpt(self, u_modes_unpacked, version=0):
 		return sum(self.DI_adjoint_forOptList(u_modes_unpacked, version=version))
+	
+	def value_and_gradList(self, u_modes_unpacked, includePrior=True):
+		return [ip.value_and_grad(u_modes_unpacked, includePrior=includePrior) for ip in self.invProbList]
+	
+	def value_and_grad(self, u_modes_unpacked, includePrior=True): # sums of I, Phi, normpart and gradient over all experiments (like I and DI_adjoint_forOpt), one forward and one adjoint solve each
+		return tuple(sum(vals) for vals in zip(*self.value_and_gradList(u_modes_unpacked, includePrior=includePrior)))
 		
 			
 	
@@ -858,12 +1070,18 @@ class inverseProblem_hydrTom():
 			res = scipy.optimize.minimize(If, u0_vec/rate, jac=DIf, method=method, options={'disp': True, 'maxiter': nit})
 			res.x = res.x * rate
 		elif method == 'BFGS':
-			If = lambda u: self.I_forOpt(u*rate)
-			if adjoint:
-				DIf = lambda u: rate*self.DI_adjoint_forOpt(u*rate, version=version)
+			if adjoint and version != 0 and hasattr(self.prior, "normpartGradient"):
+				def If(u): # I and its gradient from one forward and one adjoint solve per experiment
+					I, Phi, normpart, DI = self.value_and_grad(u*rate)
+					return I, rate*DI
+				res = scipy.optimize.minimize(If, u0_vec/rate, jac=True, method=method, options={'disp': True, 'maxiter': nit})
 			else:
-				DIf = lambda u: rate*self.DI_forOpt(u*rate)
-			res = scipy.optimize.minimize(If, u0_vec/rate, jac=DIf, method=method, options={'disp': True, 'maxiter': nit})	
+				If = lambda u: self.I_forOpt(u*rate)
+				if adjoint:
+					DIf = lambda u: rate*self.DI_adjoint_forOpt(u*rate, version=version)
+				else:
+					DIf = lambda u: rate*self.DI_forOpt(u*rate)
+				res = scipy.optimize.minimize(If, u0_vec/rate, jac=DIf, method=method, options={'disp': True, 'maxiter': nit})	
 			res.x = res.x * rate		
 		else:
 			raise NotImplementedError("this optimization routine either doesn't exist or isn't supported yet")
@@ -975,6 +1193,7 @@ class inverseProblem_hydrTom_old():
 		self.gamma = gamma
 		self.resol = self.rect.resol
 		self.numSolves = 0
+		self._obsOp = None
 	# Forward operators and their derivatives:	
 	def Ffnc(self, logkappa, pureFenicsOutput=False): # F is like forward, but uses logpermeability instead of permeability
 		# so: F maps logpermeability to solution of PDE (don't confuse with F in Sullivan's notation, which is the differential operator)
@@ -1017,6 +1236,15 @@ class inverseProblem_hydrTom_old():
 			res.append(y1primeprime+y2primeprime)
 		return res
 	
+	def observationOp(self, obspos=None): # sparse observation operator for obspos (default: self.obspos), only rebuilt when the observation positions change
+		if obspos is None:
+			obspos = self.obspos
+		if obspos is None:
+			raise ValueError("self.obspos need to be defined or obspos needs to be given")
+		if self._obsOp is None or not self._obsOp.matches(obspos):
+			self._obsOp = self.fwd.getObservationOperator(obspos)
+		return self._obsOp
+	
 	def Gfnc(self, u, Fu=None, obspos=None):
 		# this is the observation operator, i.e. G = Pi \circ F, where F is the solution operator and Pi is the projection onto obspos coordinates
 		if self.obspos == None and obspos is None:
@@ -1149,11 +1377,10 @@ class inverseProblem_hydrTom_old():
 			Fu_ = Fu_l[kk]
 			discrepancy = self.obslist[kk] - Fu.handle(self.obspos[0], self.obspos[1])
 			weights = -discrepancy/self.gamma**2
-			wtildeSol = self.fwd.solveWithDiracRHS(kappa, weights, zip(self.obspos[0][:], self.obspos[1][:]), pureFenicsOutput=True)
+			wtildeSol = self.fwd.solveWithDiracRHS(kappa, weights, self.observationOp(), pureFenicsOutput=True)
 		
 			kappa1 = mor.mapOnRectangle(self.rect, "handle", lambda x,y: np.exp(u.handle(x,y))*h.handle(x,y))
-			k1 = morToFenicsConverterHigherOrder(kappa1, self.fwd.mesh, self.fwd.V)
-			term += -assemble(k1*dot(grad(Fu_),grad(wtildeSol))*dx)
+			term += -self.fwd.evalInnerProd(kappa1, Fu_, wtildeSol)
 		return term
 	
 	def DPhi_adjoint_vec_wavelet(self, u, version=0):
@@ -1168,12 +1395,9 @@ class inverseProblem_hydrTom_old():
 			Fu = Ful[kk]
 			Fu_ = Fu_l[kk]		
 			weights = -discrepancy[kk]/self.gamma**2
-			wtildeSol = self.fwd.solveWithDiracRHS(kappa, weights, zip(self.obspos[0][:], self.obspos[1][:]), pureFenicsOutput=True)
-			k = morToFenicsConverterHigherOrder(kappa, self.fwd.mesh, self.fwd.V)
-			fnc = project(k*dot(grad(Fu_), grad(wtildeSol)), self.fwd.V)
+			wtildeSol = self.fwd.solveWithDiracRHS(kappa, weights, self.observationOp(), pureFenicsOutput=True)
 			if version == 0:
-				valsfnc = np.reshape(fnc.compute_vertex_values(), (2**self.fwd.rect.resol+1, 2**self.fwd.rect.resol+1))
-				morfnc = mor.mapOnRectangle(self.fwd.rect, "expl", valsfnc[0:-1,0:-1])
+				morfnc = self.fwd.projectGradProd(kappa, Fu_, wtildeSol)
 				DPhi_vec = unpackWavelet(morfnc.waveletcoeffs[0:len(u.waveletcoeffs)])*(-1)
 				temp = np.zeros((len(unpackWavelet(u.waveletcoeffs)),))
 				temp[0] = 1
@@ -1201,8 +1425,7 @@ class inverseProblem_hydrTom_old():
 					temp[kk] = 1
 					h = mor.mapOnRectangle(self.fwd.rect, "wavelet", packWavelet(temp))				
 					kappa1 = mor.mapOnRectangle(self.rect, "handle", lambda x,y: np.exp(u.handle(x,y))*h.handle(x,y))
-					k1 = morToFenicsConverterHigherOrder(kappa1, self.fwd.mesh, self.fwd.V)
-					DPhi_vec.append(-assemble(k1*dot(grad(Fu_),grad(wtildeSol))*dx))
+					DPhi_vec.append(-self.fwd.evalInnerProd(kappa1, Fu_, wtildeSol))
 				if DPhi_vec_full is None:
 					DPhi_vec_full = DPhi_vec
 				else:
@@ -1211,17 +1434,7 @@ class inverseProblem_hydrTom_old():
 
 	def DI_adjoint_vec_wavelet(self, u, version=2):
 		DPhi_vec = self.DPhi_adjoint_vec_wavelet(u, version=version)
-		wc = packWavelet(np.array(unpackWavelet(u.waveletcoeffs), copy = True))
-		MM = len(wc)
-		s = self.prior.s
-		kappa = self.prior.kappa
-		factors = [kappa] + [kappa*4**(j*s) for j in range(MM-1)]
-		wc[0] = wc[0]*factors[0]
-		for m in range(1, MM):
-			wc[m][0] = wc[m][0]*factors[m]
-			wc[m][1] = wc[m][1]*factors[m]
-			wc[m][2] = wc[m][2]*factors[m]
-		normpartvec = unpackWavelet(wc)
+		normpartvec = self.prior.multiplyWithInvCov(u)
 		assert(len(normpartvec) == len(DPhi_vec))
 		
 		
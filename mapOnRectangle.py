@@ -5,6 +5,7 @@ from math import sin, cos, pi, sqrt, log, pi, log10
 import haarWavelet2d as hW
 from rectangle import *
 from scipy.interpolate import RectBivariateSpline
+from caching import *
 import scipy
 import inspect
 import time
@@ -19,23 +20,11 @@ from rectangle import *
 """
 
 
-def unpackWavelet(waco):
-	J = len(waco)
-	unpacked = np.zeros((2**(2*(J-1)),)) ##### !!!!!
-	unpacked[0] = waco[0][0,0]
-	for j in range(1, J):
-		unpacked[2**(2*j-2):2**(2*j)] = np.concatenate((waco[j][0].flatten(), waco[j][1].flatten(), waco[j][2].flatten()))
-	return unpacked
+def unpackWavelet(waco): # see haarWavelet2d (kept here for scripts using mapOnRectangle's names)
+	return hW.unpackWavelet(waco)
 
 def packWavelet(vector):
-	packed = [np.array([[vector[0]]])]
-	J = int(log10(len(vector))/(2*log10(2)))+1
-	for j in range(1, J):
-		temp1 = np.reshape(vector[2**(2*j-2):2**(2*j-1)], (2**(j-1), 2**(j-1)))
-		temp2 = np.reshape(vector[2**(2*j-1):2**(2*j-1)+2**(2*j-2)], (2**(j-1), 2**(j-1)))
-		temp3 = np.reshape(vector[2**(2*j-1)+2**(2*j-2):2**(2*j)], (2**(j-1), 2**(j-1)))
-		packed.append([temp1, temp2, temp3])
-	return packed
+	return hW.packWavelet(vector)
 
 def getFourierCoeffs_(fs, M=None): # old version, doesn't work properly
 	ft = np.fft.fft2(fs[0:-1,0:-1])
@@ -103,6 +92,52 @@ def getFourierCoeffs(fs, M=None):
 	return extractsubfouriermatrix(mat_, M)
 
 
+def fourierBasis1d(t, N): # (len(t), N) matrix of the 1d factors of the fourier basis at the normalized coordinates t (in [0,1]):
+	# column 0 is 1, column i is cos(i*2*pi*t) for 0 < i <= N//2 and sin((i-N//2)*2*pi*t) above. The basis function for the modes entry [k, l] is
+	# fourierBasis1d(y', N)[:, k]*fourierBasis1d(x', N)[:, l], so evaluating a modes matrix on a grid is the separable product By.modes.Bx^T
+	maxMode = N//2
+	T = 2*pi*np.reshape(np.asarray(t, dtype=np.float64), (-1, 1))
+	B = np.ones((T.shape[0], N))
+	B[:, 1:maxMode+1] = np.cos(T*np.arange(1, maxMode+1))
+	B[:, maxMode+1:N] = np.sin(T*np.arange(1, N-maxMode))
+	return B
+
+class fourierBasisCache(lruCache):
+	# bounded LRU cache of fourierBasis1d matrices, keyed by the coordinates, the interval [a, b] they are normalized with and N
+	def key(self, args):
+		s, a, b, N = args
+		return arrayKey(s) + repr((a, b, N))
+
+fourierBases = fourierBasisCache(maxsize=32) # shared by all mapOnRectangles (grids, observation points, ...)
+
+def cachedFourierBasis1d(s, a, b, N): # fourierBasis1d((s-a)/(b-a), N) for coordinates s in [a, b], built once per point set
+	s = np.ravel(s)
+	return fourierBases.get((s, a, b, N), lambda: fourierBasis1d((s-a)/(b-a), N))
+
+def evalmodesGrid_adjoint(f, N):
+	# adjoint (transpose) of mapOnRectangle.evalmodesGrid for an N x N modes matrix, applied to grid values f on the rectangle's grid:
+	# returns D with D[k, l] = sum(f*phi_kl) for the basis functions phi_kl of evalmodesGrid (k: y-direction, l: x-direction; cos for indices <= N//2, sin above),
+	# i.e. the derivative of sum(f*g) w.r.t. the fourier modes of g. The grid is equispaced with endpoint=False, so all sums are one real FFT per direction
+	maxMode = N//2
+	n = f.shape[0]
+	cosFreqs = np.arange(0, maxMode+1)
+	sinFreqs = np.arange(1, N-maxMode)
+	def dft(G, freqs, axis): # sum_i f_i*exp(-2*pi*1j*freq*i/n) from the rfft G for arbitrary integer frequencies (using conjugate symmetry for aliased ones)
+		idx = freqs % n
+		flip = idx > n//2
+		vals = np.take(G, np.where(flip, n-idx, idx), axis=axis)
+		sign = np.where(flip, -1.0, 1.0)
+		return vals.real + 1j*vals.imag*(sign.reshape((1, -1)) if axis == 1 else sign.reshape((-1, 1)))
+	Gx = np.fft.rfft(f, axis=1)
+	Cx = dft(Gx, cosFreqs, 1).real # sum over x of f*cos(2*pi*l*x')
+	Sx = -dft(Gx, sinFreqs, 1).imag # sum over x of f*sin(2*pi*l*x')
+	D = np.zeros((N, N))
+	for (cols, X) in [(slice(0, maxMode+1), Cx), (slice(maxMode+1, N), Sx)]:
+		Gy = np.fft.rfft(X, axis=0)
+		D[0:maxMode+1, cols] = dft(Gy, cosFreqs, 0).real
+		D[maxMode+1:N, cols] = -dft(Gy, sinFreqs, 0).imag
+	return D
+
 def extractsubfouriermatrix(mat, M):
 	N = mat.shape[0]
 	temp1 = mat[0:(M+1)//2,0:(M+1)//2]
@@ -261,153 +296,33 @@ class mapOnRectangle():
 
 	
 	
+	def fourierBasis(self, s, N, axis): # cached fourierBasis1d of the coordinates s in the direction axis ("x" or "y") of the rectangle
+		if axis == "x":
+			return cachedFourierBasis1d(s, self.rect.x1, self.rect.x2, N)
+		return cachedFourierBasis1d(s, self.rect.y1, self.rect.y2, N)
+	
 	def evalmodesGrid(self, modesmat, x, y, modes_fnc=None): # evaluate function on the whole grid given by x \times y where x and y are np.linspace objects
-		if not isinstance(x, np.ndarray):
-			x = np.array([[x]])
-		if not isinstance(y, np.ndarray):
-			y = np.array([[y]])
-		# evaluates fourier space decomposition in state space
+		# evaluates fourier space decomposition in state space, separably: values[m, n] = sum_kl modesmat[k, l]*By[m, k]*Bx[n, l]
+		# modes_fnc: optional basis tensor as returned by getPhiMat (of shape (len(y), len(x), N, N))
 		N = modesmat.shape[0]
-		maxMode = N//2
-		freqs = np.reshape(np.linspace(1, maxMode, N/2), (-1, 1))
-		M = len(x)
-		if modes_fnc is None:
-			print("no helper function")
-			phi_mat = np.zeros((M, M, N, N))
-			X, Y = np.meshgrid(x, y)
-			Xprime = (X-self.rect.x1)/(self.rect.x2-self.rect.x1)
-			Yprime = (Y-self.rect.y1)/(self.rect.y2-self.rect.y1)
-			for k in range(N):
-				for l in range(N):
-					if k == 0 and l == 0:
-						phi_mat[:, :, 0, 0] = np.ones((M,M))
-					elif k == 0 and l > 0 and l <= maxMode:
-						phi_mat[:, :, k, l] = np.cos(l*2*pi*Xprime)
-					elif k == 0 and l > 0 and l > maxMode:
-						phi_mat[:, :, k, l] = np.sin((l-maxMode)*2*pi*Xprime)
-					elif k > 0 and k <= maxMode and l == 0:
-						phi_mat[:, :, k, l] = np.cos(k*2*pi*Yprime)
-					elif k > 0 and k > maxMode and l == 0:
-						phi_mat[:, :, k, l] = np.sin((k-maxMode)*2*pi*Yprime)
-					elif k > 0 and l > 0:
-						if k <= maxMode and l <= maxMode:
-							phi_mat[:, :, k, l] = np.cos(k*2*pi*Yprime)*np.cos(l*2*pi*Xprime)
-						elif k <= maxMode and l > maxMode:
-							phi_mat[:, :, k, l] = np.cos(k*2*pi*Yprime)*np.sin((l-maxMode)*2*pi*Xprime)
-						elif k > maxMode and l <= maxMode:
-							phi_mat[:, :, k, l] = np.sin((k-maxMode)*2*pi*Yprime)*np.cos(l*2*pi*Xprime)
-						else:
-							phi_mat[:, :, k, l] = np.sin((k-maxMode)*2*pi*Yprime)*np.sin((l-maxMode)*2*pi*Xprime)
-			modes_fnc = phi_mat
-			print("done constructing helper function")
-		mm = np.reshape(modesmat, (1, 1, N, N))
-		mm = np.tile(mm, (M, M, 1, 1))
-		temp = mm*modes_fnc
-		return np.sum(temp, (2,3))
+		if modes_fnc is not None:
+			return np.tensordot(modes_fnc, modesmat, axes=([2, 3], [0, 1]))
+		return self.fourierBasis(y, N, "y").dot(modesmat).dot(self.fourierBasis(x, N, "x").T)
 
-	def getPhiMat(self):
-		x = self.x
-		y = self.y
+	def getPhiMat(self): # basis tensor phi_mat[m, n, k, l] = value of the basis function for the modes entry [k, l] at grid point (x[n], y[m])
 		N = self.fouriermodes.shape[0] # only for dimensionality, value of fouriermodes is not needed
-		maxMode = N//2	
-		M = len(x)
-		phi_mat = np.zeros((M, M, N, N))
-		X, Y = np.meshgrid(x, y)
-		Xprime = (X-self.rect.x1)/(self.rect.x2-self.rect.x1)
-		Yprime = (Y-self.rect.y1)/(self.rect.y2-self.rect.y1)
-		for k in range(N):
-			for l in range(N):
-				if k == 0 and l == 0:
-					phi_mat[:, :, 0, 0] = np.ones((M,M))
-				elif k == 0 and l > 0 and l <= maxMode:
-					phi_mat[:, :, k, l] = np.cos(l*2*pi*Xprime)
-				elif k == 0 and l > 0 and l > maxMode:
-					phi_mat[:, :, k, l] = np.sin((l-maxMode)*2*pi*Xprime)
-				elif k > 0 and k <= maxMode and l == 0:
-					phi_mat[:, :, k, l] = np.cos(k*2*pi*Yprime)
-				elif k > 0 and k > maxMode and l == 0:
-					phi_mat[:, :, k, l] = np.sin((k-maxMode)*2*pi*Yprime)
-				elif k > 0 and l > 0:
-					if k <= maxMode and l <= maxMode:
-						phi_mat[:, :, k, l] = np.cos(k*2*pi*Yprime)*np.cos(l*2*pi*Xprime)
-					elif k <= maxMode and l > maxMode:
-						phi_mat[:, :, k, l] = np.cos(k*2*pi*Yprime)*np.sin((l-maxMode)*2*pi*Xprime)
-					elif k > maxMode and l <= maxMode:
-						phi_mat[:, :, k, l] = np.sin((k-maxMode)*2*pi*Yprime)*np.cos(l*2*pi*Xprime)
-					else:
-						phi_mat[:, :, k, l] = np.sin((k-maxMode)*2*pi*Yprime)*np.sin((l-maxMode)*2*pi*Xprime)
-		return phi_mat
+		return np.einsum('mk,nl->mnkl', self.fourierBasis(self.y, N, "y"), self.fourierBasis(self.x, N, "x"))
 
 	def evalmodes(self, modesmat, x, y): # evaluate function at positions (x0,y0), (x1,y1), ...
 		# input: x, y = x0, y0 or
-		# 			x, y = np.array([x0, x1, ... , x_(M-1)]), np.array([y0, y1, ... , y_(M-1)])
-	
-		if (isinstance(x, (int, float)) or (isinstance(x, np.ndarray) and len(x) == 1)): # easy case (just one pair of points)
-			N = modesmat.shape[0]
-			maxMode = N//2
-			freqs = np.reshape(np.linspace(1, maxMode, N/2), (-1, 1))
-			phi_mat = np.zeros((N, N))
-			
-			xprime = (x-self.rect.x1)/(self.rect.x2-self.rect.x1)
-			yprime = (y-self.rect.y1)/(self.rect.y2-self.rect.y1)
-			for k in range(N):
-				for l in range(N):
-					if k == 0 and l == 0:
-						phi_mat[0, 0] = 1
-					elif k == 0 and l > 0 and l <= maxMode:
-						phi_mat[k, l] = np.cos(l*2*pi*xprime)
-					elif k == 0 and l > 0 and l > maxMode:
-						phi_mat[k, l] = np.sin((l-maxMode)*2*pi*xprime)
-					elif k > 0 and k <= maxMode and l == 0:
-						phi_mat[k, l] = np.cos(k*2*pi*yprime)
-					elif k > 0 and k > maxMode and l == 0:
-						phi_mat[k, l] = np.sin((k-maxMode)*2*pi*yprime)
-					elif k > 0 and l > 0:
-						if k <= maxMode and l <= maxMode:
-							phi_mat[k, l] = np.cos(k*2*pi*yprime)*np.cos(l*2*pi*xprime)
-						elif k <= maxMode and l > maxMode:
-							phi_mat[k, l] = np.cos(k*2*pi*yprime)*np.sin((l-maxMode)*2*pi*xprime)
-						elif k > maxMode and l <= maxMode:
-							phi_mat[k, l] = np.sin((k-maxMode)*2*pi*yprime)*np.cos(l*2*pi*xprime)
-						else:
-							phi_mat[k, l] = np.sin((k-maxMode)*2*pi*yprime)*np.sin((l-maxMode)*2*pi*xprime)
-			temp = modesmat*phi_mat
-			return np.sum(temp)
-		else:	# hard case: x and y are proper lists
-			# evaluates fourier space decomposition in state space
-			N = modesmat.shape[0]
-			maxMode = N//2
-			freqs = np.reshape(np.linspace(1, maxMode, N/2), (-1, 1))
-			#x = np.reshape(x, (1, -1))
-			M = x.shape[0]
-			phi_mat = np.zeros((M, N, N))
-			xprime = (x-self.rect.x1)/(self.rect.x2-self.rect.x1)
-			yprime = (y-self.rect.y1)/(self.rect.y2-self.rect.y1)
-			for k in range(N):
-				for l in range(N):
-					if k == 0 and l == 0:
-						phi_mat[:, 0, 0] = np.ones((M,))
-					elif k == 0 and l > 0 and l <= maxMode:
-						phi_mat[:, k, l] = np.cos(l*2*pi*xprime)
-					elif k == 0 and l > 0 and l > maxMode:
-						phi_mat[:, k, l] = np.sin((l-maxMode)*2*pi*xprime)
-					elif k > 0 and k <= maxMode and l == 0:
-						phi_mat[:, k, l] = np.cos(k*2*pi*yprime)
-					elif k > 0 and k > maxMode and l == 0:
-						phi_mat[:, k, l] = np.sin((k-maxMode)*2*pi*yprime)
-					elif k > 0 and l > 0:
-						if k <= maxMode and l <= maxMode:
-							phi_mat[:, k, l] = np.cos(k*2*pi*yprime)*np.cos(l*2*pi*xprime)
-						elif k <= maxMode and l > maxMode:
-							phi_mat[:, k, l] = np.cos(k*2*pi*yprime)*np.sin((l-maxMode)*2*pi*xprime)
-						elif k > maxMode and l <= maxMode:
-							phi_mat[:, k, l] = np.sin((k-maxMode)*2*pi*yprime)*np.cos(l*2*pi*xprime)
-						else:
-							phi_mat[:, k, l] = np.sin((k-maxMode)*2*pi*yprime)*np.sin((l-maxMode)*2*pi*xprime)
-			mm = np.reshape(modesmat, (1, N, N))
-			mm = np.tile(mm, (M, 1, 1))
-			temp = mm*phi_mat
-			return np.sum(temp, (1,2))
+		# 			x, y = np.array([x0, x1, ... , x_(M-1)]), np.array([y0, y1, ... , y_(M-1)]) (or arrays of any equal shape, e.g. from meshgrid)
+		# separable in x and y: value at point p is sum_kl modesmat[k, l]*By[p, k]*Bx[p, l] with the (cached) 1d bases of the points
+		x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+		N = modesmat.shape[0]
+		vals = np.sum(self.fourierBasis(y, N, "y").dot(modesmat)*self.fourierBasis(x, N, "x"), axis=1)
+		if vals.size == 1: # easy case (just one pair of points)
+			return vals[0]
+		return np.reshape(vals, x.shape)
 	
 	# overloading of basic arithmetic operations, in order to facilitate f + g, f*3 etc. for f,g mapOnInterval instances
 	def __add__(self, m):
@@ -421,7 +336,7 @@ class mapOnRectangle():
 				return mapOnRectangle(self.rect, "expl", self.values + m.values)
 			elif self.inittype == "wavelet":
 				if m.inittype == "wavelet":
-					return mapOnRectangle(self.rect, "wavelet", packWavelet(unpackWavelet(self.waveletcoeffs)+unpackWavelet(m.waveletcoeffs)))
+					return mapOnRectangle(self.rect, "wavelet", packWavelet(hW.flatWavelet(self.waveletcoeffs)+hW.flatWavelet(m.waveletcoeffs)))
 				else:
 					return mapOnRectangle(self.rect, "expl", self.values + m.values)
 			elif self.inittype == "handle":
@@ -448,7 +363,7 @@ class mapOnRectangle():
 				return mapOnRectangle(self.rect, "expl", self.values - m.values)
 			elif self.inittype == "wavelet":
 				if m.inittype == "wavelet":
-					return mapOnRectangle(self.rect, "wavelet", packWavelet(unpackWavelet(self.waveletcoeffs)-unpackWavelet(m.waveletcoeffs)))
+					return mapOnRectangle(self.rect, "wavelet", packWavelet(hW.flatWavelet(self.waveletcoeffs)-hW.flatWavelet(m.waveletcoeffs)))
 				else:
 					return mapOnRectangle(self.rect, "expl", self.values - m.values)
 			elif self.inittype == "handle":
@@ -483,7 +398,7 @@ class mapOnRectangle():
 			if self.inittype == "handle":
 				return mapOnRectangle(self.rect, "handle", lambda x, y: self.handle(x, y) * m)
 			elif self.inittype == "wavelet":
-				return mapOnRectangle(self.rect, "wavelet", packWavelet(unpackWavelet(self.waveletcoeffs)*m))
+				return mapOnRectangle(self.rect, "wavelet", packWavelet(hW.flatWavelet(self.waveletcoeffs)*m))
 			elif self.inittype == "fourier":
 				return mapOnRectangle(self.rect, "fourier", self.fouriermodes*m)
 			else:
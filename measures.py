@@ -81,22 +81,24 @@ class GaussianFourier2d(measure):
 		modes = self._mean + np.random.normal(0, 1, (self.mean.shape))*np.sqrt(self.eigenvals)
 		return mor.mapOnRectangle(self.rect, "fourier", modes)
 	
+	def precision(self): # diagonal of the inverse covariance over the fourier modes (1 for the constant mode, which has eigenvalue 0)
+		evs = np.array(self.eigenvals)
+		evs[0, 0] = 1
+		return 1/evs
+	
 	def covInnerProd(self, u1, u2):
-		evs = self.eigenvals
-		evs[0] = 1
-		multiplicator = 1/evs
-		multiplicator[0] = 1
-		return np.sum((u1.fouriermodes*multiplicator*u2.fouriermodes)**2)
+		return np.sum(u1.fouriermodes*self.precision()*u2.fouriermodes)
 	def normpart(self, u):
 		return 1.0/2*self.covInnerProd(u, u)
 	def norm(self, u):
 		return math.sqrt(self.covInnerProd(u, u))
 	def covProd(self, u):
-		evs = self.eigenvals
-		evs[0] = 1
-		multiplicator = 1/evs
-		multiplicator[0] = 1
-		return multiplicator*u.fouriermodes
+		return self.precision()*u.fouriermodes
+	def normpartGradient(self, u): # gradient of normpart w.r.t. the flattened fourier modes of u
+		return (self.precision()*u.fouriermodes).flatten()
+	
+	def normpartHessian(self, u): # diagonal of the Hessian of normpart w.r.t. the flattened fourier modes (constant in u)
+		return self.precision().flatten()
 		
 	@property
 	def mean(self):
@@ -137,6 +139,13 @@ class Besov11Wavelet(measure):
 	
 	def cumcovInnerProd(self, w1, w2):
 		raise NotImplementedError("no inner product structure for B11 prior!")
+	
+	def invCovDiagonal(self, numLevels): # weights kappa*4^((j-1)*s) of the level j coefficients (kappa for the 0th mode), as in GeneralizedGaussianWavelet2d
+		levels = waveletLevels(numLevels-1)
+		return self.kappa*4.0**(np.maximum(levels-1, 0)*self.s)
+	
+	def multiplyWithInvCov(self, u): # C^{-1} @ u of the Gaussian prior with the same kappa and s (on all levels of u), used by DI_adjoint_vec_wavelet
+		return self.invCovDiagonal(len(u.waveletcoeffs))*flatWavelet(u.waveletcoeffs)
 
 	def normpart(self, u):
 		j_besovterm = np.zeros((self.maxJ,))
@@ -168,25 +177,24 @@ class GeneralizedGaussianWavelet2d(measure):
 		assert(maxJ <= self.rect.resol+1) # else to high resolution for rectangle
 		self.multiplier = np.array([2**(-j*self.s) for j in range(maxJ-1)])
 		
-		modes1 = [np.array([[0.0]])]
-		modes2 = ([[np.zeros((2**j, 2**j)) for m in range(3)] for j in range(self.maxJ-1)])
-		self._mean = modes1 + modes2
+		self._mean = packWavelet(np.zeros((4**(self.maxJ-1),)))
 		
+	def invCovDiagonal(self, numLevels): # kappa*4^((j-1)*s) for all unpacked coefficients of levels j = 0, ..., numLevels-1 (kappa for a0), i.e. the diagonal of C^{-1}
+		levels = waveletLevels(numLevels-1)
+		return self.kappa*4.0**(np.maximum(levels-1, 0)*self.s)
+	
 	def sample(self):
-		modes1 = [np.array([[0.0]])]
-		modes2 = ([[self.kappa_calc*self.multiplier[j]*np.random.normal(0, 1, (2**j, 2**j)) for m in range(3)] for j in range(self.maxJ-1)])
-		
-		modes = modes1 + modes2# + modesrest
-		u = mor.mapOnRectangle(self.rect, "wavelet", modes)
+		# one draw for all levels (in the order of the unpacked coefficients, so the same numbers as drawing level by level)
+		levels = waveletLevels(self.maxJ-1)[1:]
+		modes = np.zeros((4**(self.maxJ-1),))
+		modes[1:] = self.kappa_calc*self.multiplier[levels-1]*np.random.normal(0, 1, (len(levels),))
+		u = mor.mapOnRectangle(self.rect, "wavelet", packWavelet(modes))
 		return u
 	
 	def covInnerProd(self, w1, w2):
-		j_besovprod = np.zeros((self.maxJ,))
-		j_besovprod[0] = w1.waveletcoeffs[0]*w2.waveletcoeffs[0]
-		for j in range(1, min(self.maxJ, len(w1.waveletcoeffs), len(w2.waveletcoeffs))):
-			jnumber = j-1 # account for 0th mode (special)
-			j_besovprod[j] = np.sum((w1.waveletcoeffs[j][0]*w2.waveletcoeffs[j][0]+w1.waveletcoeffs[j][1]*w2.waveletcoeffs[j][1]+w1.waveletcoeffs[j][2]*w2.waveletcoeffs[j][2])*4**(jnumber*self.s))
-		return self.kappa*np.sum(j_besovprod)	
+		J = min(self.maxJ, len(w1.waveletcoeffs), len(w2.waveletcoeffs))
+		n = 4**(J-1)
+		return np.dot(flatWavelet(w1.waveletcoeffs)[0:n]*flatWavelet(w2.waveletcoeffs)[0:n], self.invCovDiagonal(J))
 	
 	def cumcovInnerProd(self, w1, w2):
 		j_besovprod = np.zeros((self.maxJ,))
@@ -196,39 +204,14 @@ class GeneralizedGaussianWavelet2d(measure):
 			j_besovprod[j] = np.sum((w1.waveletcoeffs[j][0]*w2.waveletcoeffs[j][0]+w1.waveletcoeffs[j][1]*w2.waveletcoeffs[j][1]+w1.waveletcoeffs[j][2]*w2.waveletcoeffs[j][2])*4**(jnumber*self.s))
 		return self.kappa*np.cumsum(j_besovprod)
 	
-	def multiplyWithInvCov(self, u): # yields the result of C^{-1} @ u
-		wc = packWavelet(np.array(unpackWavelet(u.waveletcoeffs), copy = True))
-		MM = len(wc)
-		s = self.s
-		kappa = self.kappa
-		factors = [kappa] + [kappa*4**(j*s) for j in range(MM-1)]
-		wc[0] = wc[0]*factors[0]
-		for m in range(1, MM):
-			wc[m][0] = wc[m][0]*factors[m]
-			wc[m][1] = wc[m][1]*factors[m]
-			wc[m][2] = wc[m][2]*factors[m]
-		normpartvec = unpackWavelet(wc)
-		return normpartvec
+	def multiplyWithInvCov(self, u): # yields the result of C^{-1} @ u (on all levels of u)
+		return self.invCovDiagonal(len(u.waveletcoeffs))*flatWavelet(u.waveletcoeffs)
 	
 	def Cov(self):
-		MM = self.maxJ
-		s = self.s
-		kappa = self.kappa
-		wc0 = [np.array([[1/kappa]])]
-		wc_rem = [[1/kappa * 4**(-j*s)*np.ones((2**j, 2**j)) for m in range(3)] for j in range(self.maxJ-1)]
-		wc = wc0 + wc_rem
-		Cov = unpackWavelet(wc)
-		return Cov
+		return 1/self.invCovDiagonal(self.maxJ)
 	
 	def invCov(self):
-		MM = self.maxJ
-		s = self.s
-		kappa = self.kappa
-		wc0 = [np.array([[kappa]])]
-		wc_rem = [[kappa * 4**(j*s)*np.ones((2**j, 2**j)) for m in range(3)] for j in range(self.maxJ-1)]
-		wc = wc0 + wc_rem
-		Cov = unpackWavelet(wc)
-		return Cov
+		return self.invCovDiagonal(self.maxJ)
 	
 	
 	
@@ -237,22 +220,23 @@ class GeneralizedGaussianWavelet2d(measure):
 	def norm(self, u):
 		return math.sqrt(self.covInnerProd(u, u))
 	
+	def normpartGradient(self, u): # gradient of normpart w.r.t. the unpacked wavelet coefficients of u
+		return self.normpartHessian(u)*flatWavelet(u.waveletcoeffs)
+	
+	def normpartHessian(self, u): # diagonal of the Hessian of normpart w.r.t. the unpacked wavelet coefficients of u (coefficients beyond maxJ don't enter normpart)
+		H = self.invCovDiagonal(len(u.waveletcoeffs))
+		H[4**(self.maxJ-1):] = 0
+		return H
+	
 	def multiplyWithCov(self, u, inputtype="function"):
 		if inputtype == "wc_unpacked":
-			u_wc = packWavelet(u)
-			num = min(self.maxJ, len(u_wc))
+			u_vec = np.asarray(u, dtype=np.float64)
 		else:
-			u_wc = u.waveletcoeffs
-			num = min(self.maxJ, len(u.waveletcoeffs))
-		u_mult_wc = packWavelet(np.zeros(unpackWavelet(u_wc).shape))
-		
-		u_mult_wc[0] = u_wc[0]/self.kappa
-		for j in range(1, num):
-			jnumber = j-1 # account for 0th mode (special)
-			u_mult_wc[j] = [u_wc[j][0]*4**(-jnumber*self.s)/self.kappa, u_wc[j][1]*4**(-jnumber*self.s)/self.kappa, u_wc[j][1]*4**(-jnumber*self.s)/self.kappa]
-		
-		
-		return mor.mapOnRectangle(self.rect, "wavelet", u_mult_wc)
+			u_vec = flatWavelet(u.waveletcoeffs)
+		n = min(4**(self.maxJ-1), len(u_vec))
+		u_mult = np.zeros((len(u_vec),))
+		u_mult[0:n] = u_vec[0:n]/self.invCovDiagonal(self.maxJ)[0:n]
+		return mor.mapOnRectangle(self.rect, "wavelet", packWavelet(u_mult))
 		
 	@property
 	def mean(self):
@@ -347,9 +331,14 @@ class GeneralizedWavelet2d(measure):
 		self.multiplier = np.array([2**(-j*self.s) for j in range(maxJ-1)])
 		self.numbergenerator = exponentialDist(p)
 		
-		modes1 = [np.array([[0.0]])]
-		modes2 = ([[np.zeros((2**j, 2**j)) for m in range(3)] for j in range(self.maxJ-1)])
-		self._mean = modes1 + modes2
+		self._mean = packWavelet(np.zeros((4**(self.maxJ-1),)))
+	
+	def invCovDiagonal(self, numLevels): # as for GeneralizedGaussianWavelet2d (the weights of covInnerProd)
+		levels = waveletLevels(numLevels-1)
+		return self.kappa*4.0**(np.maximum(levels-1, 0)*self.s)
+	
+	def multiplyWithInvCov(self, u): # C^{-1} @ u for the Gaussian case p = 2 (on all levels of u)
+		return self.invCovDiagonal(len(u.waveletcoeffs))*flatWavelet(u.waveletcoeffs)
 		
 	def sample(self):
 		modes1 = [np.array([[0.0]])]
@@ -363,13 +352,11 @@ class GeneralizedWavelet2d(measure):
 	
 	def covInnerProd(self, w1, w2): # NOT an inner product for p != 2!!!
 		fn = lambda x: np.nan_to_num(x/np.abs(x)**(2-self.p))
+		J = min(self.maxJ, len(w1.waveletcoeffs), len(w2.waveletcoeffs))
+		n = 4**(J-1)
 		with np.errstate(divide='ignore',invalid='ignore'): # is alright because np.nan_to_num catches all errors
-			j_besovprod = np.zeros((self.maxJ,))
-			j_besovprod[0] = fn(w1.waveletcoeffs[0])*w2.waveletcoeffs[0]
-			for j in range(1, min(self.maxJ, len(w1.waveletcoeffs), len(w2.waveletcoeffs))):
-				jnumber = j-1 # account for 0th mode (special)
-				j_besovprod[j] = np.sum((fn(w1.waveletcoeffs[j][0])*w2.waveletcoeffs[j][0]+fn(w1.waveletcoeffs[j][1])*w2.waveletcoeffs[j][1]+fn(w1.waveletcoeffs[j][2])*w2.waveletcoeffs[j][2])*4**(jnumber*self.s))
-		return self.kappa*np.sum(j_besovprod)	
+			prod = fn(flatWavelet(w1.waveletcoeffs)[0:n])*flatWavelet(w2.waveletcoeffs)[0:n]
+		return np.dot(prod, self.invCovDiagonal(J))
 	
 	"""def cumcovInnerProd(self, w1, w2):
 		j_besovprod = np.zeros((self.maxJ,))
@@ -380,12 +367,9 @@ class GeneralizedWavelet2d(measure):
 		return self.kappa*np.cumsum(j_besovprod)"""
 
 	def normpart(self, u):
-		j_besovprod = np.zeros((self.maxJ,))
-		j_besovprod[0] = np.abs(u.waveletcoeffs[0])**self.p
-		for j in range(1, min(self.maxJ, len(u.waveletcoeffs))):
-			jnumber = j-1 # account for 0th mode (special)
-			j_besovprod[j] = np.sum((np.abs(u.waveletcoeffs[j][0])**self.p+np.abs(u.waveletcoeffs[j][1])**self.p+np.abs(u.waveletcoeffs[j][2])**self.p)*4**(jnumber*self.p*((self.s+1)/2-1/self.p)))
-		return self.kappa/self.p*np.sum(j_besovprod)	
+		J = min(self.maxJ, len(u.waveletcoeffs))
+		weights = 4.0**(np.maximum(waveletLevels(J-1)-1, 0)*self.p*((self.s+1)/2-1/self.p))
+		return self.kappa/self.p*np.dot(np.abs(flatWavelet(u.waveletcoeffs)[0:4**(J-1)])**self.p, weights)
 	def norm(self, u):
 		return self.p*self.normpart(u)**(1/self.p)
 		
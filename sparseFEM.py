@@ -0,0 +1,465 @@
+from __future__ import division
+import numpy as np
+import scipy.sparse as sps
+import scipy.sparse.linalg as spsla
+from caching import *
+
+# Sparse P1 finite element building blocks which do not depend on fenics.
+# The stiffness matrix A(k) = int k * nabla(u)*nabla(v) dx of a piecewise linear k is linear in the nodal values of k,
+# so everything that depends on the mesh only is precomputed once and A(k) is assembled by one sparse matrix-vector product.
+
+class P1StiffnessAssembler():
+	# precomputes the element stiffness contributions and the scatter pattern of a P1 triangulation
+	# coords: (numDofs, 2) coordinates of the degrees of freedom, cells: (numCells, 3) dof indices of the triangles
+	def __init__(self, coords, cells):
+		coords = np.asarray(coords, dtype=np.float64)
+		cells = np.asarray(cells, dtype=np.int64)
+		self.numDofs = coords.shape[0]
+		self.coords = coords
+		self.cells = cells
+		numCells = cells.shape[0]
+
+		# gradients of the barycentric coordinates on every triangle
+		p0 = coords[cells[:, 0], :]
+		p1 = coords[cells[:, 1], :]
+		p2 = coords[cells[:, 2], :]
+		det = (p1[:, 0]-p0[:, 0])*(p2[:, 1]-p0[:, 1]) - (p2[:, 0]-p0[:, 0])*(p1[:, 1]-p0[:, 1])
+		self.areas = np.abs(det)/2
+		grads = np.zeros((numCells, 3, 2))
+		grads[:, 0, 0] = p1[:, 1] - p2[:, 1]
+		grads[:, 0, 1] = p2[:, 0] - p1[:, 0]
+		grads[:, 1, 0] = p2[:, 1] - p0[:, 1]
+		grads[:, 1, 1] = p0[:, 0] - p2[:, 0]
+		grads[:, 2, 0] = p0[:, 1] - p1[:, 1]
+		grads[:, 2, 1] = p1[:, 0] - p0[:, 0]
+		grads = grads/det.reshape((-1, 1, 1))
+		self.grads = grads
+
+		# geometric element matrices area*grad(phi_i).grad(phi_j); k enters via its (exact) cell mean (k_0+k_1+k_2)/3
+		Ke = np.einsum('cid,cjd->cij', grads, grads)*self.areas.reshape((-1, 1, 1))
+		rows = np.repeat(cells, 3, axis=1).flatten()
+		cols = np.tile(cells, (1, 3)).flatten()
+
+		# sort the COO entries into CSR order once: entry e ends up in data[position[e]]
+		lin = rows*self.numDofs + cols
+		uniq, position = np.unique(lin, return_inverse=True)
+		position = position.flatten()
+		self.position = position
+		self.indices = (uniq % self.numDofs).astype(np.int32)
+		self.indptr = np.concatenate((np.array([0]), np.cumsum(np.bincount(uniq // self.numDofs, minlength=self.numDofs)))).astype(np.int32)
+		self.nnz = len(uniq)
+
+		# sparse map from nodal values of k to the CSR data of A(k)
+		entryVals = np.repeat(Ke.reshape((numCells, 9))/3, 3, axis=1).flatten()
+		entryRows = np.repeat(position, 3)
+		entryCols = np.repeat(cells, 9, axis=0).flatten()
+		self.kToData = sps.csr_matrix((entryVals, (entryRows, entryCols)), shape=(self.nnz, self.numDofs))
+		self._massLU = None
+
+	def assemble(self, kvec): # returns A(k) as scipy.sparse.csr_matrix for nodal values kvec of k
+		data = self.kToData.dot(np.asarray(kvec, dtype=np.float64))
+		return sps.csr_matrix((data, self.indices, self.indptr), shape=(self.numDofs, self.numDofs))
+
+	def derivativeMatrix(self, uvec): # sparse (numDofs, numDofs) matrix M with A(k) u = M k for all nodal k (A(k) u is linear in k), e.g. for blocks of tangent right hand sides
+		rowSums = sps.csr_matrix((np.asarray(uvec, dtype=np.float64)[self.indices], np.arange(self.nnz), self.indptr), shape=(self.numDofs, self.nnz))
+		return rowSums.dot(self.kToData).tocsr()
+
+	def innerProd(self, kvec, uvec, vvec): # \int k * nabla(u)*nabla(v) for nodal vectors k, u, v
+		return np.dot(uvec, self.assemble(kvec).dot(vvec))
+
+	def pointEvaluation(self, points, tol=1e-10): # sparse (numPoints, numDofs) matrix P with (P u)_i = u(points[i]) for P1 functions u
+		# its transpose has the point sources dirac_{x_i} as columns, so it doubles as block right hand side for adjoint solves
+		points = np.asarray(points, dtype=np.float64).reshape((-1, 2))
+		p0 = self.coords[self.cells[:, 0], :]
+		e1 = self.coords[self.cells[:, 1], :] - p0
+		e2 = self.coords[self.cells[:, 2], :] - p0
+		det = e1[:, 0]*e2[:, 1] - e1[:, 1]*e2[:, 0]
+		cellInd = np.zeros((points.shape[0],), dtype=np.int64)
+		bary = np.zeros((points.shape[0], 3))
+		chunk = 64 # bounds the (chunk, numCells) temporaries
+		for start in range(0, points.shape[0], chunk):
+			d = points[start:start+chunk, np.newaxis, :] - p0[np.newaxis, :, :]
+			l1 = (d[:, :, 0]*e2[:, 1] - d[:, :, 1]*e2[:, 0])/det
+			l2 = (e1[:, 0]*d[:, :, 1] - e1[:, 1]*d[:, :, 0])/det
+			l0 = 1 - l1 - l2
+			inside = (l0 >= -tol) & (l1 >= -tol) & (l2 >= -tol)
+			if not np.all(np.any(inside, axis=1)):
+				raise ValueError("point outside of mesh")
+			ind = np.argmax(inside, axis=1) # first cell containing the point
+			rng = np.arange(ind.shape[0])
+			cellInd[start:start+chunk] = ind
+			bary[start:start+chunk, :] = np.stack((l0[rng, ind], l1[rng, ind], l2[rng, ind]), axis=1)
+		rows = np.repeat(np.arange(points.shape[0]), 3)
+		return sps.csr_matrix((bary.flatten(), (rows, self.cells[cellInd, :].flatten())), shape=(points.shape[0], self.numDofs))
+
+	def massMatrix(self): # P1 mass matrix \int u*v, sharing the sparsity pattern of A(k)
+		Me = (np.ones((3, 3)) + np.eye(3)).flatten()/12
+		data = np.bincount(self.position, weights=np.outer(self.areas, Me).flatten(), minlength=self.nnz)
+		return sps.csr_matrix((data, self.indices, self.indptr), shape=(self.numDofs, self.numDofs))
+
+	def projectGradProd(self, kvec, uvec, vvec): # L2 projection of k * nabla(u).nabla(v) onto P1 (the mass matrix is factorized on first use)
+		if self._massLU is None:
+			self._massLU = spsla.splu(self.massMatrix().tocsc())
+		kc = np.asarray(kvec)[self.cells]
+		local = (self.cellGradProd(uvec, vvec)/12).reshape((-1, 1))*(kc + np.sum(kc, axis=1).reshape((-1, 1))) # \int_T k*phi_a = area_T*(k_a + k_0+k_1+k_2)/12
+		return self._massLU.solve(np.bincount(self.cells.flatten(), weights=local.flatten(), minlength=self.numDofs))
+
+	def cellGradProd(self, uvec, vvec): # area_T * nabla(u).nabla(v) on every triangle T (both gradients are constant there)
+		gu = np.einsum('cid,ci->cd', self.grads, np.asarray(uvec)[self.cells])
+		gv = np.einsum('cid,ci->cd', self.grads, np.asarray(vvec)[self.cells])
+		return self.areas*np.sum(gu*gv, axis=1)
+
+	def gradProdWeights(self, uvec, vvec): # nodal weights w with \int phi * nabla(u)*nabla(v) = phi . w for every P1 function phi
+		return np.bincount(self.cells.flatten(), weights=np.repeat(self.cellGradProd(uvec, vvec)/3, 3), minlength=self.numDofs)
+
+def structuredRectangleMesh(x1, y1, x2, y2, nx, ny):
+	# vertices and cells of fenics' RectangleMesh(Point(x1,y1), Point(x2,y2), nx, ny) (diagonal "right") in the same numbering:
+	# vertex j*(nx+1)+i sits at (x_i, y_j), every square is split into the triangles [v0,v1,v3] and [v0,v2,v3]
+	XX, YY = np.meshgrid(np.linspace(x1, x2, nx+1), np.linspace(y1, y2, ny+1))
+	coords = np.stack((XX.flatten(), YY.flatten()), axis=1)
+	II, JJ = np.meshgrid(np.arange(nx), np.arange(ny))
+	v0 = (JJ*(nx+1) + II).flatten()
+	v1 = v0 + 1
+	v2 = v0 + nx + 1
+	v3 = v1 + nx + 1
+	cells = np.zeros((2*nx*ny, 3), dtype=np.int64)
+	cells[0::2, :] = np.stack((v0, v1, v3), axis=1)
+	cells[1::2, :] = np.stack((v0, v2, v3), axis=1)
+	return coords, cells
+
+def boundaryFacets(nx, ny): # (numFacets, 2) vertex indices of the exterior edges of structuredRectangleMesh(..., nx, ny)
+	bottom = np.arange(nx)
+	top = ny*(nx+1) + np.arange(nx)
+	left = np.arange(ny)*(nx+1)
+	right = left + nx
+	return np.concatenate((np.stack((bottom, bottom+1), axis=1), np.stack((top, top+1), axis=1), np.stack((left, left+nx+1), axis=1), np.stack((right, right+nx+1), axis=1)))
+
+class rectangleSides():
+	# vectorized Dirichlet boundary specification by named sides of the rectangle ("left", "right", "bottom", "top")
+	def __init__(self, *sides):
+		for side in sides:
+			if side not in ("left", "right", "bottom", "top"):
+				raise ValueError("unknown side " + str(side))
+		self.sides = frozenset(sides)
+
+	def inside(self, x, y, bounds, tol=1e-10): # boolean array: which of the points (x, y) lie on one of the sides of the rectangle bounds = (x1, y1, x2, y2)
+		(x1, y1, x2, y2) = bounds
+		tol = tol*max(x2-x1, y2-y1)
+		mask = np.zeros(np.shape(x), dtype=bool)
+		if "left" in self.sides:
+			mask |= np.abs(x - x1) <= tol
+		if "right" in self.sides:
+			mask |= np.abs(x - x2) <= tol
+		if "bottom" in self.sides:
+			mask |= np.abs(y - y1) <= tol
+		if "top" in self.sides:
+			mask |= np.abs(y - y2) <= tol
+		return mask
+
+	def __eq__(self, other):
+		return isinstance(other, rectangleSides) and self.sides == other.sides
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __hash__(self):
+		return hash(self.sides)
+
+class boundaryPredicate():
+	# vectorized Dirichlet boundary specification by a predicate fnc(x, y) on coordinate arrays returning a boolean array
+	def __init__(self, fnc):
+		self.fnc = fnc
+
+	def inside(self, x, y, bounds):
+		return np.zeros(np.shape(x), dtype=bool) | np.asarray(self.fnc(x, y), dtype=bool)
+
+	def __eq__(self, other):
+		return isinstance(other, boundaryPredicate) and self.fnc is other.fnc
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __hash__(self):
+		return hash(self.fnc)
+
+def evalBoundarySpec(spec, points, bounds): # evaluates a boundary specification on an array of points (numPoints, 2)
+	if hasattr(spec, "inside"):
+		return spec.inside(points[:, 0], points[:, 1], bounds)
+	return np.array([bool(spec(points[m, :])) for m in range(points.shape[0])], dtype=bool) # pointwise callback boundary_D_boolean(x) as used with fenics' SubDomain
+
+def dirichletBoundary(x1, y1, x2, y2, nx, ny, spec):
+	# exterior facets of structuredRectangleMesh(x1, y1, x2, y2, nx, ny) and a mask of the Dirichlet ones; like fenics' SubDomain.mark, a facet is
+	# Dirichlet if both its vertices and its midpoint satisfy spec. Only boundary points are evaluated, and results are cached per mesh and spec
+	def build():
+		coords, cells = structuredRectangleMesh(x1, y1, x2, y2, nx, ny)
+		facets = boundaryFacets(nx, ny)
+		pa = coords[facets[:, 0], :]
+		pb = coords[facets[:, 1], :]
+		bounds = (x1, y1, x2, y2)
+		isDirichlet = evalBoundarySpec(spec, pa, bounds) & evalBoundarySpec(spec, pb, bounds) & evalBoundarySpec(spec, (pa+pb)/2, bounds)
+		return (facets, isDirichlet)
+	return _dirichletBoundaryCache.get((x1, y1, x2, y2, nx, ny, spec), build)
+
+class kappaOperator():
+	# stiffness matrix A(k) with the Dirichlet dofs eliminated and the remaining block factorized once
+	# solve() can then be called for any number of right hand sides (and Dirichlet values)
+	def __init__(self, A, dirichletDofs):
+		self.A = A.tocsr()
+		n = self.A.shape[0]
+		isFree = np.ones((n,), dtype=bool)
+		isFree[np.asarray(dirichletDofs, dtype=np.int64)] = False
+		self.freeDofs = np.nonzero(isFree)[0]
+		self.dirichletDofs = np.nonzero(~isFree)[0]
+		Afree = self.A[self.freeDofs, :]
+		self.A_ff = Afree[:, self.freeDofs].tocsc()
+		self.A_fd = Afree[:, self.dirichletDofs].tocsr()
+		self.setupSolver()
+
+	def setupSolver(self):
+		self.lu = spsla.splu(self.A_ff)
+
+	def solveFree(self, rhs, x0=None, basis=None): # solves A_ff x_f = rhs, rhs can be (numFree,) or (numFree, m). Initial guesses are only used by iterative solvers
+		return self.lu.solve(rhs)
+
+	def solve(self, b, dirichletValues=None, x0=None, basis=None): # solves A(k) x = b on the free dofs with x = dirichletValues (default 0) on the Dirichlet dofs; b can be (n,) or (n, m)
+		# x0 (full initial guess) and basis (columns spanning a recycled subspace) warm start iterative solvers
+		b = np.asarray(b, dtype=np.float64)
+		x = np.zeros(b.shape)
+		rhs = b[self.freeDofs]
+		if dirichletValues is not None:
+			x[self.dirichletDofs] = dirichletValues
+			rhs = rhs - self.A_fd.dot(x[self.dirichletDofs])
+		x[self.freeDofs] = self.solveFree(rhs, None if x0 is None else x0[self.freeDofs], None if basis is None else basis[self.freeDofs, :])
+		return x
+
+def prolongationStructured(nc): # P1 interpolation from structuredRectangleMesh(..., nc, nc) to its uniform refinement (2nc x 2nc), both in vertex numbering
+	# the refined "right" triangulation is nested, so every fine vertex is the midpoint of the coarse vertices floor(I/2, J/2) and ceil(I/2, J/2)
+	nf = 2*nc
+	II, JJ = np.meshgrid(np.arange(nf+1), np.arange(nf+1))
+	II = II.flatten()
+	JJ = JJ.flatten()
+	rows = np.concatenate((np.arange((nf+1)**2), np.arange((nf+1)**2)))
+	cols = np.concatenate(((JJ//2)*(nc+1) + II//2, ((JJ+1)//2)*(nc+1) + (II+1)//2))
+	return sps.csr_matrix((0.5*np.ones(rows.shape), (rows, cols)), shape=((nf+1)**2, (nc+1)**2)) # duplicate entries (coarse vertices) are summed up
+
+class multigridHierarchy():
+	# mesh dependent part of geometric multigrid on the dyadic grids 2^resol x 2^resol, ..., 2^coarsestResol x 2^coarsestResol
+	# prolongations are restricted to free (non-Dirichlet) dofs; it is built once and reused for every A(k)
+	# vertexOfDof maps the dofs of the finest level to structuredRectangleMesh vertices (None if they coincide)
+	def __init__(self, resol, dirichletDofs, vertexOfDof=None, coarsestResol=2, numSmooth=2, omega=2/3, tol=1e-10, maxiter=500):
+		self.numSmooth = numSmooth
+		self.omega = omega
+		self.tol = tol
+		self.maxiter = maxiter
+		self.iterations = 0 # total number of PCG iterations, for diagnostics
+		self.lastStats = None # (iterations, relative initial residual, relative final residual) of the last PCG run
+		n = 2**resol
+		numDofs = (n+1)**2
+		isFree = np.ones((numDofs,), dtype=bool)
+		isFree[np.asarray(dirichletDofs, dtype=np.int64)] = False
+		if vertexOfDof is None:
+			vertexOfDof = np.arange(numDofs)
+		freeRows = np.nonzero(isFree)[0]
+		isFreeVertex = np.ones((numDofs,), dtype=bool)
+		isFreeVertex[vertexOfDof[~isFree]] = False
+		rowVertices = vertexOfDof[freeRows]
+		self.prolongations = []
+		for r in range(resol, max(coarsestResol, 1), -1):
+			nc = 2**(r-1)
+			# coarse vertex (i,j) coincides with fine vertex (2i,2j), so it is Dirichlet iff that one is
+			II, JJ = np.meshgrid(np.arange(nc+1), np.arange(nc+1))
+			isFreeCoarse = isFreeVertex[(2*JJ*(2*nc+1) + 2*II).flatten()]
+			coarseVertices = np.nonzero(isFreeCoarse)[0]
+			self.prolongations.append(prolongationStructured(nc)[rowVertices, :][:, coarseVertices].tocsr())
+			rowVertices = coarseVertices
+			isFreeVertex = isFreeCoarse
+
+	def pcg(self, As, Dinvs, lu, b, x0=None): # preconditioned conjugate gradients for As[0] x = b with one V-cycle as preconditioner, starting in x0
+		bnorm = np.linalg.norm(b)
+		if bnorm == 0:
+			self.lastStats = (0, 0.0, 0.0)
+			return np.zeros(b.shape)
+		if x0 is None:
+			x = np.zeros(b.shape)
+			r = b.copy()
+		else:
+			x = x0.copy()
+			r = b - As[0].dot(x)
+		r0norm = np.linalg.norm(r)
+		rnorm = r0norm
+		numIt = 0
+		if rnorm > self.tol*bnorm:
+			z = self.vcycle(As, Dinvs, lu, r, 0)
+			p = z.copy()
+			rz = np.dot(r, z)
+			for it in range(self.maxiter):
+				Ap = As[0].dot(p)
+				alpha = rz/np.dot(p, Ap)
+				x += alpha*p
+				r -= alpha*Ap
+				numIt += 1
+				rnorm = np.linalg.norm(r)
+				if rnorm <= self.tol*bnorm:
+					break
+				z = self.vcycle(As, Dinvs, lu, r, 0)
+				rzNew = np.dot(r, z)
+				p = z + (rzNew/rz)*p
+				rz = rzNew
+		self.iterations += numIt
+		self.lastStats = (numIt, r0norm/bnorm, rnorm/bnorm)
+		return x
+
+	def vcycle(self, As, Dinvs, lu, b, level): # symmetric V-cycle with damped Jacobi smoothing and a direct solve on the coarsest level
+		if level == len(As)-1:
+			return lu.solve(b)
+		A = As[level]
+		x = self.omega*Dinvs[level]*b
+		for m in range(self.numSmooth-1):
+			x += self.omega*Dinvs[level]*(b - A.dot(x))
+		P = self.prolongations[level]
+		x += P.dot(self.vcycle(As, Dinvs, lu, P.T.dot(b - A.dot(x)), level+1))
+		for m in range(self.numSmooth):
+			x += self.omega*Dinvs[level]*(b - A.dot(x))
+		return x
+
+class multigridOperator(kappaOperator):
+	# like kappaOperator, but solves with multigrid preconditioned CG instead of a sparse LU factorization
+	# setup per A(k) only consists of the Galerkin coarse operators P^T A P, so memory stays linear in the number of dofs
+	def __init__(self, A, dirichletDofs, hierarchy):
+		self.hierarchy = hierarchy
+		kappaOperator.__init__(self, A, dirichletDofs)
+
+	def setupSolver(self):
+		self.As = [self.A_ff.tocsr()]
+		for P in self.hierarchy.prolongations:
+			self.As.append((P.T.dot(self.As[-1]).dot(P)).tocsr())
+		self.Dinvs = [1/A.diagonal() for A in self.As]
+		self.lu = spsla.splu(self.As[-1].tocsc())
+
+	def solveFree(self, rhs, x0=None, basis=None):
+		if rhs.ndim == 1:
+			if basis is not None: # Galerkin projection onto x0 + span(basis): the A-norm optimal start in the recycled subspace
+				x0 = np.zeros(rhs.shape) if x0 is None else x0
+				AW = self.As[0].dot(basis)
+				x0 = x0 + basis.dot(np.linalg.solve(basis.T.dot(AW), basis.T.dot(rhs - self.As[0].dot(x0))))
+			return self.hierarchy.pcg(self.As, self.Dinvs, self.lu, rhs, x0)
+		return np.stack([self.hierarchy.pcg(self.As, self.Dinvs, self.lu, rhs[:, m]) for m in range(rhs.shape[1])], axis=1)
+
+class solutionHistory():
+	# remembers recent solutions of A(k) x = b per kind of solve (e.g. "state", "adjoint") for warm starting iterative solves along
+	# MCMC chains and line searches: the start is the solution belonging to the nearest previously seen k, optionally improved by
+	# a Galerkin projection onto the span of the last `recycle` solutions
+	def __init__(self, maxsize=8, recycle=0):
+		self.maxsize = maxsize
+		self.recycle = recycle
+		self._store = {}
+		self.solves = 0
+		self.iterations = 0
+		self.savedIterations = 0.0
+
+	def store(self, key, kvec, x):
+		entries = self._store.setdefault(key, [])
+		entries.append((np.array(kvec, copy=True), np.array(x, copy=True)))
+		if len(entries) > self.maxsize:
+			entries.pop(0)
+
+	def nearest(self, key, kvec): # solution for the stored k closest to kvec (None if there is none)
+		entries = self._store.get(key, [])
+		if len(entries) == 0:
+			return None
+		dists = [np.linalg.norm(kvec - kk) for kk, x in entries]
+		return entries[int(np.argmin(dists))][1]
+
+	def basis(self, key): # orthonormal basis of the last `recycle` solutions (None if recycling is switched off)
+		entries = self._store.get(key, [])
+		if self.recycle <= 0 or len(entries) == 0:
+			return None
+		Q, R = np.linalg.qr(np.stack([x for kk, x in entries[-self.recycle:]], axis=1))
+		keep = np.abs(np.diag(R)) > 1e-10*np.max(np.abs(np.diag(R)))
+		return Q[:, keep]
+
+	def record(self, stats): # bookkeeping of iteration savings from the PCG statistics (iterations, initial residual, final residual)
+		numIt, r0, r1 = stats
+		self.solves += 1
+		self.iterations += numIt
+		if numIt > 0 and 0 < r0 < 1 and r1 < r0:
+			# a cold start would have had to reduce the residual from 1 to r0 first, at the observed convergence rate
+			self.savedIterations += numIt*np.log(r0)/np.log(r1/r0)
+
+	def report(self): # summary of warm started solves: iterations used and (estimated) iterations saved
+		return {"solves": self.solves, "iterations": self.iterations, "savedIterations": self.savedIterations,
+			"savedFraction": self.savedIterations/(self.iterations+self.savedIterations) if self.iterations+self.savedIterations > 0 else 0.0}
+
+	def clear(self):
+		self._store = {}
+
+class kappaOperatorCache(lruCache):
+	# bounded LRU cache of assembled and factorized stiffness operators A(k) = k*dot(grad(u),grad(v))*dx (with Dirichlet dofs eliminated)
+	# keyed by the degrees of freedom of k, so that forward, adjoint and tangent solves for the same permeability share one factorization
+	def key(self, kvec):
+		return arrayKey(kvec)
+
+class sharedStructures():
+	# mesh dependent data which all forward problems on the same mesh and Dirichlet boundary can share (see meshRegistry):
+	# attributes are filled in by the forward problem class that creates the entry, multigrid hierarchies and operator caches are added on demand
+	def __init__(self):
+		self.multigrids = {}
+		self.operatorCaches = {}
+
+	def multigridFor(self, tol, build): # shared multigrid hierarchy for the given solver tolerance
+		if tol not in self.multigrids:
+			self.multigrids[tol] = build()
+		return self.multigrids[tol]
+
+	def operatorCacheFor(self, key, maxsize): # shared cache of factorized operators A(k) for one solver configuration key
+		if maxsize <= 0:
+			return kappaOperatorCache(maxsize) # caching switched off for this instance
+		if key not in self.operatorCaches:
+			self.operatorCaches[key] = kappaOperatorCache(maxsize)
+		cache = self.operatorCaches[key]
+		cache.maxsize = max(cache.maxsize, maxsize)
+		return cache
+
+# mesh dependent data is shared through these bounded caches. Their keys contain the boundary specification, i.e. the identity of a callable 
+# boundary_D_boolean, so every fresh lambda makes a new entry: the least recently used ones are dropped (forward problems holding them keep theirs alive)
+_sharedCaches = []
+def sharedCache(maxsize): # new bounded cache for mesh dependent data, which clearMeshRegistry empties together with the registry
+	cache = lruCache(maxsize=maxsize)
+	_sharedCaches.append(cache)
+	return cache
+
+_dirichletBoundaryCache = sharedCache(32)
+_meshRegistry = sharedCache(16)
+
+def meshRegistry(key, build): # returns the sharedStructures stored under key; on first use, build(shared) fills in a new entry
+	def create():
+		shared = sharedStructures()
+		build(shared)
+		return shared
+	return _meshRegistry.get(key, create)
+
+def clearMeshRegistry(): # frees all shared meshes, operators and boundary data (which are not used by existing forward problems)
+	for cache in _sharedCaches:
+		cache.invalidate()
+
+class observationOperator():
+	# pointwise observation of P1 functions in obspos = [[x1,x2,...], [y1,y2,...]] as a sparse (numObs, numDofs) interpolation matrix O, built once:
+	# G(u) = O p is one sparse matvec on the FEM solution p, and the columns of O^T are the point sources dirac_{x_i} of the adjoint problems
+	def __init__(self, assembler, obspos):
+		self.points = np.stack((np.asarray(obspos[0], dtype=np.float64).flatten(), np.asarray(obspos[1], dtype=np.float64).flatten()), axis=1)
+		self.O = assembler.pointEvaluation(self.points)
+		self.OT = self.O.T.tocsr()
+		self.numObs = self.points.shape[0]
+
+	def matches(self, obspos): # True if this operator observes in obspos
+		pts = np.stack((np.asarray(obspos[0], dtype=np.float64).flatten(), np.asarray(obspos[1], dtype=np.float64).flatten()), axis=1)
+		return pts.shape == self.points.shape and np.array_equal(pts, self.points)
+
+	def apply(self, vec): # observations O vec of a dof vector (or of every column of a dof matrix)
+		return self.O.dot(vec)
+
+	def adjoint(self, weights): # adjoint source O^T weights = sum_i w_i*dirac_{x_i} as load vector
+		return self.OT.dot(np.asarray(weights, dtype=np.float64))
+
+	def sources(self): # dense (numDofs, numObs) block of all point sources dirac_{x_i}
+		return self.OT.toarray()